@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""
+程序目录下的文件路径
+日志、决策缓存、结果日志、指标和批量报告都放在程序所在目录
+"""
+
+import os
+import sys
+
+
+def app_file(name):
+    """程序所在目录下的文件（PyInstaller 单文件模式下是 exe 所在目录）"""
+    if getattr(sys, 'frozen', False):
+        base = os.path.dirname(sys.executable)
+    else:
+        base = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base, name)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+异步日志
+热路径只把日志记录放进队列（logging.handlers.QueueHandler），
+后台线程负责格式化、写控制台和滚动日志文件；
+带 storm 键的记录（例如 "同一规则处理了同一种弹窗"）短时间内重复出现时只输出第一条，
+其余合并成一行汇总
+"""
+
+import sys
+import time
+import queue
+import logging
+import threading
+import logging.handlers
+
+LOG_FORMAT = '[%(asctime)s] %(message)s'
+DATE_FORMAT = '%H:%M:%S'
+
+# 同一 storm 键的记录间隔小于 STORM_WINDOW 秒视为同一次风暴；
+# 风暴持续时每 STORM_REPORT 秒输出一次汇总，结束后再输出最后一次
+STORM_WINDOW = 2.0
+STORM_REPORT = 10.0
+
+# 滚动日志文件：单个文件最大字节数和保留的旧文件数
+MAX_BYTES = 1024 * 1024
+BACKUP_COUNT = 3
+
+# 共用模块的 logger（工作线程、控制命令、批量打开、决策缓存中的异常和警告），setup 时和处理程序的 logger 接到同一个输出
+LIBRARY_LOGGERS = ('dialog_workers', 'control_api', 'batch_open', 'decision_cache')
+
+
+class StormAggregator:
+    """合并 storm 键相同的记录（只在写入线程中使用）"""
+
+    def __init__(self, window=STORM_WINDOW, report_interval=STORM_REPORT):
+        self.window = window
+        self.report_interval = report_interval
+        # key -> [第一条记录, 最近一次出现的时间, 上次汇总的时间, 未输出的次数, 总次数]
+        self.storms = {}
+
+    def accept(self, record):
+        """返回 True 表示这条记录需要输出"""
+        key = getattr(record, 'storm', None)
+        if key is None:
+            return True
+        storm = self.storms.get(key)
+        if storm is None:
+            self.storms[key] = [record, record.created, record.created, 0, 1]
+            return True
+        storm[1] = record.created
+        storm[3] += 1
+        storm[4] += 1
+        return False
+
+    def due(self, now, flush=False):
+        """到期（风暴结束或到了汇总间隔）的汇总记录"""
+        result = []
+        for key, storm in list(self.storms.items()):
+            first, last, reported, pending, total = storm
+            ended = flush or now - last >= self.window
+            if pending and (ended or now - reported >= self.report_interval):
+                result.append(self._summary(first, last, pending, total))
+                storm[2] = now
+                storm[3] = 0
+            if ended:
+                del self.storms[key]
+        return result
+
+    @staticmethod
+    def _summary(first, last, pending, total):
+        record = logging.makeLogRecord({
+            'name': first.name, 'levelno': first.levelno, 'levelname': first.levelname,
+            'msg': "  ↳ 同类记录又出现 %d 次（共 %d 次，%.1f 秒内）: %s",
+            'args': (pending, total, last - first.created, first.getMessage()),
+        })
+        record.created = last
+        record.msecs = (last - int(last)) * 1000
+        return record
+
+
+class _EnqueueHandler(logging.handlers.QueueHandler):
+    """只把记录放进队列，消息格式化也留给写入线程（参数都是不可变值）"""
+
+    def prepare(self, record):
+        return record
+
+
+class LogWriter(threading.Thread):
+    """后台写入线程：从队列取出记录，合并风暴后交给实际的 handler"""
+
+    def __init__(self, records, handlers, aggregator=None, tick=0.5):
+        super().__init__(name='log-writer', daemon=True)
+        self.records = records
+        self.handlers = handlers
+        self.aggregator = aggregator or StormAggregator()
+        self.tick = tick
+
+    def run(self):
+        while True:
+            try:
+                record = self.records.get(timeout=self.tick)
+            except queue.Empty:
+                record = False
+            if record is None:
+                break
+            if record and self.aggregator.accept(record):
+                self._emit(record)
+            for summary in self.aggregator.due(time.time()):
+                self._emit(summary)
+        for summary in self.aggregator.due(time.time(), flush=True):
+            self._emit(summary)
+        for handler in self.handlers:
+            handler.flush()
+
+    def _emit(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self):
+        """写完队列中剩余的记录后退出"""
+        self.records.put(None)
+        self.join()
+
+
+def setup(logger, level=logging.INFO, log_file=None, stream=None, console=True):
+    """
+    给 logger 配置异步输出：控制台（stream，默认 stdout；console 为 False 时不输出）和可选的滚动日志文件
+    LIBRARY_LOGGERS 中的 logger 也写到这里（否则它们的记录落到 logging 的 lastResort，只输出到 stderr）
+    返回 LogWriter（程序退出前调用 stop() 写完剩余日志）
+    """
+    formatter = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
+    handlers = [logging.StreamHandler(stream or sys.stdout)] if console else []
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    writer = LogWriter(records, handlers)
+    writer.start()
+
+    enqueue = _EnqueueHandler(records)
+    for target in [logger] + [logging.getLogger(name) for name in LIBRARY_LOGGERS]:
+        for handler in list(target.handlers):
+            target.removeHandler(handler)
+        target.addHandler(enqueue)
+        target.setLevel(level)
+        target.propagate = False
+    return writer
+
+
+def get_logger(name):
+    """处理程序的 logger；setup 之前的记录被丢弃（基准等场景不产生输出）"""
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+    return logger
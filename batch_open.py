@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+批量打开文件
+依次打开目录或列表中的 .cdr / .ps / .prn 文件，和弹窗处理程序配合：
+文件打开完成、并且处理程序没有待处理的弹窗时立即打开下一个文件（不再每个文件固定等待），
+每个文件记录耗时和结果，超时的文件放弃并继续下一个；打开前先用 preflight 跳过文件头无效或被截断的文件
+  - CorelOpener:     通过 COM（CorelDRAW.Application.OpenDocument）打开，需要 pywin32
+  - ShellOpener:     用关联程序打开（os.startfile），以弹窗处理完、界面安静下来作为完成
+  - FakeCorelOpener: 在 window_backend.FakeDesktop 上模拟 CorelDRAW 打开文件时弹出的对话框（基准用）
+"""
+
+import os
+import csv
+import time
+import queue
+import logging
+import threading
+
+import preflight
+
+# 默认打开的文件类型
+DEFAULT_PATTERNS = ('.cdr', '.ps', '.prn')
+
+# 单个文件的超时（秒），超时后放弃并继续下一个
+DEFAULT_TIMEOUT = 120.0
+
+# 文件打开完成后，处理程序连续空闲这么久才算"没有弹窗"（弹窗可能在打开完成的瞬间才出现）
+DEFAULT_SETTLE = 0.05
+
+# 检查完成状态的间隔（秒）
+POLL_INTERVAL = 0.005
+
+# 结果
+OK = 'ok'                 # 打开完成，没有弹窗
+POPUPS = 'popups'         # 打开完成，处理了弹窗
+ERROR = 'error'           # 打开失败（打开器抛出异常）
+TIMEOUT = 'timeout'       # 超时放弃
+SKIPPED = 'skipped'       # 预检发现 CorelDRAW 打不开，没有打开
+
+# 这些预检结论说明文件本身打不开，记入结果日志，以后的运行直接跳过
+BAD_VERDICTS = frozenset((preflight.INVALID, preflight.CORRUPT))
+
+logger = logging.getLogger(__name__)
+
+
+def collect_files(paths, patterns=DEFAULT_PATTERNS, recursive=True):
+    """把目录和文件列表展开成按名称排序的文件列表（列表文件 .txt 每行一个路径）"""
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, dirs, files in os.walk(path):
+                found += [os.path.join(root, f) for f in files if f.lower().endswith(patterns)]
+                if not recursive:
+                    break
+            result += sorted(found)
+        elif path.lower().endswith('.txt'):
+            with open(path, encoding='utf-8') as f:
+                result += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        else:
+            result.append(path)
+    return result
+
+
+class Opener:
+    """
+    打开器接口（open 和 close 总在同一个打开线程中调用）
+    open(path) 阻塞到文件打开完成（CorelDRAW 有弹窗时会一直阻塞到弹窗被处理），失败时抛出异常；
+    返回 False 表示无法判断是否完成（只能等界面安静下来）
+    cancel() 在超时时尽量中止正在进行的打开（在其它线程中调用）
+    close() 在打开线程退出前释放资源
+    """
+
+    def open(self, path):
+        raise NotImplementedError
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class CorelOpener(Opener):
+    """
+    通过 COM 自动化打开；OpenDocument 在弹窗处理完、文件打开后才返回，
+    随后在同一线程中关闭文档（COM 对象只能在创建它的线程中使用），避免文档越积越多
+    整个批量只在一个打开线程中初始化一次 COM、连接一次 CorelDRAW，线程退出时释放
+    """
+
+    def __init__(self, prog_id='CorelDRAW.Application', close_after=True):
+        self.prog_id = prog_id
+        self.close_after = close_after
+        self._local = threading.local()
+
+    def _app(self):
+        # 每个线程单独初始化 COM，连接到正在运行的 CorelDRAW
+        app = getattr(self._local, 'app', None)
+        if app is None:
+            import pythoncom
+            import win32com.client
+            pythoncom.CoInitialize()
+            app = self._local.app = win32com.client.Dispatch(self.prog_id)
+        return app
+
+    def open(self, path):
+        document = self._app().OpenDocument(os.path.abspath(path))
+        if self.close_after:
+            try:
+                document.Close()
+            except Exception as e:
+                logger.warning("关闭文档失败 %s: %s", path, e)
+        return True
+
+    def close(self):
+        if getattr(self._local, 'app', None) is None:
+            return
+        import pythoncom
+        self._local.app = None
+        pythoncom.CoUninitialize()
+
+
+class ShellOpener(Opener):
+    """用关联程序打开：无法知道何时完成，由驱动等待处理程序空闲 min_wait 秒"""
+
+    def open(self, path):
+        os.startfile(os.path.abspath(path))
+        return False
+
+
+class HandlerSignal:
+    """
+    处理程序的 "弹窗已处理完 / 没有待处理弹窗" 信号
+    watcher（DialogWatcher）的重试队列和 workers（DialogWorkers）正在处理的对话框都为空时视为空闲；
+    开始一个文件时已经存在的对话框（例如之前的文件留下、规则无法处理的）不计入
+    """
+
+    def __init__(self, watcher, workers):
+        self.watcher = watcher
+        self.workers = workers
+
+    def outstanding(self):
+        return self.watcher.pending_dialogs() | self.workers.active()
+
+    def handled(self):
+        return self.workers.handled_count
+
+
+class FileResult:
+    """一个文件的处理结果"""
+
+    __slots__ = ('path', 'outcome', 'seconds', 'popups', 'error')
+
+    def __init__(self, path, outcome, seconds, popups=0, error=''):
+        self.path = path
+        self.outcome = outcome
+        self.seconds = seconds
+        self.popups = popups
+        self.error = error
+
+    def row(self):
+        return [self.path, self.outcome, f"{self.seconds:.3f}", self.popups, self.error]
+
+
+class BatchDriver:
+    """
+    依次打开文件
+    所有文件都在同一个常驻的打开线程中调用 opener.open（COM 套间、CorelDRAW 连接只建立一次），
+    等它返回并且处理程序连续空闲 settle 秒后开始下一个；
+    超过 timeout 秒调用 opener.cancel() 放弃这个文件，并等被放弃的调用返回后才打开下一个文件
+    （不在它还阻塞在 CorelDRAW 中时发出新的调用）；再等 timeout 秒仍未返回就停止批量打开
+    """
+
+    def __init__(self, opener, signal, timeout=DEFAULT_TIMEOUT, settle=DEFAULT_SETTLE,
+                 min_wait=1.0, on_result=None, journal=None):
+        self.opener = opener
+        self.journal = journal
+        self.signal = signal
+        self.timeout = timeout
+        self.settle = settle
+        self.min_wait = min_wait
+        self.on_result = on_result
+        self.results = []
+        self.stopped = False
+        # 打开器卡住（被放弃的调用一直没有返回），批量打开已停止
+        self.stuck = False
+        self._requests = queue.SimpleQueue()
+        self._thread = None
+
+    def stop(self):
+        """处理完当前文件后停止"""
+        self.stopped = True
+
+    def run(self, files):
+        """打开所有文件，返回 [FileResult, ...]"""
+        try:
+            for path in files:
+                if self.stopped:
+                    break
+                if self.journal is not None:
+                    self.journal.begin_file(path)
+                try:
+                    result = self.open_one(path)
+                finally:
+                    if self.journal is not None:
+                        self.journal.end_file()
+                self.results.append(result)
+                self.record(result)
+                if self.on_result is not None:
+                    self.on_result(result)
+        finally:
+            self.close()
+        return self.results
+
+    def close(self):
+        """让打开线程在完成手上的调用后退出"""
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread = None
+
+    def _open_thread(self):
+        try:
+            while True:
+                request = self._requests.get()
+                if request is None:
+                    return
+                path, state, done = request
+                try:
+                    state['done'] = self.opener.open(path)
+                except Exception as e:
+                    state['error'] = f"{type(e).__name__}: {e}"
+                done.set()
+        finally:
+            self.opener.close()
+
+    def _submit(self, path):
+        """交给打开线程，返回 (结果 dict, 完成事件)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._open_thread, name='batch-open', daemon=True)
+            self._thread.start()
+        state = {}
+        done = threading.Event()
+        self._requests.put((path, state, done))
+        return state, done
+
+    def _wait_abandoned(self, path, done):
+        """等被放弃的打开返回；超过 timeout 秒仍未返回（或被要求停止）时停止批量打开"""
+        deadline = time.perf_counter() + self.timeout
+        while not done.wait(POLL_INTERVAL):
+            if self.stopped or time.perf_counter() >= deadline:
+                logger.warning("打开 %s 超时后一直没有返回，停止批量打开", path)
+                self.stuck = True
+                self.stopped = True
+                return
+
+    def record(self, result, bad=False):
+        """把结果记入结果日志（bad 的文件下次运行时跳过）"""
+        if self.journal is not None:
+            self.journal.record_file(result.path, result.outcome, result.seconds, result.popups, result.error, bad)
+
+    def open_one(self, path):
+        signal = self.signal
+        existing = signal.outstanding()
+        handled = signal.handled()
+
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        state, done = self._submit(path)
+        quiet_since = None
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                self.opener.cancel()
+                self._wait_abandoned(path, done)
+                return FileResult(path, TIMEOUT, now - start, signal.handled() - handled,
+                                  f"超过 {self.timeout:g} 秒")
+            if done.is_set():
+                if 'error' in state:
+                    return FileResult(path, ERROR, now - start, signal.handled() - handled, state['error'])
+                # 打开器无法判断完成时至少等 min_wait 秒
+                ready = state.get('done', True) is not False or now - start >= self.min_wait
+                if ready and not (signal.outstanding() - existing):
+                    if quiet_since is None:
+                        quiet_since = now
+                    if now - quiet_since >= self.settle:
+                        break
+                else:
+                    quiet_since = None
+            time.sleep(POLL_INTERVAL)
+
+        popups = signal.handled() - handled
+        return FileResult(path, POPUPS if popups else OK, time.perf_counter() - start, popups)
+
+
+# --opener 可选的打开器
+OPENERS = {
+    'com': CorelOpener,
+    'shell': ShellOpener,
+}
+
+
+def start_batch(files, opener, signal, log, on_done, timeout=DEFAULT_TIMEOUT, report=None, check=True,
+                journal=None, retry_bad=False):
+    """
+    在后台线程中依次打开文件：每个文件的结果写日志，结束后写报告并调用 on_done()，返回 BatchDriver
+    check 为 True 时先用 preflight 并行检查所有文件，打不开的文件记为 skipped，不再打开；
+    journal（outcome_journal.OutcomeJournal）记录每个文件的结果，之前打不开的文件直接跳过（retry_bad 时重新打开）
+    """
+    def on_result(r):
+        extra = f", 弹窗 {r.popups} 个" if r.popups else ''
+        error = f" ({r.error})" if r.error else ''
+        log(f"[{len(driver.results)}/{len(files)}] {r.outcome} {r.seconds:.1f}s{extra}: {r.path}{error}")
+
+    driver = BatchDriver(opener, signal, timeout, on_result=on_result, journal=journal)
+
+    def skip(path, reason):
+        result = FileResult(path, SKIPPED, 0.0, error=reason)
+        driver.results.append(result)
+        on_result(result)
+        return result
+
+    def run():
+        try:
+            to_open = files
+            if journal is not None and not retry_bad:
+                to_open = []
+                for path in files:
+                    reason = journal.known_bad(path)
+                    if reason is None:
+                        to_open.append(path)
+                    else:
+                        skip(path, f"之前打不开 ({reason})")
+                if len(to_open) < len(files):
+                    log(f"结果日志: 跳过 {len(files) - len(to_open)} 个之前打不开的文件")
+            if check:
+                checked = to_open
+                to_open = []
+                for verdict in preflight.scan(checked):
+                    if verdict.ok:
+                        to_open.append(verdict.path)
+                    else:
+                        # 无法读取（文件被占用、还在复制、共享暂时不可用）不算打不开，下次运行重新检查
+                        driver.record(skip(verdict.path, f"{verdict.status}: {verdict.reason}"),
+                                      bad=verdict.status in BAD_VERDICTS)
+                if len(to_open) < len(checked):
+                    log(f"预检: 跳过 {len(checked) - len(to_open)} 个打不开的文件")
+            driver.run(to_open)
+        except Exception as e:
+            log(f"批量打开出错: {type(e).__name__}: {e}")
+        finally:
+            if driver.stuck:
+                log("打开器超时后一直没有返回，已停止批量打开（需要检查 CorelDRAW 是否卡死）")
+            summary = summarize(driver.results)
+            outcomes = ', '.join(f"{k} {v}" for k, v in sorted(summary['outcomes'].items()))
+            log(f"批量打开结束: {summary['files']} 个文件 ({outcomes}), 共 {summary['seconds']:.0f} 秒, "
+                f"每小时 {summary['files_per_hour']:.0f} 个")
+            if report:
+                write_report(driver.results, report)
+                log(f"报告: {report}")
+            on_done()
+
+    threading.Thread(target=run, name='batch', daemon=True).start()
+    return driver
+
+
+def summarize(results):
+    """各结果的文件数、总耗时和每小时文件数"""
+    counts = {}
+    for r in results:
+        counts[r.outcome] = counts.get(r.outcome, 0) + 1
+    total = sum(r.seconds for r in results)
+    return {
+        'files': len(results),
+        'outcomes': counts,
+        'seconds': total,
+        'files_per_hour': len(results) / total * 3600 if total else 0.0,
+        'popups': sum(r.popups for r in results),
+    }
+
+
+def write_report(results, path):
+    """每个文件一行的 CSV 报告"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'outcome', 'seconds', 'popups', 'error'])
+        for r in results:
+            writer.writerow(r.row())
+
+
+class FakeCorelOpener(Opener):
+    """
+    在 FakeDesktop 上模拟 CorelDRAW 打开文件：
+    plan(path) 返回 (加载耗时, [(标题, 子控件), ...])，对话框依次弹出，
+    每个对话框关闭之前 open 一直阻塞（和真实的模态对话框一样）；加载耗时为 None 表示卡死
+    """
+
+    def __init__(self, desktop, plan, owner=0, pid=1, unblock_delay=0.0):
+        self.desktop = desktop
+        self.plan = plan
+        self.owner = owner
+        self.pid = pid
+        # 卡死的打开被取消后还要过这么久才返回（模拟 COM 调用迟迟不返回）
+        self.unblock_delay = unblock_delay
+        self._cancelled = threading.Event()
+        self.opened = []
+        # 调用 open 的线程、同时进行的 open 的最大数量
+        self.threads = set()
+        self.max_active = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        with self._lock:
+            self.threads.add(threading.get_ident())
+            self._active += 1
+            self.max_active = max(self.max_active, self._active)
+        try:
+            self._open(path)
+        finally:
+            with self._lock:
+                self._active -= 1
+        return True
+
+    def _open(self, path):
+        self._cancelled.clear()
+        load, popups = self.plan(path)
+        for title, children in popups:
+            hwnd = self.desktop.create_window(title, pid=self.pid, children=children, owner=self.owner)
+            while self.desktop.is_window(hwnd):
+                if self._cancelled.wait(POLL_INTERVAL):
+                    self.desktop.destroy_window(hwnd)
+                    raise RuntimeError("已取消")
+        if load is None:
+            self._cancelled.wait()
+            time.sleep(self.unblock_delay)
+            raise RuntimeError("已取消")
+        time.sleep(load)
+        self.opened.append(path)
+
+    def cancel(self):
+        self._cancelled.set()
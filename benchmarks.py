@@ -0,0 +1,2096 @@
+#!/usr/bin/env python3
+"""
+性能基准
+全部基于 window_backend.FakeDesktop 等替身，可以在 Linux 下运行
+用法: python benchmarks.py [基准名 ...]     （不带参数运行全部）
+"""
+
+import io
+import os
+import ctypes
+import sys
+import mmap
+import time
+import random
+import logging
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+
+import button_labels
+import click_actions
+import decision_cache
+import dialog_snapshot
+import hook_protocol
+import popup_rules
+import process_scope
+import text_providers
+import win32_api
+import window_backend
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """注册基准函数"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def percentile(values, p):
+    """简单百分位数（values 非空）"""
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def report(name, **fields):
+    parts = ', '.join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}"
+                      for k, v in fields.items())
+    print(f"  {name}: {parts}")
+
+
+def _swap_handler(handler, backend, **overrides):
+    """让处理程序模块在替身后端上运行（依赖后端的全局对象一并替换），返回原值"""
+    values = {
+        'backend': backend,
+        'decisions': None,
+        'scope': process_scope.ProcessScope(backend),
+        'actions': click_actions.ActionExecutor(backend),
+        'unmatched': decision_cache.UnmatchedCache(),
+        'uia': None,
+    }
+    values.update(overrides)
+    saved = {name: getattr(handler, name) for name in values}
+    for name, value in values.items():
+        setattr(handler, name, value)
+    return saved
+
+
+def _restore_handler(handler, saved):
+    for name, value in saved.items():
+        setattr(handler, name, value)
+
+
+# ========== 检测延迟 ==========
+
+def _run_detect(event_driven, count=20, seed=1):
+    desktop = window_backend.FakeDesktop(events=event_driven)
+    watcher = window_backend.DialogWatcher(
+        desktop, lambda h: desktop.get_class_name(h) == '#32770'
+    )
+    rng = random.Random(seed)
+
+    def producer():
+        for i in range(count):
+            time.sleep(rng.uniform(0.05, 0.3))
+            desktop.create_window(f"CorelDRAW 弹窗 {i}", children=[('Button', '确定')])
+
+    sweeps = 0
+    latencies = []
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    while len(latencies) < count:
+        dialogs = watcher.next_dialogs()
+        sweeps += watcher.swept
+        now = time.perf_counter()
+        for hwnd in dialogs:
+            win = desktop.windows.get(hwnd)
+            if win is None:
+                continue
+            latencies.append(now - win.created_at)
+            desktop.destroy_window(hwnd)
+    watcher.close()
+    thread.join()
+    return latencies, sweeps
+
+
+@benchmark
+def detect_latency():
+    """弹窗出现到被检测到的延迟：0.5 秒轮询 vs 窗口事件驱动"""
+    for label, event_driven in (('polling', False), ('event', True)):
+        latencies, sweeps = _run_detect(event_driven)
+        report(label,
+               p50_ms=percentile(latencies, 50) * 1000,
+               max_ms=max(latencies) * 1000,
+               full_sweeps=sweeps)
+
+
+# ========== 规则引擎 ==========
+
+def legacy_standard_rules(content, title):
+    """标准版原 handle_popup 的 if 链（按顺序返回成立的规则）"""
+    matched = []
+    if ('无效' in content and '轮廓' in content) or '轮廓 ID' in content or '轮廓ID' in content:
+        matched.append('outline_id')
+    if '关于' in content and '重试' in content and '忽略' in content:
+        matched.append('about_retry_ignore')
+    if '无法打开文件' in content or '无效标头' in content:
+        matched.append('invalid_header')
+    if '文件被损坏' in content or ('文件' in content and '损坏' in content):
+        matched.append('file_corrupted')
+    if 'PS/PRN' in content or 'PS/PRN' in title:
+        matched.append('import_ps_prn')
+    return matched
+
+
+def legacy_hook_rules(all_text, title, buttons):
+    """Hook 版原 handle_popup 的 if 链（按顺序返回成立的规则）"""
+    matched = []
+    if '无效' in all_text and '轮廓' in all_text:
+        matched.append('outline_id')
+    if len(buttons) == 1 and ('OK' in buttons[0] or '确定' in buttons[0]):
+        matched.append('single_ok')
+    if '无法打开' in all_text or '无效标头' in all_text or '无效的' in all_text:
+        matched.append('invalid_header')
+    if '损坏' in all_text:
+        matched.append('file_corrupted')
+    if 'PS/PRN' in all_text:
+        matched.append('import_ps_prn')
+    if any('忽略' in b for b in buttons):
+        if any(kw in all_text for kw in ['错误', '无效', '失败', '问题', 'error', 'invalid']):
+            matched.append('error_ignore')
+    if 'CorelDRAW' in title:
+        matched.append('coreldraw_generic')
+    return matched
+
+
+RULE_FRAGMENTS = [
+    '无效的轮廓 ID', '轮廓ID', '无效', '轮廓', '关于', '重试', '忽略(&I)', '无法打开文件',
+    '无效标头', '文件被损坏', '文件', '损坏', 'PS/PRN', '错误', '失败', '问题', 'error',
+    'invalid', 'CorelDRAW', '选择工具', '形状', '缩放', '图层', '对象属性', '曲线(&C)',
+]
+BUTTON_LABELS = ['确定', 'OK', '取消', '忽略', '忽略(&I)', '重试', '关于', '是(&Y)', '曲线']
+TITLES = ['CorelDRAW X7', 'CorelDRAW', '导入 PS/PRN', '警告', 'Corel']
+
+
+def _rule_cases(count, seed=2):
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        texts = rng.sample(RULE_FRAGMENTS, rng.randint(1, 8))
+        buttons = rng.sample(BUTTON_LABELS, rng.randint(0, 3))
+        title = rng.choice(TITLES)
+        # 模拟 Hook 文本：整个进程的绘制历史
+        noise = rng.sample(RULE_FRAGMENTS[-6:], 3) * rng.randint(0, 10)
+        cases.append((' '.join(texts + buttons + noise), title, buttons))
+    return cases
+
+
+def _time_per_call(func, cases, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for case in cases:
+            func(*case)
+        elapsed = (time.perf_counter() - start) / len(cases)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@benchmark
+def rule_engine():
+    """编译后的规则引擎 vs 原 if 链（先校验两者判定完全一致）"""
+    cases = _rule_cases(5000)
+    standard = popup_rules.compile_rules(popup_rules.STANDARD_RULES)
+    hook = popup_rules.compile_rules(popup_rules.HOOK_RULES)
+
+    for text, title, buttons in cases:
+        assert [r.name for r in standard.match(text, title)] == legacy_standard_rules(text, title)
+        assert [r.name for r in hook.match(text, title, buttons)] == legacy_hook_rules(text, title, buttons)
+    report('parity', cases=len(cases), mismatches=0)
+
+    report('standard',
+           legacy_us=_time_per_call(lambda t, ti, b: legacy_standard_rules(t, ti), cases) * 1e6,
+           engine_us=_time_per_call(lambda t, ti, b: standard.match(t, ti), cases) * 1e6)
+    report('hook',
+           legacy_us=_time_per_call(legacy_hook_rules, cases) * 1e6,
+           engine_us=_time_per_call(hook.match, cases) * 1e6)
+
+    # 规则数量增长时的开销：每条规则 3 个独立关键词
+    for extra in (10, 50):
+        rules = list(popup_rules.HOOK_RULES) + [
+            popup_rules.Rule(f'extra_{i}', f'extra {i}', targets=('OK',),
+                             text=[(f'kw{i}a', f'kw{i}b'), f'kw{i}c'])
+            for i in range(extra)
+        ]
+        engine = popup_rules.compile_rules(rules)
+
+        def chain(text, title, buttons, extra=extra):
+            legacy_hook_rules(text, title, buttons)
+            for i in range(extra):
+                if (f'kw{i}a' in text and f'kw{i}b' in text) or f'kw{i}c' in text:
+                    pass
+
+        report(f'+{extra} rules',
+               legacy_us=_time_per_call(chain, cases) * 1e6,
+               engine_us=_time_per_call(engine.match, cases) * 1e6)
+
+
+# ========== 按钮查找 ==========
+
+def _legacy_find_button(buttons, targets):
+    """改造前标准版的按钮查找：按钮 × 目标逐对比较，每次都 lower() / replace('&')，包含即算命中"""
+    for control in buttons:
+        text = control.text
+        for btn_text in targets:
+            if (btn_text.lower() in text.lower() or
+                    btn_text.replace('&', '') in text or
+                    text.replace('&', '') in btn_text or
+                    btn_text == text):
+                return control
+    return None
+
+
+# (按钮文本, 改造前规则的 targets, 语义动作, 应该点击的按钮)
+BUTTON_CASES = [
+    (('关于(&A)', '重试(&R)', '忽略(&I)'), ('忽略(&I)', '忽略', 'Ignore'), (button_labels.IGNORE,), '忽略(&I)'),
+    (('&Abort', '&Retry', '&Ignore'), ('忽略(&I)', '忽略', 'Ignore'), (button_labels.IGNORE,), '&Ignore'),
+    (('全部忽略(&A)', '忽略(&I)'), ('忽略(&I)', '忽略', 'Ignore'), (button_labels.IGNORE,), '忽略(&I)'),
+    (('Look Up', 'OK'), ('OK', '确定'), (button_labels.OK,), 'OK'),
+    (('ＯＫ',), ('OK', '确定'), (button_labels.OK,), 'ＯＫ'),
+    (('確定', '取消'), ('OK', '确定'), (button_labels.OK,), '確定'),
+    (('不是', '是(&Y)'), ('OK', '确定', '是', '是(&Y)', 'Yes'), (button_labels.OK, button_labels.YES), '是(&Y)'),
+    (('文本', '曲线', '确定', '取消'), ('曲线',), (button_labels.CURVES,), '曲线'),
+    (('Text', 'Curves', 'OK', 'Cancel'), ('曲线',), (button_labels.CURVES,), 'Curves'),
+]
+
+
+def _button_records(labels):
+    return [dialog_snapshot.ControlRecord(1000 + i, 'Button', 1000 + i, text, 0)
+            for i, text in enumerate(labels)]
+
+
+@benchmark
+def button_lookup():
+    """按钮查找：按钮 × 目标的包含匹配 vs 规范化索引 + 多语言标签表（先统计两者点错/找不到的按钮）"""
+    legacy_wrong = index_wrong = 0
+    for labels, targets, actions, expected in BUTTON_CASES:
+        buttons = _button_records(labels)
+        legacy = _legacy_find_button(buttons, targets)
+        found = button_labels.ButtonIndex(buttons).find(actions)
+        legacy_wrong += (legacy.text if legacy else None) != expected
+        index_wrong += (found.text if found else None) != expected
+    report('accuracy', cases=len(BUTTON_CASES), legacy_wrong=legacy_wrong, index_wrong=index_wrong)
+
+    # 典型对话框（4 个按钮）查找一条规则的 targets；索引每个快照建立一次
+    buttons = _button_records(('关于(&A)', '重试(&R)', '忽略(&I)', '取消'))
+    legacy_targets = ('OK', '确定', '是', '是(&Y)', 'Yes', '忽略(&I)')
+    actions = (button_labels.OK, button_labels.YES, button_labels.IGNORE)
+    cases = [()] * 2000
+    report('per_dialog',
+           legacy_us=_time_per_call(lambda: _legacy_find_button(buttons, legacy_targets), cases) * 1e6,
+           index_build_find_us=_time_per_call(
+               lambda: button_labels.ButtonIndex(buttons).find(actions), cases) * 1e6)
+    index = button_labels.ButtonIndex(buttons)
+    report('repeat_lookup',
+           legacy_us=_time_per_call(lambda: _legacy_find_button(buttons, legacy_targets), cases) * 1e6,
+           index_find_us=_time_per_call(lambda: index.find(actions), cases) * 1e6)
+    return index_wrong == 0
+
+
+# ========== Hook 共享内存协议 ==========
+
+def _ring_payload(writer_id, n):
+    return f"w{writer_id}:{n}:" + '文' * (n % 61)
+
+
+def _ring_writer_proc(path, size, lock, writer_id, count):
+    with open(path, 'r+b') as f:
+        buf = mmap.mmap(f.fileno(), size)
+        writer = hook_protocol.RingWriter(buf, lock)
+        for n in range(count):
+            writer.write(_ring_payload(writer_id, n))
+        buf.close()
+
+
+@benchmark
+def hook_ring():
+    """共享内存环形缓冲区压力测试（mmap 文件 + 多个写入进程 + 并发读取）"""
+    writers, per_writer = 2, 100000
+    # 小容量环，保证会频繁回绕和覆盖
+    capacity = 64 * 1024
+    size = hook_protocol.total_size(capacity)
+
+    fd, path = tempfile.mkstemp(suffix='.shm')
+    os.write(fd, b'\0' * size)
+    os.close(fd)
+    try:
+        with open(path, 'r+b') as f:
+            buf = mmap.mmap(f.fileno(), size)
+        hook_protocol.init_header(buf, capacity)
+
+        lock = multiprocessing.Lock()
+        procs = [multiprocessing.Process(target=_ring_writer_proc,
+                                         args=(path, size, lock, w, per_writer))
+                 for w in range(writers)]
+        reader = hook_protocol.RingReader()
+        received = corrupt = 0
+        last_seq = 0
+        last_n = {}
+
+        start = time.perf_counter()
+        for p in procs:
+            p.start()
+        while True:
+            alive = any(p.is_alive() for p in procs)
+            for rec in reader.read(buf):
+                # 序号必须单调递增，同一写入方的记录按写入顺序出现
+                writer_id, n, pad = rec.text.split(':', 2)
+                n = int(n)
+                if pad != '文' * (n % 61) or n <= last_n.get(writer_id, -1) or rec.seq <= last_seq:
+                    corrupt += 1
+                last_seq = rec.seq
+                last_n[writer_id] = n
+                received += 1
+            if not alive:
+                break
+        elapsed = time.perf_counter() - start
+        for p in procs:
+            p.join()
+
+        total = writers * per_writer
+        report('ring', records=total, received=received, lost=reader.lost,
+               corrupt=corrupt, records_per_s=total / elapsed)
+        buf.close()
+    finally:
+        os.unlink(path)
+    # 每条记录要么读到、要么计入 lost（包括开始读取之前就被覆盖的）
+    return corrupt == 0 and received + reader.lost == total
+
+
+LEGACY_MAX_TEXT_LENGTH = 4096
+LEGACY_MAX_TEXT_COUNT = 100
+LEGACY_SIZE = 4 + 8 + LEGACY_MAX_TEXT_COUNT * LEGACY_MAX_TEXT_LENGTH * 2 + 4
+
+
+def _legacy_read_texts(fileno):
+    """原 SharedMemory.read_texts：每次映射视图，每个槽位分配 8KB 缓冲并整体拷贝"""
+    import ctypes
+    import struct
+    buf = mmap.mmap(fileno, LEGACY_SIZE)              # MapViewOfFile
+    try:
+        anchor = ctypes.c_char.from_buffer(buf)
+        base = ctypes.addressof(anchor)
+        text_count = min(struct.unpack_from('I', buf, 0)[0], LEGACY_MAX_TEXT_COUNT)
+        texts = []
+        offset = 4 + 8
+        for i in range(text_count):
+            text_buf = (ctypes.c_char * (LEGACY_MAX_TEXT_LENGTH * 2))()
+            ctypes.memmove(text_buf, base + offset, LEGACY_MAX_TEXT_LENGTH * 2)
+            raw = bytes(text_buf).decode('utf-16-le')
+            text = raw[:raw.find('\0')]
+            if text and len(text) > 1:
+                texts.append(text)
+            offset += LEGACY_MAX_TEXT_LENGTH * 2
+        del anchor
+        return texts
+    finally:
+        buf.close()                                   # UnmapViewOfFile
+
+
+@benchmark
+def hook_read():
+    """共享内存读取开销：原实现（每次映射 + 槽位整体拷贝）vs 常驻映射 + memoryview 解码"""
+    texts = ['确定', '无效的轮廓 ID', '是否忽略此错误并继续？', 'CorelDRAW X7 - [图形1]']
+    with tempfile.TemporaryFile() as legacy_file, tempfile.TemporaryFile() as ring_file:
+        legacy_file.truncate(LEGACY_SIZE)
+        ring_size = hook_protocol.total_size()
+        ring_file.truncate(ring_size)
+        legacy = mmap.mmap(legacy_file.fileno(), LEGACY_SIZE)
+        ring = mmap.mmap(ring_file.fileno(), ring_size)
+
+        for filled in (1, 10, 100):
+            # 旧布局：textCount + 固定 4096 wchar 的槽位
+            legacy[:LEGACY_SIZE] = bytes(LEGACY_SIZE)
+            legacy[0:4] = filled.to_bytes(4, 'little')
+            for i in range(filled):
+                data = (texts[i % len(texts)] + '\0').encode('utf-16-le')
+                at = 12 + i * LEGACY_MAX_TEXT_LENGTH * 2
+                legacy[at:at + len(data)] = data
+
+            # v2 环形缓冲区
+            hook_protocol.init_header(ring)
+            writer = hook_protocol.RingWriter(ring)
+            for i in range(filled):
+                writer.write(texts[i % len(texts)])
+
+            rounds = 200
+            start = time.perf_counter()
+            for _ in range(rounds):
+                old = _legacy_read_texts(legacy_file.fileno())
+            legacy_us = (time.perf_counter() - start) / rounds * 1e6
+
+            with memoryview(ring) as view:
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    new = [r.text for r in hook_protocol.RingReader().read(view)]
+                ring_us = (time.perf_counter() - start) / rounds * 1e6
+
+                # 常驻读取方在没有新记录时的开销
+                reader = hook_protocol.RingReader()
+                reader.read(view)
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    reader.read(view)
+                idle_us = (time.perf_counter() - start) / rounds * 1e6
+
+            assert old == new
+            report(f'{filled} slots', legacy_us=legacy_us, mapped_us=ring_us, no_new_us=idle_us)
+
+        legacy.close()
+        ring.close()
+
+
+@benchmark
+def hook_index():
+    """按窗口归属 Hook 文本：整个进程的绘制历史 vs 只取弹窗自己的文本"""
+    main_window, dialog = 0x1000, 0x2000
+    noise = ['选择工具', '形状工具', '缩放', '对象属性', '图层 1', '页面 1', '100%', 'X: 12.5 mm']
+    dialog_texts = ['无效的轮廓 ID', '是否忽略此错误并继续？', '忽略(&I)', '重试(&R)', '关于(&A)']
+    rule_engine = popup_rules.compile_rules(popup_rules.HOOK_RULES)
+
+    for history in (100, 1000, 10000):
+        buf = bytearray(hook_protocol.total_size())
+        hook_protocol.init_header(buf)
+        writer = hook_protocol.RingWriter(buf)
+        for i in range(history):
+            writer.write(noise[i % len(noise)] + str(i), main_window + 4, main_window)
+        for text in dialog_texts:
+            writer.write(text, dialog + 8, dialog)
+
+        # 原方式：读取全部新文本并合并
+        records = hook_protocol.RingReader().read(buf)
+        index = hook_protocol.WindowTextIndex()
+        index.add(records)
+
+        def merged():
+            text = ' '.join(r.text for r in records if len(r.text) > 1)
+            rule_engine.match(text, 'CorelDRAW', ['忽略(&I)'])
+            return text
+
+        def own():
+            text = ' '.join(t for t in index.get(dialog) if len(t) > 1)
+            rule_engine.match(text, 'CorelDRAW', ['忽略(&I)'])
+            return text
+
+        all_text, own_text = merged(), own()
+        merged_us = _time_per_call(merged, [()] * 20) * 1e6
+        own_us = _time_per_call(own, [()] * 20) * 1e6
+
+        report(f'history={history}', merged_chars=len(all_text), merged_us=merged_us,
+               own_chars=len(own_text), own_us=own_us)
+
+
+# ========== 每个弹窗的跨进程调用次数 ==========
+
+SNAPSHOT_DIALOGS = [
+    ('CorelDRAW X7', [('Static', '无效的轮廓 ID'), ('Button', '关于'),
+                      ('Button', '重试(&R)'), ('Button', '忽略(&I)')]),
+    ('CorelDRAW X7', [('Static', '无法打开文件 a.cdr'), ('Static', '无效标头'), ('Button', 'OK')]),
+    ('导入 PS/PRN', [('Static', '导入 PS/PRN 文件'), ('Button', '文本', window_backend.BS_AUTORADIOBUTTON),
+                     ('Button', '曲线', window_backend.BS_AUTORADIOBUTTON), ('Button', '确定'), ('Button', '取消')]),
+]
+
+
+def _snapshot_desktop(counting):
+    """在（可选 CountingBackend 包装的）FakeDesktop 上创建测试弹窗"""
+    desktop = window_backend.FakeDesktop(events=False)
+    dialogs = []
+    for title, children in SNAPSHOT_DIALOGS:
+        hwnd = desktop.create_window(title)
+        for i, spec in enumerate(children):
+            desktop.add_child(hwnd, spec[0], spec[1], 1000 + i, *spec[2:])
+        dialogs.append((hwnd, title))
+    return window_backend.CountingBackend(desktop) if counting else desktop, dialogs
+
+
+def _legacy_standard_popup(backend, hwnd, title, engine):
+    """改造前标准版 handle_popup 的窗口调用序列（每个消费方各自遍历一次子窗口）"""
+    def content():
+        texts = []
+        for child in backend.enum_child_windows(hwnd):
+            class_name = backend.get_class_name(child)
+            text = backend.get_control_text(child)
+            if text:
+                texts.append(text)
+            if class_name == 'Static' or 'STATIC' in class_name.upper():
+                static_text = backend.get_control_text(child)
+                if static_text and static_text not in texts:
+                    texts.append(static_text)
+        return ' '.join(texts)
+
+    def find(targets):
+        for child in backend.enum_child_windows(hwnd):
+            text = backend.get_control_text(child)
+            class_name = backend.get_class_name(child)
+            if 'Button' in class_name or 'BUTTON' in class_name.upper():
+                for target in targets:
+                    if (target.lower() in text.lower() or target.replace('&', '') in text or
+                            text.replace('&', '') in target or target == text):
+                        return child
+        return None
+
+    text = content()
+    for child in backend.enum_child_windows(hwnd):
+        backend.get_control_text(child)
+        backend.get_class_name(child)
+        backend.get_control_id(child)
+    for rule in engine.match(text, title):
+        if rule.action == popup_rules.ACTION_RADIO_OK:
+            radio = find(rule.radio[:1])
+            if radio:
+                backend.click(radio)
+        button = find(rule.targets)
+        if button:
+            backend.click(button)
+            return True
+    return False
+
+
+@benchmark
+def snapshot_calls():
+    """每个弹窗的窗口 API 调用次数：各消费方分别遍历子窗口 vs 单次遍历快照"""
+    import cdr_popup_handler as handler
+
+    engine = popup_rules.compile_rules(popup_rules.STANDARD_RULES)
+    counting, dialogs = _snapshot_desktop(True)
+    legacy = []
+    for hwnd, title in dialogs:
+        counting.reset()
+        _legacy_standard_popup(counting, hwnd, title, engine)
+        legacy.append(counting.total())
+
+    # 点击后确认状态的调用单独统计，不计入读取调用
+    verify = ('is_window', 'is_window_visible', 'is_window_enabled', 'is_checked')
+    counting, dialogs = _snapshot_desktop(True)
+    saved = _swap_handler(handler, counting)
+    current = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for hwnd, title in dialogs:
+                counting.reset()
+                handler.handle_popup(hwnd, title)
+                checks = sum(counting.calls[name] for name in verify)
+                current.append((counting.total() - checks, checks))
+    finally:
+        _restore_handler(handler, saved)
+
+    for (title, children), before, (after, checks) in zip(SNAPSHOT_DIALOGS, legacy, current):
+        report(title, controls=len(children), legacy_calls=before, snapshot_calls=after,
+               verify_calls=checks)
+
+    desktop, dialogs = _snapshot_desktop(False)
+    hwnd = dialogs[0][0]
+    snapshot_us = _time_per_call(lambda: dialog_snapshot.take_snapshot(desktop, hwnd), [()] * 200) * 1e6
+    report('take_snapshot', us=snapshot_us)
+
+
+# ========== 目标程序无响应时的扫描节奏 ==========
+
+def _run_busy_loop(handler, budget, count=8, busy=3, hang=0.5, seed=3):
+    """
+    按标准版主循环处理弹窗，桌面上同时有 busy 个 WM_GETTEXT 要 hang 秒才响应的对话框
+    返回 (正常弹窗的处理延迟列表, 相邻两轮循环的最大间隔)
+    """
+    desktop = window_backend.FakeDesktop(events=True)
+    saved = _swap_handler(handler, desktop, text_budget=budget)
+    watcher = window_backend.DialogWatcher(desktop, handler.is_coreldraw_dialog,
+                                           safety_interval=1.0, budget=budget)
+    for _ in range(busy):
+        hwnd = desktop.create_window('CorelDRAW X7', children=[('Static', '正在导入 big.cdr'),
+                                                               ('msctls_progress32', '')])
+        desktop.set_delay(hwnd, hang)
+    rng = random.Random(seed)
+
+    def producer():
+        for i in range(count):
+            time.sleep(rng.uniform(0.05, 0.3))
+            desktop.create_window('CorelDRAW X7', children=[('Static', '无效标头'), ('Button', 'OK')])
+
+    latencies = []
+    gaps = []
+    thread = threading.Thread(target=producer, daemon=True)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread.start()
+            last = time.perf_counter()
+            while len(latencies) < count:
+                dialogs = watcher.next_dialogs()
+                for hwnd in dialogs:
+                    win = desktop.windows.get(hwnd)
+                    if win is None:
+                        continue
+                    title = handler.get_window_text(hwnd)
+                    snapshot = handler.get_dialog_snapshot(hwnd, title)
+                    if not snapshot.complete:
+                        watcher.defer(hwnd, slow=True)
+                        continue
+                    if handler.handle_popup(hwnd, title, snapshot):
+                        latencies.append(time.perf_counter() - win.created_at)
+                    else:
+                        watcher.defer(hwnd)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+            thread.join()
+    finally:
+        watcher.close()
+        _restore_handler(handler, saved)
+    return latencies, max(gaps)
+
+
+@benchmark
+def busy_window():
+    """有对话框长时间不响应 WM_GETTEXT 时，其它弹窗的处理延迟：阻塞读取 vs 超时 + 预算"""
+    import cdr_popup_handler as handler
+
+    for label, budget in (
+        ('blocking', window_backend.TextBudget(call_timeout=60.0, scan_budget=float('inf'))),
+        ('budgeted', window_backend.TextBudget(call_timeout=0.1, scan_budget=0.25)),
+    ):
+        latencies, max_gap = _run_busy_loop(handler, budget)
+        report(label, p50_ms=percentile(latencies, 50) * 1000, p95_ms=percentile(latencies, 95) * 1000,
+               max_loop_gap_ms=max_gap * 1000, scans=budget.scans, timeouts=budget.timeouts,
+               budget_hits=budget.budget_hits)
+
+
+# ========== 对话框发现范围 ==========
+
+class _AuditDesktop(window_backend.FakeDesktop):
+    """记录向非 CorelDRAW 进程的窗口读取控件文本的次数"""
+
+    def __init__(self):
+        super().__init__(events=False)
+        self.foreign_reads = 0
+
+    def get_control_text(self, hwnd, timeout=None):
+        if self.processes.get(self.get_window_pid(hwnd)) != 'CorelDRW.exe':
+            self.foreign_reads += 1
+        return super().get_control_text(hwnd, timeout)
+
+
+def _scope_desktop(apps):
+    """CorelDRAW 主窗口 + 2 个 CorelDRAW 对话框，以及 apps 个各带 2 个对话框的其它程序"""
+    desktop = _AuditDesktop()
+    main_window = desktop.create_window('CorelDRAW 2023 - a.cdr', class_name='CorelDRAW 25.0')
+    desktop.create_window('CorelDRAW', owner=main_window,
+                          children=[('Static', '无效的轮廓 ID'), ('Button', '忽略(&I)')])
+    desktop.create_window('导入 PS/PRN', owner=main_window,
+                          children=[('Static', '导入 PS/PRN 文件'), ('Button', '曲线'), ('Button', '确定')])
+    for i in range(apps):
+        pid = 100 + i
+        desktop.processes[pid] = f'app{i}.exe'
+        app_window = desktop.create_window(f'应用 {i}', class_name='AppWindow', pid=pid)
+        for j in range(2):
+            desktop.create_window(f'提示 {j}', pid=pid, owner=app_window,
+                                  children=[('Static', '文件已保存'), ('Button', '确定'), ('Button', '取消')])
+    return desktop
+
+
+def _legacy_is_coreldraw_dialog(backend, hwnd):
+    """改造前标准版的判断：标题不含 Corel 的 #32770 都要读取全部控件文本"""
+    if backend.get_class_name(hwnd) != '#32770':
+        return False
+    title = backend.get_window_text(hwnd)
+    if 'CorelDRAW' in title or 'Corel' in title:
+        return True
+    texts = []
+    for child in backend.enum_child_windows(hwnd):
+        class_name = backend.get_class_name(child)
+        text = backend.get_control_text(child)
+        if text:
+            texts.append(text)
+        if class_name == 'Static' or 'STATIC' in class_name.upper():
+            backend.get_control_text(child)
+    content = ' '.join(texts)
+    return any(kw in content for kw in ['轮廓', 'CorelDRAW', '文件', 'PS/PRN', '损坏'])
+
+
+@benchmark
+def discovery_scope():
+    """一次全量扫描的开销：读取所有 #32770 的内容 vs 只看 CorelDRAW 进程的对话框"""
+    import cdr_popup_handler as handler
+
+    for apps in (10, 50, 200):
+        desktop = _scope_desktop(apps)
+        counting = window_backend.CountingBackend(desktop)
+        found = [h for h in counting.enum_windows()
+                 if counting.is_window_visible(h) and _legacy_is_coreldraw_dialog(counting, h)]
+        report(f'apps={apps} legacy', found=len(found), calls=counting.total(),
+               foreign_text_reads=desktop.foreign_reads)
+
+        desktop = _scope_desktop(apps)
+        counting = window_backend.CountingBackend(desktop)
+        saved = _swap_handler(handler, counting)
+        try:
+            handler.scope.refresh()
+            counting.reset()
+            found = [h for h in counting.enum_windows()
+                     if counting.is_window_visible(h) and handler.is_coreldraw_dialog(h)]
+        finally:
+            _restore_handler(handler, saved)
+        report(f'apps={apps} scoped', found=len(found), calls=counting.total(),
+               text_calls=counting.calls['get_control_text'], foreign_text_reads=desktop.foreign_reads)
+
+
+# ========== 进程监视与注入 ==========
+
+def _process_timeline(table):
+    """(时间, 动作)：CorelDRAW 启动、退出、以相同 PID 重启、退出、以新 PID 启动"""
+    state = {}
+
+    def start():
+        state['pid'] = table.start('CorelDRW.exe')
+
+    def restart_same_pid():
+        table.start('CorelDRW.exe', pid=state['pid'])
+
+    def stop():
+        table.exit(state['pid'])
+
+    return [(0.2, start), (30.0, stop), (31.0, restart_same_pid), (60.0, stop), (62.0, start)]
+
+
+@benchmark
+def process_inject():
+    """CorelDRAW 重启（含 PID 复用）后的重新注入：只按 PID 记录 vs 按 (pid, 启动时间) 跟踪"""
+    import process_watch
+
+    step, end = 0.5, 70.0
+
+    # 改造前：每轮循环都找一遍 CorelDRAW 进程，注入过的 PID 永远不再注入
+    table = process_watch.FakeProcessTable()
+    timeline = _process_timeline(table)
+    injected_pids = set()
+    injections = enumerations = 0
+    now = 0.0
+    while now < end:
+        while timeline and timeline[0][0] <= now:
+            timeline.pop(0)[1]()
+        enumerations += 1
+        for pid in list(table.processes):
+            if pid not in injected_pids:
+                injected_pids.add(pid)
+                injections += 1
+        now += step
+    report('pid_set', injections=injections, expected=3, enumerations=enumerations,
+           stale_pids=len(injected_pids - set(table.processes)))
+
+    # 进程监视：每 2 秒对比一次进程快照；启动 main_window 秒后才显示主窗口，之前不注入
+    main_window = 3.0
+    table = process_watch.FakeProcessTable()
+    timeline = _process_timeline(table)
+    started_at = {}
+    delays = []
+
+    def key_of(pid):
+        info = table.processes[pid]
+        return info.pid, info.start_time
+
+    def inject(pid):
+        delays.append(now - started_at[key_of(pid)])
+        return True
+
+    watcher = process_watch.ProcessWatcher(table, ['CorelDRW.exe'], interval=2.0)
+    tracker = process_watch.InjectionTracker(
+        watcher, inject, ready=lambda pid: now - started_at[key_of(pid)] >= main_window)
+    now = 0.0
+    while now < end:
+        while timeline and timeline[0][0] <= now:
+            timeline.pop(0)[1]()
+            for info in table.processes.values():
+                started_at.setdefault((info.pid, info.start_time), now)
+        tracker.update(now)
+        now += step
+    early = sum(1 for d in delays if d < main_window)
+    report('pid_start_time', injections=len(delays), expected=3, snapshots=table.snapshots,
+           max_delay_s=max(delays), before_main_window=early, tracked=len(tracker.injected))
+
+    # 取不到启动时间（OpenProcess 失败）的进程不按 (pid, 0) 跟踪，能取到后才注入
+    table = process_watch.FakeProcessTable()
+    table.processes[2000] = process_watch.ProcessInfo(2000, None, 'CorelDRW.exe')
+    attempts = []
+    tracker = process_watch.InjectionTracker(
+        process_watch.ProcessWatcher(table, ['CorelDRW.exe'], interval=2.0), lambda pid: attempts.append(pid) or True)
+    tracker.update(0.0)
+    skipped = not attempts and not tracker.watcher.processes
+    table.processes[2000] = process_watch.ProcessInfo(2000, 7, 'CorelDRW.exe')
+    tracker.update(2.0)
+    report('no_start_time', skipped_while_unknown=skipped, injected_after=attempts == [2000])
+    return len(delays) == 3 and not early and skipped and attempts == [2000]
+
+
+# ========== 自适应扫描与内容稳定检测 ==========
+
+def _run_scheduler(mode, idle=3.0, count=10, apps=100, seed=4):
+    """
+    按 Hook 版主循环处理一批弹窗（文本在弹窗出现后 10~80 毫秒才出现）
+    mode: fixed（0.5 秒轮询 + 固定等待 0.3 秒）/ adaptive（自适应轮询 + 稳定检测）/ event（事件驱动 + 稳定检测）
+    返回 (空闲时 CPU 占用, 处理延迟列表, 点错按钮的次数)
+    """
+    import cdr_popup_handler_hook as handler
+
+    desktop = window_backend.FakeDesktop(events=(mode == 'event'))
+    for i in range(apps):
+        desktop.processes[200 + i] = f'app{i}.exe'
+        desktop.create_window(f'应用 {i}', class_name='AppWindow', pid=200 + i)
+    saved = _swap_handler(handler, desktop)
+    if mode == 'fixed':
+        watcher = window_backend.DialogWatcher(desktop, handler.is_coreldraw_dialog,
+                                               poll_interval=0.5, burst_interval=0.5)
+    else:
+        watcher = window_backend.DialogWatcher(desktop, handler.is_coreldraw_dialog)
+    stability = window_backend.StabilityTracker()
+    rng = random.Random(seed)
+    created = {}
+
+    def producer():
+        time.sleep(idle)
+        for i in range(count):
+            time.sleep(rng.uniform(0.05, 0.2))
+            hwnd = desktop.create_window('CorelDRAW X7', children=[
+                ('Static', ''), ('Button', '确定'), ('Button', '忽略(&I)')])
+            created[hwnd] = time.perf_counter()
+            threading.Timer(rng.uniform(0.01, 0.08), desktop.set_text,
+                            (desktop.enum_child_windows(hwnd)[0], '无效的轮廓 ID')).start()
+
+    latencies = []
+    handled = set()
+    thread = threading.Thread(target=producer, daemon=True)
+    cpu_start = time.process_time()
+    idle_cpu = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread.start()
+            while len(latencies) < count:
+                dialogs = watcher.next_dialogs()
+                if idle_cpu is None and created:
+                    idle_cpu = (time.process_time() - cpu_start) / idle
+                for hwnd in dialogs:
+                    if hwnd in handled or hwnd not in created:
+                        continue
+                    if mode == 'fixed':
+                        time.sleep(0.3)
+                    info = handler.get_dialog_info(hwnd)
+                    if mode != 'fixed':
+                        wait = stability.observe(hwnd, (info.signature, 0))
+                        if wait:
+                            watcher.defer(hwnd, delay=wait)
+                            continue
+                    if handler.handle_popup(hwnd, info, []):
+                        handled.add(hwnd)
+                        latencies.append(time.perf_counter() - created[hwnd])
+                    else:
+                        watcher.defer(hwnd)
+            thread.join()
+    finally:
+        watcher.close()
+        _restore_handler(handler, saved)
+    wrong = sum(1 for _, label in desktop.clicks if label != '忽略(&I)')
+    return idle_cpu or 0.0, latencies, wrong
+
+
+@benchmark
+def scheduler():
+    """空闲 CPU 与检测到点击的延迟：固定轮询 + 固定等待 vs 自适应轮询/事件驱动 + 内容稳定检测"""
+    for mode in ('fixed', 'adaptive', 'event'):
+        idle_cpu, latencies, wrong = _run_scheduler(mode)
+        report(mode, idle_cpu_pct=idle_cpu * 100, p50_ms=percentile(latencies, 50) * 1000,
+               p95_ms=percentile(latencies, 95) * 1000, wrong_clicks=wrong)
+
+
+# ========== 点击动作 ==========
+
+def _ps_prn_dialog(desktop, rng, drop_clicks=0):
+    """PS/PRN 导入对话框：点击确定后 5~30 毫秒对话框才关闭"""
+    radio = window_backend.BS_AUTORADIOBUTTON
+    hwnd = desktop.create_window('导入 PS/PRN', children=[
+        ('Static', '导入 PS/PRN 文件', 1), ('Button', '文本', 2, radio),
+        ('Button', '曲线', 3, radio), ('Button', '确定', 1), ('Button', '取消', 2)])
+    ok = desktop.enum_child_windows(hwnd)[3]
+    desktop.windows[ok].drop_clicks = drop_clicks
+    desktop.windows[ok].on_click = lambda d, h: threading.Timer(
+        rng.uniform(0.005, 0.03), d.destroy_window, (hwnd,)).start()
+    return hwnd
+
+
+def _legacy_ps_prn(backend, hwnd, histograms):
+    """改造前标准版的 PS/PRN 处理：点击后固定等待"""
+    children = backend.enum_child_windows(hwnd)
+    start = time.perf_counter()
+    backend.click(children[2])
+    time.sleep(0.1)
+    time.sleep(0.3)
+    histograms['radio'].record(time.perf_counter() - start)
+    start = time.perf_counter()
+    time.sleep(0.2)
+    backend.click(children[3])
+    time.sleep(0.1)
+    histograms['button'].record(time.perf_counter() - start)
+
+
+@benchmark
+def click_latency():
+    """每个动作的耗时直方图：固定 sleep vs 确认状态的有界轮询（含 BM_CLICK 失效时的备用点击）"""
+    import collections
+    import dialog_workers
+    import cdr_popup_handler as handler
+
+    rule = next(r for r in popup_rules.STANDARD_RULES if r.name == 'import_ps_prn')
+    rng = random.Random(5)
+
+    desktop = window_backend.FakeDesktop(events=False)
+    legacy = collections.defaultdict(click_actions.LatencyHistogram)
+    for _ in range(5):
+        _legacy_ps_prn(desktop, _ps_prn_dialog(desktop, rng), legacy)
+    for name, h in sorted(legacy.items()):
+        report(f'fixed_sleep {name}', p50_ms=h.percentile(50), p95_ms=h.percentile(95), hist=h.format())
+
+    for label, drop in (('verified', 0), ('verified_bm_click_lost', 1)):
+        desktop = window_backend.FakeDesktop(events=False)
+        saved = _swap_handler(handler, desktop)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(20):
+                    hwnd = _ps_prn_dialog(desktop, rng, drop)
+                    snapshot = handler.get_dialog_snapshot(hwnd)
+                    handler.execute_rule(snapshot, rule)
+            actions = handler.actions
+        finally:
+            _restore_handler(handler, saved)
+        for name, h in sorted(actions.histograms.items()):
+            report(f'{label} {name}', p50_ms=h.percentile(50), p95_ms=h.percentile(95), hist=h.format())
+        report(f'{label} fallbacks', **dict(actions.fallbacks), failures=sum(actions.failures.values()))
+
+    # 点击后始终不关闭的对话框（两条规则都匹配）：发出点击消息后不再点击其它按钮，重复提交也不再处理
+    desktop = window_backend.FakeDesktop(events=False)
+    saved = _swap_handler(handler, desktop, actions=click_actions.ActionExecutor(desktop, timeout=0.02))
+    watcher = window_backend.DialogWatcher(desktop, handler.is_coreldraw_dialog)
+    workers = dialog_workers.DialogWorkers(lambda h: handler.process_dialog(watcher, h), handler.dialog_lane)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            hwnd = desktop.create_window('CorelDRAW X7', children=[
+                ('Static', '无效的轮廓 ID，无法打开文件'), ('Button', '确定', 1), ('Button', '忽略', 5)])
+            for child in desktop.enum_child_windows(hwnd):
+                desktop.windows[child].on_click = lambda d, h: None
+            for _ in range(3):
+                workers.submit([hwnd])
+                workers.wait_idle(5.0)
+    finally:
+        workers.close()
+        _restore_handler(handler, saved)
+    buttons = sorted({text for _, text in desktop.clicks})
+    report('unconfirmed', click_messages=len(desktop.clicks), buttons=','.join(buttons),
+           handled=workers.handled_count, duplicates=workers.duplicates)
+    return len(desktop.clicks) == len(click_actions.CLICK_METHODS) and len(buttons) == 1
+
+
+# ========== 日志量与点击延迟 ==========
+
+class _SlowConsole(io.StringIO):
+    """模拟 Windows 控制台：每次写入耗时 0.3 毫秒"""
+
+    def write(self, text):
+        time.sleep(0.0003)
+        return super().write(text)
+
+
+def _run_logged_popups(handler, mode, count=200):
+    """
+    按标准版流程处理 count 个同样的 "无效的轮廓 ID" 弹窗，返回 (检测到点击的延迟列表, 控制台输出行数)
+    mode: sync_debug（改造前：每行同步写控制台）/ async_debug / async_info
+    """
+    import logging
+    import async_log
+    import replay as replay_module
+
+    console = _SlowConsole()
+    logger = handler.logger
+    saved_logger = (list(logger.handlers), logger.level, logger.propagate)
+    writer = None
+    if mode == 'sync_debug':
+        sync = logging.StreamHandler(console)
+        sync.setFormatter(logging.Formatter(async_log.LOG_FORMAT, async_log.DATE_FORMAT))
+        logger.handlers = [sync]
+        logger.setLevel(logging.DEBUG)
+    else:
+        level = logging.DEBUG if mode == 'async_debug' else logging.INFO
+        writer = async_log.setup(logger, level, stream=console)
+
+    desktop = replay_module.ReplayDesktop()
+    saved = _swap_handler(handler, desktop)
+    watcher = window_backend.DialogWatcher(desktop, handler.is_coreldraw_dialog)
+    latencies = []
+    try:
+        for i in range(count):
+            hwnd = desktop.create_window('CorelDRAW X7', children=[
+                ('Static', '无效的轮廓 ID', 65535), ('Button', '关于(&A)', 3),
+                ('Button', '重试(&R)', 4), ('Button', '忽略(&I)', 5)])
+            created = desktop.windows[hwnd].created_at
+            handler.process_dialog(watcher, hwnd)
+            latencies.append(desktop.closed_by[hwnd][0] - created)
+    finally:
+        watcher.close()
+        _restore_handler(handler, saved)
+        if writer is not None:
+            writer.stop()
+        logger.handlers, level, logger.propagate = saved_logger
+        logger.setLevel(level)
+    return latencies, console.getvalue().count('\n')
+
+
+@benchmark
+def log_volume():
+    """日志量对检测到点击延迟的影响：同步写控制台 vs 异步队列（DEBUG / INFO + 风暴合并）"""
+    import cdr_popup_handler as handler
+
+    for mode in ('sync_debug', 'async_debug', 'async_info'):
+        latencies, lines = _run_logged_popups(handler, mode)
+        report(mode, p50_ms=percentile(latencies, 50) * 1000, p99_ms=percentile(latencies, 99) * 1000,
+               console_lines=lines)
+
+
+# ========== 语料回放 ==========
+
+@benchmark
+def replay():
+    """按时间戳回放记录的弹窗语料，走两个处理程序的完整流程，并与基线对比"""
+    import replay as replay_module
+    return replay_module.run_suite() == 0
+
+
+# ========== 并发处理 ==========
+
+def _run_concurrent(handler, max_workers, popups, delay=0.005, processes=4):
+    """
+    同时弹出 popups 个对话框（分属 processes 个 CorelDRAW 进程，每次读取控件文本耗时 delay 秒），
+    交给 max_workers 个工作线程处理；每个 hwnd 提交两次（模拟兜底扫描重复发现）
+    返回 (每秒处理的弹窗数, 已处理数, 重复点击数)
+    """
+    import dialog_workers
+    import replay as replay_module
+
+    desktop = replay_module.ReplayDesktop()
+    for pid in range(1, processes + 1):
+        desktop.processes[pid] = 'CorelDRW.exe'
+    saved = _swap_handler(handler, desktop,
+                          text_budget=window_backend.TextBudget(call_timeout=0.1, scan_budget=0.25))
+    watcher = window_backend.DialogWatcher(desktop, handler.is_coreldraw_dialog)
+    workers = dialog_workers.DialogWorkers(lambda hwnd: handler.process_dialog(watcher, hwnd),
+                                           handler.dialog_lane, max_workers)
+    hwnds = []
+    for i in range(popups):
+        hwnd = desktop.create_window('CorelDRAW X7', pid=1 + i % processes, children=[
+            ('Static', '无效的轮廓 ID', 65535), ('Button', '关于(&A)', 3),
+            ('Button', '重试(&R)', 4), ('Button', '忽略(&I)', 5)])
+        desktop.set_delay(hwnd, delay)
+        hwnds.append(hwnd)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            workers.submit(hwnds)
+            workers.submit(hwnds)
+            workers.wait_idle(30.0)
+    finally:
+        workers.close()
+        watcher.close()
+        _restore_handler(handler, saved)
+    closed = [desktop.closed_by[h][0] for h in hwnds if h in desktop.closed_by]
+    elapsed = max(closed, default=start) - start
+    return len(closed) / max(elapsed, 1e-6), len(closed), replay_module.duplicate_clicks(desktop)
+
+
+@benchmark
+def concurrent_workers():
+    """同时出现多个弹窗时的吞吐量：逐个处理（1 个工作线程） vs 线程池；任何对话框都不能被点击两次"""
+    import cdr_popup_handler as handler
+
+    ok = True
+    for popups in (1, 4, 16):
+        serial = None
+        for max_workers in (1, 4, 8):
+            rate, handled, duplicates = _run_concurrent(handler, max_workers, popups)
+            serial = serial or rate
+            ok = ok and handled == popups and duplicates == 0
+            report(f"popups={popups} workers={max_workers}", popups_per_sec=rate,
+                   speedup=rate / serial, handled=handled, duplicate_clicks=duplicates)
+    return ok
+
+
+# ========== 控制接口 ==========
+
+def _control_loop(handler, watcher, workers, control):
+    """标准版 main 的检测循环（暂停、退出由控制接口决定）"""
+    while not control.stopping:
+        dialogs = watcher.next_dialogs()
+        if watcher.swept:
+            workers.prune(handler.backend.is_window)
+            handler.unmatched.prune(handler.backend.is_window)
+        if not control.paused:
+            workers.submit(dialogs)
+
+
+def _wait_closed(desktop, hwnd, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while hwnd not in desktop.closed_by and time.monotonic() < deadline:
+        time.sleep(0.002)
+    return desktop.closed_by.get(hwnd)
+
+
+@benchmark
+def control_api():
+    """控制接口（Unix 套接字）：命令往返延迟、暂停/恢复、dry-run，以及处理过程中热更新规则（不漏处理、不用旧规则）"""
+    import control_api as control_module
+    import dialog_workers
+    import cdr_popup_handler as handler
+    import replay as replay_module
+
+    desktop = replay_module.ReplayDesktop()
+    saved = _swap_handler(handler, desktop, rule_engine=handler.rule_engine,
+                          decisions=decision_cache.DecisionCache(handler.rule_engine.version))
+    watcher = window_backend.DialogWatcher(desktop, handler.is_coreldraw_dialog,
+                                           budget=handler.text_budget)
+    workers = dialog_workers.DialogWorkers(lambda hwnd: handler.process_dialog(watcher, hwnd),
+                                           handler.dialog_lane)
+    control = control_module.HandlerControl(handler, workers, handler.take_snapshot, handler.dry_run,
+                                            wake=watcher.request_sweep)
+    tmp = tempfile.mkdtemp()
+    server = control_module.ControlServer(os.path.join(tmp, 'control.sock'), control.commands())
+    loop = threading.Thread(target=_control_loop, args=(handler, watcher, workers, control), daemon=True)
+
+    def header_dialog():
+        return desktop.create_window('CorelDRAW X7', children=[
+            ('Static', '无法打开文件 a.cdr'), ('Static', '无效标头'), ('Button', 'OK')])
+
+    ok = True
+    try:
+        with control_module.ControlClient(server.address) as client:
+            loop.start()
+            for cmd in ('ping', 'stats'):
+                latencies = []
+                for _ in range(200):
+                    start = time.perf_counter()
+                    client.call(cmd)
+                    latencies.append(time.perf_counter() - start)
+                report(cmd, p50_us=percentile(latencies, 50) * 1e6, p99_us=percentile(latencies, 99) * 1e6)
+
+            # dry-run：给定控件列表 / 真实窗口，都不点击
+            spec = client.call('dry_run', title='导入 PS/PRN', controls=[
+                ['Static', '导入 PS/PRN 文件'], ['Button', '文本', 1, window_backend.BS_AUTORADIOBUTTON],
+                ['Button', '曲线', 2, window_backend.BS_AUTORADIOBUTTON], ['Button', '确定'], ['Button', '取消']])
+            client.call('pause')
+            hwnd = header_dialog()
+            live = client.call('dry_run', hwnd=hwnd)
+            time.sleep(0.3)
+            untouched = desktop.windows[hwnd].visible and hwnd not in desktop.closed_by
+            report('dry_run', spec=f"{spec['rule']}:{spec['radio']}+{spec['button']}",
+                   live=f"{live['rule']}:{live['button']}", paused_untouched=untouched)
+            ok = ok and spec['button'] == '确定' and spec['radio'] == '曲线' and live['button'] == 'OK'
+
+            # 恢复：立即全量扫描，暂停期间出现的弹窗马上处理
+            start = time.perf_counter()
+            client.call('resume')
+            closed = _wait_closed(desktop, hwnd)
+            report('resume', to_click_ms=(closed[0] - start) * 1000 if closed else -1)
+            ok = ok and untouched and closed is not None
+
+            # 弹窗持续出现时替换规则：换成同样点击 OK、但名称不同的规则集
+            rules = client.call('rules')['rules']
+            for spec in rules:
+                spec['name'] = 'v2_' + spec['name']
+            hwnds = []
+            swap_at = 20
+            for i in range(40):
+                if i == swap_at:
+                    version = client.call('load_rules', rules=rules)['version']
+                hwnds.append(header_dialog())
+                time.sleep(0.005)
+            handled = sum(_wait_closed(desktop, h) is not None for h in hwnds)
+            hits = handler.telemetry.to_dict()['counters']
+            new_hits = sum(v for k, v in hits.items() if 'rule="v2_' in k)
+            try:
+                client.call('load_rules', rules=[{'name': 'broken'}])
+                rejected = False
+            except RuntimeError:
+                rejected = client.call('stats')['rules_version'] == version
+            report('hot_swap', popups=len(hwnds), handled=handled, new_rule_hits=new_hits,
+                   invalid_rejected=rejected)
+            ok = ok and handled == len(hwnds) and new_hits >= len(hwnds) - swap_at and rejected
+
+            client.call('stop')
+            loop.join(5.0)
+            ok = ok and not loop.is_alive()
+    finally:
+        control.stopping = True
+        watcher.request_sweep()
+        loop.join(5.0)
+        server.close()
+        workers.close()
+        watcher.close()
+        _restore_handler(handler, saved)
+    return ok
+
+
+# ========== 批量打开 ==========
+
+# 改造前的批量脚本：每个文件打开后固定等待的秒数
+BATCH_FIXED_WAIT = 0.5
+
+BATCH_POPUPS = {
+    'header': ('CorelDRAW X7', [('Static', '无法打开文件'), ('Static', '无效标头'), ('Button', 'OK')]),
+    'outline': ('CorelDRAW X7', [('Static', '无效的轮廓 ID', 65535), ('Button', '关于(&A)', 3),
+                                 ('Button', '重试(&R)', 4), ('Button', '忽略(&I)', 5)]),
+}
+
+
+def _batch_plan(count, hang=(7,), seed=5):
+    """每个文件的 (加载耗时, 弹窗)：30% 一个弹窗，10% 两个弹窗，hang 中的文件卡死"""
+    rng = random.Random(seed)
+    plan = {}
+    for i in range(count):
+        roll = rng.random()
+        popups = []
+        if roll < 0.1:
+            popups = [BATCH_POPUPS['outline'], BATCH_POPUPS['header']]
+        elif roll < 0.4:
+            popups = [BATCH_POPUPS['header']]
+        plan[f'file{i:03d}.cdr'] = (None if i in hang else rng.uniform(0.02, 0.08), popups)
+    return plan
+
+
+def _run_batch(mode, count, timeout=1.0):
+    """
+    mode: fixed（改造前：每个文件固定等待 BATCH_FIXED_WAIT 秒，不管是否打开完成）
+          signal（等打开完成 + 处理程序没有待处理弹窗就开始下一个，超时跳过）
+    返回 (每个文件的结果列表, 总耗时, 上一个文件还没打开完就开始下一个的次数, 打开器)
+    卡死的文件被取消后 0.3 秒才返回（模拟阻塞在 CorelDRAW 中的 COM 调用）
+    """
+    import batch_open
+    import dialog_workers
+    import control_api as control_module
+    import cdr_popup_handler as handler
+
+    desktop = window_backend.FakeDesktop(events=True)
+    main_window = desktop.create_window('CorelDRAW X7', class_name='CorelDRAW')
+    plan = _batch_plan(count)
+    opener = batch_open.FakeCorelOpener(desktop, plan.get, owner=main_window, unblock_delay=0.3)
+    saved = _swap_handler(handler, desktop)
+    watcher = window_backend.DialogWatcher(desktop, handler.is_coreldraw_dialog, budget=handler.text_budget)
+    workers = dialog_workers.DialogWorkers(lambda hwnd: handler.process_dialog(watcher, hwnd),
+                                           handler.dialog_lane)
+    control = control_module.HandlerControl(handler, workers, handler.take_snapshot, handler.dry_run,
+                                            wake=watcher.request_sweep)
+    loop = threading.Thread(target=_control_loop, args=(handler, watcher, workers, control), daemon=True)
+    loop.start()
+    files = sorted(plan)
+    overlaps = 0
+    start = time.perf_counter()
+    try:
+        if mode == 'fixed':
+            results = []
+            previous = None
+            for path in files:
+                if previous is not None and previous.is_alive():
+                    overlaps += 1
+                    opener.cancel()
+                previous = threading.Thread(target=lambda p=path: _ignore_errors(opener.open, p), daemon=True)
+                previous.start()
+                time.sleep(BATCH_FIXED_WAIT)
+                results.append(batch_open.FileResult(path, batch_open.OK, BATCH_FIXED_WAIT))
+        else:
+            driver = batch_open.BatchDriver(opener, batch_open.HandlerSignal(watcher, workers), timeout=timeout)
+            results = driver.run(files)
+        elapsed = time.perf_counter() - start
+    finally:
+        opener.cancel()
+        control.stop()
+        loop.join(5.0)
+        workers.close()
+        watcher.close()
+        _restore_handler(handler, saved)
+    return results, elapsed, overlaps, opener
+
+
+def _ignore_errors(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        pass
+
+
+@benchmark
+def batch_open():
+    """批量打开（假 CorelDRAW + 假打开器）：每个文件固定等待 vs 等打开完成和弹窗处理完立即开始下一个"""
+    import batch_open as batch_module
+
+    results, elapsed, overlaps, opener = _run_batch('fixed', 12)
+    report('fixed_wait', files=len(results), files_per_hour=len(results) / elapsed * 3600,
+           wait_s=BATCH_FIXED_WAIT, started_before_done=overlaps, max_concurrent_opens=opener.max_active)
+
+    results, elapsed, _, opener = _run_batch('signal', 40)
+    summary = batch_module.summarize(results)
+    seconds = [r.seconds for r in results if r.outcome != batch_module.TIMEOUT]
+    outcomes = ' '.join(f"{k}:{v}" for k, v in sorted(summary['outcomes'].items()))
+    report('signal', files=len(results), files_per_hour=len(results) / elapsed * 3600,
+           p50_ms=percentile(seconds, 50) * 1000, p95_ms=percentile(seconds, 95) * 1000,
+           popups=summary['popups'], outcomes=outcomes)
+    # 所有文件在同一个打开线程中打开，超时的文件返回之前不开始下一个
+    report('opener', threads=len(opener.threads), max_concurrent_opens=opener.max_active)
+    expected_popups = sum(len(popups) for load, popups in _batch_plan(40).values() if load is not None)
+    return (summary['outcomes'].get(batch_module.TIMEOUT) == 1 and opener.max_active == 1
+            and len(opener.threads) == 1 and batch_module.ERROR not in summary['outcomes'] and summary['popups'] >= expected_popups)
+
+
+# ========== 打开前预检 ==========
+
+@benchmark
+def preflight():
+    """打开前预检：合成语料（正常 / 截断 / 垃圾数据）的分类正确率，和 1..N 个进程的每秒文件数"""
+    import preflight as preflight_module
+
+    with tempfile.TemporaryDirectory() as directory:
+        expected = preflight_module.make_corpus(directory, 1200)
+        paths = list(expected)
+
+        size_kb = sum(os.path.getsize(p) for p in paths) / len(paths) / 1024
+        report('corpus', files=len(paths), avg_kb=size_kb,
+               read_kb=(preflight_module.HEAD_SIZE + preflight_module.TAIL_SIZE) / 1024)
+
+        wrong = 0
+        counts = sorted({1, 2, 4, os.cpu_count() or 1})
+        for workers in counts:
+            start = time.perf_counter()
+            verdicts = preflight_module.scan(paths, workers)
+            elapsed = time.perf_counter() - start
+            errors = [v for v in verdicts if v.status != expected[v.path]]
+            wrong += len(errors)
+            statuses = {}
+            for v in verdicts:
+                statuses[v.status] = statuses.get(v.status, 0) + 1
+            report(f'workers_{workers}', files_per_sec=len(paths) / elapsed, wrong=len(errors),
+                   **statuses)
+        print(f"  (CPU 数: {os.cpu_count()}，进程数超过 CPU 数时只有进程启动开销)")
+    return wrong == 0
+
+
+# ========== 结果日志 ==========
+
+def _journal_events(journal, threads=4, per_thread=5000):
+    """threads 个工作线程同时记录弹窗，返回每次记录的耗时（秒）"""
+    durations = []
+
+    def worker(n):
+        local = []
+        for i in range(per_thread):
+            start = time.perf_counter()
+            journal.record_dialog(1000 + n, 'CorelDRW.exe', '无法打开文件', f'fp{n}-{i % 50}',
+                                  'invalid_header', 'cache', 'OK', 0.002)
+            local.append(time.perf_counter() - start)
+        durations.extend(local)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return durations
+
+
+@benchmark
+def outcome_journal():
+    """结果日志：热路径记录耗时、批量事务的写入吞吐量（对照：每条一个事务），已知打不开文件的查询耗时"""
+    import sqlite3
+    import outcome_journal as journal_module
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 对照：每条记录一个事务
+        conn = sqlite3.connect(os.path.join(directory, 'naive.db'))
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(journal_module.SCHEMA)
+        count = 2000
+        start = time.perf_counter()
+        for i in range(count):
+            with conn:
+                conn.execute(journal_module._INSERT_DIALOG,
+                             (time.time(), 1, 'CorelDRW.exe', None, 't', f'fp{i}', 'r', 'rules', 'OK', 0.002))
+        elapsed = time.perf_counter() - start
+        conn.close()
+        report('per_event_commit', events=count, events_per_min=count / elapsed * 60)
+
+        path = os.path.join(directory, 'outcomes.db')
+        journal = journal_module.OutcomeJournal(path)
+        start = time.perf_counter()
+        durations = _journal_events(journal)
+        journal.flush(30.0)
+        elapsed = time.perf_counter() - start
+        events_per_min = len(durations) / elapsed * 60
+        report('batched', events=len(durations), events_per_min=events_per_min, batches=journal.batches,
+               record_p50_us=percentile(durations, 50) * 1e6, record_p99_us=percentile(durations, 99) * 1e6)
+
+        # 已知打不开文件的查询：files 表 1k 行 vs 100k 行（主键 B 树，O(log n)）
+        lookups = {}
+        filled = 0
+        for rows in (1000, 100000):
+            for i in range(filled, rows):
+                journal.record_file(os.path.join(directory, f'f{i:06d}.cdr'),
+                                    'skipped' if i % 7 == 0 else 'ok', reason='corrupt', bad=i % 7 == 0)
+            journal.flush(60.0)
+            filled = rows
+            probes = [os.path.join(directory, f'f{random.randrange(rows):06d}.cdr') for _ in range(2000)]
+            start = time.perf_counter()
+            bad = sum(journal.known_bad(p) is not None for p in probes)
+            lookups[rows] = (time.perf_counter() - start) / len(probes)
+            report(f'known_bad_{rows}', lookup_us=lookups[rows] * 1e6, bad=bad, probes=len(probes))
+
+        # 重新运行（新实例打开同一个数据库）时仍然知道哪些文件打不开
+        journal.begin_file(os.path.join(directory, 'broken.cdr'))
+        journal.record_dialog(1, 'CorelDRW.exe', '无法打开文件', 'fp', 'invalid_header', 'rules', 'OK', 0.01)
+        journal.end_file()
+        journal.record_file(os.path.join(directory, 'broken.cdr'), 'popups', 0.5, 1)
+
+        # 上一个文件超时后才处理完的弹窗：归到检测到它时正在打开的文件，而不是下一个文件
+        journal.begin_file(os.path.join(directory, 'slow.cdr'))
+        journal.note_dialogs([0x2001])
+        journal.end_file()
+        journal.record_file(os.path.join(directory, 'slow.cdr'), 'timeout', 30.0, 1)
+        journal.begin_file(os.path.join(directory, 'next.cdr'))
+        journal.record_dialog(1, 'CorelDRW.exe', '文件被损坏', 'fp2', 'file_corrupted', 'rules', 'OK', 0.01,
+                              hwnd=0x2001)
+        journal.end_file()
+        journal.record_file(os.path.join(directory, 'next.cdr'), 'ok', 1.0, 0)
+
+        # 预检：文件头无效的文件记为打不开；暂时无法读取的文件（这里是不存在）下次照常检查
+        import batch_open
+        invalid = os.path.join(directory, 'empty.cdr')
+        open(invalid, 'wb').close()
+        unreadable = os.path.join(directory, 'copying.cdr')
+        done = threading.Event()
+        batch_open.start_batch([invalid, unreadable], batch_open.FakeCorelOpener(None, {}.get), None,
+                               lambda message: None, done.set, journal=journal)
+        done.wait(10.0)
+        journal.stop()
+        rerun = journal_module.OutcomeJournal(path)
+        remembered = rerun.known_bad(os.path.join(directory, 'broken.cdr'))
+        history = rerun.dialogs_for(os.path.join(directory, 'broken.cdr'))
+        late = rerun.dialogs_for(os.path.join(directory, 'slow.cdr'))
+        next_bad = rerun.known_bad(os.path.join(directory, 'next.cdr'))
+        invalid_bad = rerun.known_bad(invalid)
+        unreadable_bad = rerun.known_bad(unreadable)
+        rerun.stop()
+        report('rerun', known_bad=remembered, dialogs=len(history))
+        report('late_dialog', slow_dialogs=len(late), next_bad=next_bad)
+        report('preflight', invalid=invalid_bad, unreadable=unreadable_bad)
+    return (events_per_min >= 10000 and lookups[100000] < lookups[1000] * 5
+            and remembered is not None and len(history) == 1 and len(late) == 1 and next_bad is None
+            and invalid_bad is not None and unreadable_bad is None)
+
+
+# ========== 决策缓存 ==========
+
+class _CountingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@benchmark
+def decision_cache_files():
+    """决策缓存的保存 / 加载出错：目录不可写时不抛出异常、只警告一次、恢复后写入；格式不对的缓存文件不加载"""
+    handler = _CountingHandler()
+    logger = logging.getLogger('decision_cache')
+    logger.addHandler(handler)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            # 目录不存在：open(tmp) 失败
+            path = os.path.join(directory, 'missing', 'decisions.json')
+            cache = decision_cache.DecisionCache('v1', path)
+            cache.put('fp', {'rule': 'r', 'radio': None, 'button': 'OK'})
+            for _ in range(3):
+                cache.save()
+            failed_dirty = cache.dirty
+            warnings = len(handler.records)
+            os.mkdir(os.path.dirname(path))
+            cache.save()
+            saved = not cache.dirty and os.path.exists(path)
+            loaded = decision_cache.DecisionCache('v1', path).load()
+
+            bad = {}
+            for name, content in (('not_dict', '[1, 2]'),
+                                  ('entries_not_list', '{"format": 1, "rules_version": "v1", "entries": 5}'),
+                                  ('bad_pair', '{"format": 1, "rules_version": "v1", "entries": [["fp"]]}'),
+                                  ('bad_decision', '{"format": 1, "rules_version": "v1", "entries": [["fp", 3]]}')):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                fresh = decision_cache.DecisionCache('v1', path)
+                bad[name] = fresh.load() or bool(fresh.entries)
+    finally:
+        logger.removeHandler(handler)
+    report('save', dirty_after_failure=failed_dirty, warnings=warnings, saved_after_recovery=saved, reloaded=loaded)
+    report('load', **bad)
+    return failed_dirty and warnings == 1 and saved and loaded and not any(bad.values())
+
+
+# ========== 未匹配的对话框 ==========
+
+class _NoUnmatchedCache(decision_cache.UnmatchedCache):
+    """对照：没有未匹配缓存，每 0.5 秒完整复查一次（读取全部控件、匹配规则、写日志）"""
+
+    def seen(self, hwnd, version, rules_version):
+        return False
+
+    def record(self, hwnd, version, rules_version):
+        return self.schedule[0]
+
+
+class _LegacyWatcher(window_backend.DialogWatcher):
+    """对照：未匹配的对话框不暂缓，每次全量扫描都会重新发现它（并让扫描保持繁忙间隔）"""
+
+    def defer(self, hwnd, slow=False, delay=None, hold=False):
+        super().defer(hwnd, slow, delay)
+
+
+UNMATCHED_CHILDREN = [('Static', '正在检查打印机设置', 65535), ('Button', '详细信息(&D)', 1), ('Button', 'OK', 2)]
+
+
+def _run_unmatched(cache, watcher_class=window_backend.DialogWatcher, warmup=2.0, steady=5.0):
+    """
+    一个一直没人处理的未匹配对话框打开 warmup 秒后，再统计 steady 秒内的 CPU 时间、后端调用和规则匹配次数；
+    随后修改对话框文本（变成 "无效标头"）和替换规则，统计重新处理的延迟
+    """
+    import replay as replay_module
+    import dialog_workers
+    import control_api as control_module
+    import metrics as metrics_module
+    import cdr_popup_handler as handler
+
+    desktop = replay_module.ReplayDesktop()
+    counting = window_backend.CountingBackend(desktop)
+    main_window = desktop.create_window('CorelDRAW X7', class_name='CorelDRAW')
+    telemetry = metrics_module.Registry()
+    saved = _swap_handler(handler, counting, unmatched=cache, telemetry=telemetry,
+                          rule_engine=handler.rule_engine)
+    watcher = watcher_class(counting, handler.is_coreldraw_dialog, budget=handler.text_budget)
+    workers = dialog_workers.DialogWorkers(lambda hwnd: handler.process_dialog(watcher, hwnd), handler.dialog_lane)
+    control = control_module.HandlerControl(handler, workers, handler.take_snapshot, handler.dry_run,
+                                            wake=watcher.request_sweep)
+    loop = threading.Thread(target=_control_loop, args=(handler, watcher, workers, control), daemon=True)
+    loop.start()
+
+    def evaluations():
+        return sum(h.count for kind, name, labels, h in telemetry.samples()
+                   if name == 'rule_eval_seconds')
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            dialog = desktop.create_window('CorelDRAW X7', children=UNMATCHED_CHILDREN, owner=main_window)
+            time.sleep(warmup)
+            counting.reset()
+            evals = evaluations()
+            cpu = time.process_time()
+            time.sleep(steady)
+            result = {
+                'cpu_ms_per_s': (time.process_time() - cpu) * 1000 / steady,
+                'calls_per_s': counting.total() / steady,
+                'evals_per_s': (evaluations() - evals) / steady,
+            }
+
+            # 内容变化：文本变化事件触发立即复查
+            static = desktop.enum_child_windows(dialog)[0]
+            start = time.perf_counter()
+            desktop.set_text(static, '无法打开文件：无效标头')
+            closed = _wait_closed(desktop, dialog)
+            result['changed_ms'] = (closed[0] - start) * 1000 if closed else None
+
+            # 规则替换：新规则能处理的未匹配对话框立即复查
+            other = desktop.create_window('CorelDRAW X7', children=[('Static', '字体替换'), ('Button', 'OK', 2)],
+                                          owner=main_window)
+            time.sleep(1.5)
+            rule = popup_rules.Rule('font_substitution', '字体替换', targets=(button_labels.OK,), text='字体替换')
+            start = time.perf_counter()
+            control.load_rules(rules=[popup_rules.rule_to_dict(r) for r in handler.rule_engine.rules]
+                               + [popup_rules.rule_to_dict(rule)])
+            closed = _wait_closed(desktop, other)
+            result['rules_ms'] = (closed[0] - start) * 1000 if closed else None
+    finally:
+        control.stop()
+        loop.join(5.0)
+        workers.close()
+        watcher.close()
+        _restore_handler(handler, saved)
+    return result
+
+
+@benchmark
+def unmatched_dialog():
+    """一直打开的未匹配对话框：稳态 CPU / 后端调用 / 规则匹配次数，内容变化和替换规则后重新处理的延迟"""
+    legacy = _run_unmatched(_NoUnmatchedCache(), _LegacyWatcher)
+    report('without_cache', **legacy)
+    cached = _run_unmatched(decision_cache.UnmatchedCache())
+    report('unmatched_cache', **cached)
+    return (cached['evals_per_s'] < 0.5 and cached['calls_per_s'] < legacy['calls_per_s'] / 5
+            and cached['changed_ms'] is not None and cached['changed_ms'] < 200
+            and cached['rules_ms'] is not None and cached['rules_ms'] < 200)
+
+
+# ========== 文本分层 ==========
+
+class _FixedTexts(text_providers.TextProvider):
+    """改造前的做法：补充文本在匹配规则之前已经全部读好，这里只交给处理程序"""
+
+    name = 'all'
+
+    def __init__(self, texts):
+        super().__init__()
+        self._texts = texts
+
+    def texts(self, hwnd, snapshot):
+        return self._texts
+
+
+def _run_text_tiers(tiered, per_group=100):
+    """
+    Hook 版处理三组对话框：Win32 读得到文本 / 只有 UI Automation 读得到（自绘）/ 只有 Hook 读得到，
+    tiered 为 False 时每个弹窗都读取所有来源（改造前）；返回各来源的调用次数、后端调用次数和点错的弹窗数
+    """
+    import replay as replay_module
+    import cdr_popup_handler_hook as handler
+
+    desktop = replay_module.ReplayDesktop()
+    counting = window_backend.CountingBackend(desktop)
+    shared_mem = handler.SharedMemory()
+    shared_mem.attach(bytearray(hook_protocol.total_size()))
+    writer = hook_protocol.RingWriter(shared_mem.view)
+    uia = text_providers.FakeUIAProvider(desktop)
+    hook = text_providers.HookTextProvider(shared_mem)
+    children = [('Static', ''), ('Button', '确定', 1), ('Button', '忽略(&I)', 2)]
+    dialogs = []
+    for group in ('win32', 'uia', 'hook'):
+        for _ in range(per_group):
+            hwnd = desktop.create_window('CorelDRAW X7', children=children)
+            if group == 'win32':
+                desktop.set_text(desktop.enum_child_windows(hwnd)[0], '无效的轮廓 ID')
+            elif group == 'uia':
+                uia.drawn[hwnd] = ['无效的轮廓 ID']
+            else:
+                writer.write('无效的轮廓 ID', hwnd=hwnd, root=hwnd)
+            dialogs.append(hwnd)
+
+    saved = _swap_handler(handler, counting)
+    counting.reset()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for hwnd in dialogs:
+                info = handler.get_dialog_info(hwnd)
+                if tiered:
+                    providers = [uia, hook]
+                else:
+                    providers = [_FixedTexts(uia.texts(hwnd, info) + hook.texts(hwnd, info))]
+                handler.handle_popup(hwnd, info, providers)
+    finally:
+        _restore_handler(handler, saved)
+    elapsed = time.perf_counter() - start
+    wrong = sum(1 for hwnd in dialogs if desktop.closed_by.get(hwnd, (0, None))[1] != '忽略(&I)')
+    return {
+        'dialogs': len(dialogs),
+        'uia_calls': uia.calls,
+        'hook_reads': hook.calls,
+        'backend_calls': counting.total(),
+        'us_per_dialog': elapsed / len(dialogs) * 1e6,
+        'wrong': wrong,
+    }
+
+
+@benchmark
+def text_tiers():
+    """文本来源分层：Win32 -> UI Automation -> Hook 文本，只在补充文本可能改变结果时读取下一层"""
+    per_group = 100
+    always = _run_text_tiers(False, per_group)
+    report('read_all_tiers', **always)
+    tiered = _run_text_tiers(True, per_group)
+    report('cheapest_first', **tiered)
+    # UI Automation 只用于 Win32 读不到文本的两组，Hook 文本只用于 UI Automation 也读不到的一组
+    return (tiered['wrong'] == 0 and always['wrong'] == 0
+            and tiered['uia_calls'] == 2 * per_group and tiered['hook_reads'] == per_group)
+
+
+# ========== Windows API 绑定 ==========
+
+class _LegacyWin32Backend(window_backend.Win32Backend):
+    """改造前的 Win32Backend：每次调用分配缓冲区、每次枚举创建回调，先查询长度再读取文本"""
+
+    def enum_windows(self):
+        windows = []
+
+        def callback(hwnd, lparam):
+            windows.append(hwnd)
+            return True
+
+        self.user32.EnumWindows(win32_api.EnumWindowsProc(callback), 0)
+        return windows
+
+    def enum_child_windows(self, hwnd):
+        children = []
+
+        def callback(child, lparam):
+            children.append(child)
+            return True
+
+        self.user32.EnumChildWindows(hwnd, win32_api.EnumWindowsProc(callback), 0)
+        return children
+
+    def get_window_text(self, hwnd):
+        length = self.user32.GetWindowTextLengthW(hwnd) + 1
+        buffer = ctypes.create_unicode_buffer(length)
+        self.user32.GetWindowTextW(hwnd, buffer, length)
+        return buffer.value
+
+    def get_control_text(self, hwnd, timeout=None):
+        text = self.get_window_text(hwnd)
+        if text:
+            return text
+        deadline = time.monotonic() + (window_backend.TEXT_TIMEOUT if timeout is None else timeout)
+        length = self._send_timeout(hwnd, window_backend.WM_GETTEXTLENGTH, 0, None, deadline)
+        if length is None:
+            return None
+        if length > 0:
+            buffer = ctypes.create_unicode_buffer(length + 1)
+            if self._send_timeout(hwnd, window_backend.WM_GETTEXT, length + 1,
+                                  ctypes.cast(buffer, ctypes.c_void_p), deadline) is None:
+                return None
+            return buffer.value
+        return ""
+
+    def _send_timeout(self, hwnd, msg, wparam, lparam, deadline):
+        timeout_ms = int((deadline - time.monotonic()) * 1000)
+        if timeout_ms <= 0:
+            return None
+        result = ctypes.c_size_t()
+        if not self.user32.SendMessageTimeoutW(hwnd, msg, wparam, lparam, 0, timeout_ms, ctypes.byref(result)):
+            return None
+        return result.value
+
+    def get_class_name(self, hwnd):
+        buffer = ctypes.create_unicode_buffer(256)
+        self.user32.GetClassNameW(hwnd, buffer, 256)
+        return buffer.value
+
+    def get_window_pid(self, hwnd):
+        pid = ctypes.c_ulong()
+        self.user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        return pid.value
+
+
+class _CountingUser32:
+    """统计替身 user32 每个函数的调用次数"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = 0
+
+    def __getattr__(self, name):
+        function = getattr(self.inner, name)
+
+        def call(*args):
+            self.calls += 1
+            return function(*args)
+
+        return call
+
+
+def _win32_desktop(dialogs=20, apps=200):
+    desktop = window_backend.FakeDesktop(events=False)
+    for i in range(apps):
+        desktop.create_window(f'应用 {i}', class_name='AppWindow', pid=200 + i)
+    radio = window_backend.BS_AUTORADIOBUTTON
+    for i in range(dialogs):
+        desktop.create_window('CorelDRAW X7', children=[
+            ('Static', '无效的轮廓 ID ' * (i % 3 + 1)), ('Static', ''), ('Button', '文本', 2, radio),
+            ('Button', '曲线', 3, radio), ('Button', '重试(&R)', 4), ('Button', '忽略(&I)', 5),
+            ('Button', '关于(&A)', 6), ('Edit', 'x' * 600)])
+    return desktop
+
+
+@benchmark
+def win32_calls():
+    """Win32Backend 的调用开销（替身 user32，经 ctypes 写缓冲区、调用回调）：每次分配 vs 复用缓冲区和回调"""
+    desktop = _win32_desktop()
+    dialogs = [h for h in desktop.enum_windows() if desktop.get_class_name(h) == '#32770']
+    results = {}
+    for name, backend_class in (('legacy', _LegacyWin32Backend), ('bound', window_backend.Win32Backend)):
+        user32 = _CountingUser32(win32_api.FakeUser32(desktop))
+        backend = backend_class(user32=user32)
+        controls = [(c,) for h in dialogs for c in backend.enum_child_windows(h)]
+        user32.calls = 0
+        snapshots = [dialog_snapshot.take_snapshot(backend, h) for h in dialogs]
+        calls = user32.calls / len(dialogs)
+        results[name] = [(s.title, [(c.class_name, c.text) for c in s.controls]) for s in snapshots]
+        report(name,
+               enum_windows_us=_time_per_call(backend.enum_windows, [()] * 200) * 1e6,
+               enum_child_us=_time_per_call(backend.enum_child_windows, [(h,) for h in dialogs] * 50) * 1e6,
+               control_text_us=_time_per_call(backend.get_control_text, controls * 20) * 1e6,
+               class_name_us=_time_per_call(backend.get_class_name, controls * 20) * 1e6,
+               window_pid_us=_time_per_call(backend.get_window_pid, controls * 20) * 1e6,
+               snapshot_us=_time_per_call(lambda h: dialog_snapshot.take_snapshot(backend, h),
+                                          [(h,) for h in dialogs] * 20) * 1e6,
+               user32_calls_per_snapshot=calls)
+    # 两种实现读到的快照必须完全一致（包括超过初始缓冲区长度的文本）
+    same = results['legacy'] == results['bound']
+    report('check', same_snapshots=same)
+    return same
+
+
+class _LegacyEventFilter(window_backend.Win32Backend):
+    """改造前的事件过滤：要求 GetAncestor(hwnd) == hwnd，已销毁窗口的销毁事件被丢弃"""
+
+    def _on_event(self, hook, event, hwnd, id_object, id_child, thread_id, event_time):
+        if id_object != window_backend.OBJID_WINDOW or id_child != window_backend.CHILDID_SELF or not hwnd:
+            return
+        root = self.user32.GetAncestor(hwnd, window_backend.GA_ROOT)
+        if event == window_backend.EVENT_OBJECT_NAMECHANGE:
+            hwnd = root
+        elif root != hwnd:
+            return
+        self._events.append((event, hwnd))
+
+
+class _FakeKernel32:
+    GetCurrentThreadId = staticmethod(threading.get_ident)
+
+
+@benchmark
+def win32_events():
+    """Win32Backend 的事件过滤（替身 user32 经 ctypes 回调送出事件）：暂缓的对话框被关闭后立即清理"""
+    results = {}
+    for name, backend_class in (('legacy', _LegacyEventFilter), ('current', window_backend.Win32Backend)):
+        desktop = window_backend.FakeDesktop()
+        inner = backend_class(user32=win32_api.FakeUser32(desktop), kernel32=_FakeKernel32())
+        backend = window_backend.CachingBackend(inner)
+        watcher = window_backend.DialogWatcher(
+            backend, lambda h: backend.get_class_name(h) == '#32770', safety_interval=60.0)
+        hwnd = desktop.create_window('正在检查打印机设置', children=[('Button', 'OK', 1)])
+        watcher.next_dialogs()
+        # 未匹配，暂缓 30 秒；随后被用户关闭，又弹出一个新的对话框
+        watcher.defer(hwnd, delay=30.0, hold=True)
+        desktop.destroy_window(hwnd)
+        other = desktop.create_window('另一个对话框')
+        dialogs = watcher.next_dialogs()
+        kept = hwnd in watcher._pending or hwnd in watcher._held
+        results[name] = (dialogs == [other], kept, hwnd in backend.entries)
+        report(name, new_dialog=dialogs == [other], still_pending=kept, still_cached=hwnd in backend.entries)
+        watcher.close()
+
+    # 仍然存在的控件：显示/隐藏事件忽略，文本变化报告为所在的顶层窗口
+    inner._events.clear()
+    parent = desktop.create_window('设置', children=[('Static', '...', 65535)])
+    control = desktop.enum_child_windows(parent)[0]
+    for event in (window_backend.EVENT_OBJECT_SHOW, window_backend.EVENT_OBJECT_HIDE,
+                  window_backend.EVENT_OBJECT_NAMECHANGE):
+        inner._on_event(None, event, control, window_backend.OBJID_WINDOW, window_backend.CHILDID_SELF, 0, 0)
+    controls = list(inner._events)
+    report('controls', events=controls)
+    return (results['current'] == (True, False, False) and results['legacy'][1]
+            and controls == [(window_backend.EVENT_OBJECT_NAMECHANGE, parent)])
+
+
+def _call_prototype(restype, argtypes, value):
+    """按函数原型构造一个返回 value 的 C 函数指针并调用，返回 ctypes 转换后的结果"""
+    function = ctypes.CFUNCTYPE(restype, *argtypes)(lambda *args: value)
+    args = []
+    for t in argtypes:
+        if issubclass(t, ctypes._CFuncPtr):
+            args.append(t())
+        elif issubclass(t, (ctypes.c_void_p, ctypes.c_char_p, ctypes.c_wchar_p, ctypes._Pointer)):
+            args.append(None)
+        else:
+            args.append(0)
+    return function(*args)
+
+
+@benchmark
+def pointer_width():
+    """返回句柄 / 地址的 Windows API 原型：restype 与指针同宽，高位地址经 ctypes 往返不被截断"""
+    pointer_size = ctypes.sizeof(ctypes.c_void_p)
+    # 64 位用户态的高位地址（32 位下用最高位为 1 的地址）
+    address = 0x7FFF12345678 if pointer_size == 8 else 0x80001234
+    failed = []
+    for dll, name in win32_api.POINTER_RESULTS:
+        restype, argtypes = win32_api.PROTOTYPES[dll][name]
+        if ctypes.sizeof(restype) != pointer_size or _call_prototype(restype, argtypes, address) != address:
+            failed.append(name)
+    # 对照：不声明 restype 时 ctypes 按 C int 返回
+    legacy = _call_prototype(ctypes.c_int, [], address)
+    declared = sum(len(functions) for functions in win32_api.PROTOTYPES.values())
+    report('prototypes', declared=declared, pointer_results=len(win32_api.POINTER_RESULTS),
+           pointer_bits=pointer_size * 8, failed=','.join(failed) or '-',
+           undeclared_result=hex(legacy & 0xFFFFFFFFFFFFFFFF), expected=hex(address))
+    return not failed
+
+
+# ========== 窗口属性缓存 ==========
+
+def _attribute_desktop(events, apps=240, foreign=12):
+    """稳态桌面：apps 个其它程序的顶层窗口（三分之一隐藏）、CorelDRAW 主窗口、其它程序的 #32770 对话框"""
+    desktop = window_backend.FakeDesktop(events=events)
+    for i in range(apps):
+        pid = 100 + i % 60
+        desktop.processes[pid] = f'app{pid}.exe'
+        desktop.create_window(f'应用 {i}', class_name='AppWindow', pid=pid, visible=i % 3 != 0)
+    main = desktop.create_window('CorelDRAW X7 - 未命名', class_name='CorelDRAW', pid=1)
+    for i in range(foreign):
+        desktop.create_window(f'另存为 {i}', pid=100 + i)
+    return desktop, main
+
+
+def _dialog_filter(backend, scope):
+    """和 is_coreldraw_dialog 相同的筛选（只用给定的后端，便于和不缓存的结果对照）"""
+    def is_dialog(hwnd):
+        return (backend.get_class_name(hwnd) == '#32770' and scope.contains(hwnd)
+                and 'Corel' in backend.get_window_text(hwnd))
+    return is_dialog
+
+
+def _attribute_sweep(backend, watcher, scope):
+    # 先处理积压的事件（检测循环在每次扫描前都会这样做）
+    backend.wait_events(0)
+    found = watcher.sweep()
+    scope.refresh()
+    return sorted(found)
+
+
+@benchmark
+def window_cache():
+    """每轮兜底扫描（DialogWatcher.sweep + ProcessScope.refresh）的窗口 API 调用：每次重新读取 vs 按 hwnd 缓存"""
+    ok = True
+    for mode, events in (('events', True), ('polling', False)):
+        desktop, main = _attribute_desktop(events)
+        counting = window_backend.CountingBackend(desktop)
+        backends = {'uncached': counting, 'cached': window_backend.CachingBackend(counting)}
+        for name, backend in backends.items():
+            backend.start_events()
+            scope = process_scope.ProcessScope(backend)
+            watcher = window_backend.DialogWatcher(backend, _dialog_filter(backend, scope))
+            for _ in range(2):
+                _attribute_sweep(backend, watcher, scope)
+            counting.reset()
+            sweeps = 20
+            start = time.perf_counter()
+            for _ in range(sweeps):
+                _attribute_sweep(backend, watcher, scope)
+            elapsed = time.perf_counter() - start
+            report(f'{mode}/{name}', windows=len(desktop.top_level), calls_per_sweep=counting.total() / sweeps,
+                   sweep_us=elapsed / sweeps * 1e6)
+            backend.stop_events()
+
+        # 窗口变化后缓存的结果必须和直接读取的一致
+        cached = backends['cached']
+        cached.start_events()
+        scope = process_scope.ProcessScope(cached)
+        watcher = window_backend.DialogWatcher(cached, _dialog_filter(cached, scope))
+        oracle_scope = process_scope.ProcessScope(desktop)
+        oracle = window_backend.DialogWatcher(desktop, _dialog_filter(desktop, oracle_scope))
+        _attribute_sweep(cached, watcher, scope)
+        apps = [h for h in desktop.top_level if desktop.get_class_name(h) == 'AppWindow']
+        dialog = desktop.create_window('CorelDRAW X7', pid=1, owner=main)
+        steps = [
+            ('create', lambda: None),
+            ('hide', lambda: desktop.hide_window(dialog)),
+            ('show', lambda: desktop.show_window(dialog)),
+            ('rename', lambda: desktop.set_text(dialog, '导入')),
+            ('rename_back', lambda: desktop.set_text(dialog, 'CorelDRAW X7')),
+            ('destroy', lambda: desktop.destroy_window(dialog)),
+        ]
+        if events:
+            # hwnd 复用：其它程序的窗口关闭后，同一 hwnd 上创建 CorelDRAW 的对话框（只有事件能及时发现）
+            reused = apps[1]
+            steps.append(('reuse', lambda: (desktop.destroy_window(reused),
+                                            desktop.create_window('CorelDRAW X7', pid=1, hwnd=reused))))
+        mismatched = []
+        for step, change in steps:
+            change()
+            got = _attribute_sweep(cached, watcher, scope)
+            oracle_scope.refresh()
+            want = sorted(oracle.sweep())
+            if got != want:
+                mismatched.append(step)
+        cached.stop_events()
+        report(f'{mode}/check', steps=len(steps), mismatched=','.join(mismatched) or '-')
+        report(f'{mode}/cache', stats=cached.stats())
+        ok = ok and not mismatched
+    return ok
+
+
+# ========== 指标开销 ==========
+
+# 每轮扫描记录指标的开销上限（微秒）
+METRICS_OVERHEAD_BOUND_US = 50.0
+
+
+@benchmark
+def metrics_overhead():
+    """每轮扫描记录指标的开销（10 个对话框），超过 METRICS_OVERHEAD_BOUND_US 视为失败"""
+    import metrics
+
+    registry = metrics.Registry()
+    labels = (('rule', 'outline_id'), ('source', 'rules'))
+    dialogs = 10
+
+    def scan():
+        registry.observe('sweep_seconds', 0.001)
+        registry.inc('windows_enumerated_total', 120)
+        for _ in range(dialogs):
+            registry.inc('child_walks_total')
+            registry.observe('rule_eval_seconds', 0.00002)
+            registry.inc('rule_hits_total', labels=labels)
+            registry.inc('popups_handled_total')
+
+    scans = 20000
+    start = time.perf_counter()
+    for _ in range(scans):
+        scan()
+    per_scan_us = (time.perf_counter() - start) / scans * 1e6
+
+    # 对比：替身后端上一次全量扫描（含指标记录）的耗时
+    desktop = window_backend.FakeDesktop(events=False)
+    for _ in range(dialogs):
+        desktop.create_window('CorelDRAW X7', children=[('Static', '无效的轮廓 ID'), ('Button', '忽略(&I)')])
+    watcher = window_backend.DialogWatcher(desktop, lambda h: True, metrics=registry)
+    start = time.perf_counter()
+    for _ in range(200):
+        watcher.sweep()
+    sweep_us = (time.perf_counter() - start) / 200 * 1e6
+
+    start = time.perf_counter()
+    text = registry.render()
+    render_ms = (time.perf_counter() - start) * 1000
+    ok = per_scan_us <= METRICS_OVERHEAD_BOUND_US
+    report('record', per_scan_us=per_scan_us, bound_us=METRICS_OVERHEAD_BOUND_US,
+           sweep_us=sweep_us, render_ms=render_ms, lines=text.count('\n'),
+           result='OK' if ok else '超出上限')
+    return ok
+
+
+def main(argv):
+    names = argv or list(BENCHMARKS)
+    failed = []
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"未知基准: {name}（可选: {', '.join(BENCHMARKS)}）")
+            return 1
+        print(f"[{name}] {BENCHMARKS[name].__doc__}")
+        # 带检查的基准返回 False 表示失败
+        if BENCHMARKS[name]() is False:
+            failed.append(name)
+    if failed:
+        print(f"失败: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
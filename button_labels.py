@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+按钮标签
+把按钮文本规范化（去掉助记符 (&I) / &、全角转半角、大小写折叠），
+并通过标签表把中文（简体/繁体）和英文版 CorelDRAW 的按钮映射到同一个语义动作（确定、忽略、是、曲线…），
+规则的 targets / radio 可以写语义动作，也可以写具体的按钮文本；匹配是精确的，
+不会因为目标文本恰好包含在另一个按钮的文本中而点错按钮
+"""
+
+import re
+import functools
+import unicodedata
+
+# 语义动作
+OK = 'ok'
+CANCEL = 'cancel'
+YES = 'yes'
+NO = 'no'
+IGNORE = 'ignore'
+RETRY = 'retry'
+ABORT = 'abort'
+CLOSE = 'close'
+CURVES = 'curves'
+TEXT = 'text'
+
+# 语义动作 -> 各语言版本的按钮文本（不含助记符）
+LABELS = {
+    OK: ('确定', '確定', 'OK'),
+    CANCEL: ('取消', 'Cancel'),
+    YES: ('是', 'Yes'),
+    NO: ('否', 'No'),
+    IGNORE: ('忽略', 'Ignore'),
+    RETRY: ('重试', '重試', 'Retry'),
+    ABORT: ('中止', 'Abort'),
+    CLOSE: ('关闭', '關閉', 'Close'),
+    CURVES: ('曲线', '曲線', 'Curves'),
+    TEXT: ('文本', '文字', 'Text'),
+}
+
+# 结尾的助记符：中文版的 "忽略(&I)"（NFKC 之后全角括号已变成半角）
+_ACCELERATOR = re.compile(r'\s*\(&?[0-9A-Za-z]\)$')
+# 结尾的省略号和冒号："浏览..." / "Options:"
+_TRAILER = re.compile(r'(\.\.\.|:)$')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_label(text):
+    """按钮文本的规范形式：'忽略(&I)' -> '忽略'，'&Ignore' -> 'ignore'，'ＯＫ' -> 'ok'"""
+    text = unicodedata.normalize('NFKC', text).strip()
+    text = _ACCELERATOR.sub('', text)
+    # "&&" 是真正的 & 字符，单个 & 是助记符标记
+    text = text.replace('&&', '\0').replace('&', '').replace('\0', '&')
+    text = _TRAILER.sub('', text)
+    return _SPACES.sub(' ', text).strip().casefold()
+
+
+# 规范化的按钮文本 -> 语义动作（语义动作名本身也可以直接查）
+_ACTIONS = {}
+for _action, _labels in LABELS.items():
+    _ACTIONS[_action] = _action
+    for _label in _labels:
+        _ACTIONS[normalize_label(_label)] = _action
+
+
+@functools.lru_cache(maxsize=1024)
+def label_key(text):
+    """查找用的键：已知按钮是语义动作，其它按钮是规范化文本（按钮文本重复率很高，结果缓存）"""
+    norm = normalize_label(text)
+    return _ACTIONS.get(norm, norm)
+
+
+def target_keys(targets):
+    """规则的 targets / radio（语义动作或按钮文本）-> 去重后保持顺序的键元组"""
+    if isinstance(targets, str):
+        targets = (targets,)
+    return _target_keys(tuple(targets))
+
+
+@functools.lru_cache(maxsize=256)
+def _target_keys(targets):
+    # 规则的 targets 是固定的元组，每条规则只规范化一次
+    return tuple(dict.fromkeys(label_key(t) for t in targets))
+
+
+class ButtonIndex:
+    """一个对话框的按钮索引：键 -> 按对话框顺序的第一个按钮"""
+
+    __slots__ = ('keys',)
+
+    def __init__(self, buttons):
+        self.keys = {}
+        for button in buttons:
+            self.keys.setdefault(label_key(button.text), button)
+
+    def find(self, targets):
+        """按 targets 的顺序查找，返回第一个存在的按钮（没有返回 None）"""
+        for key in target_keys(targets):
+            button = self.keys.get(key)
+            if button is not None:
+                return button
+        return None
+
+    def __contains__(self, target):
+        return label_key(target) in self.keys
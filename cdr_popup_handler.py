@@ -4,252 +4,500 @@ CorelDRAW 弹窗自动处理工具 v3.0
 自动检测并处理 CorelDRAW 打开文件时的各种错误弹窗
 """
 
-import time
 import sys
-import ctypes
-from ctypes import wintypes
-from datetime import datetime
+import time
+import logging
+import argparse
+import multiprocessing
+
+import app_paths
+import async_log
+import batch_open
+import control_api
+import decision_cache
+import click_actions
+import dialog_snapshot
+import dialog_workers
+import metrics
+import outcome_journal
+import popup_rules
+import process_scope
+import text_providers
+import window_backend
+
+# 窗口系统后端（非 Windows 下可替换为 window_backend.FakeDesktop）
+backend = window_backend.default_backend()
+
+# 事件驱动模式下的兜底全量扫描间隔（秒）
+SAFETY_SCAN_INTERVAL = 5.0
+
+# 并发处理对话框的工作线程数（不同进程、互不相关的对话框同时处理）
+MAX_WORKERS = dialog_workers.DEFAULT_WORKERS
+
+# 读取控件文本的时间预算：单次最多等待 0.1 秒，每轮扫描累计最多 0.25 秒
+text_budget = window_backend.TextBudget(call_timeout=0.1, scan_budget=0.25)
+
+# CorelDRAW 进程范围：只检查 CorelDRAW 进程的对话框
+scope = process_scope.ProcessScope(backend)
+
+# 点击动作（确认状态，代替固定等待）
+actions = click_actions.ActionExecutor(backend)
+
+# 编译后的弹窗规则
+rule_engine = popup_rules.compile_rules(popup_rules.STANDARD_RULES)
+
+# 弹窗决策缓存（main 中加载）
+DECISION_CACHE_FILE = "decision_cache_standard.json"
+decisions = None
+
+# 未匹配任何规则的对话框：内容和规则集都没变时不再重复读取日志、匹配规则，按计划拉长复查间隔
+unmatched = decision_cache.UnmatchedCache()
+
+# is_coreldraw_dialog 为判断内容读取的快照：hwnd -> (读取时间, 快照)，
+# process_dialog 在 SNAPSHOT_REUSE_AGE 秒内直接使用，不再遍历一次子控件
+SNAPSHOT_REUSE_AGE = 0.5
+detected_snapshots = {}
+
+# UI Automation 文本来源（Windows 下装有 comtypes 时可用，None 表示不使用）：
+# Win32 快照无法确定规则时才用它补充自绘控件的文本
+uia = text_providers.default_uia()
+
+# 结果日志：每个处理过的弹窗和批量打开的每个文件的结果（程序目录下的 SQLite 数据库，None 表示不记录），
+# 批量打开时跳过之前打不开的文件（main 中打开）
+JOURNAL_FILE = "outcomes_standard.db"
+journal = None
+
+# 运行指标：本机 http://127.0.0.1:9464/metrics（Prometheus 格式，0 表示不开启），
+# 退出时保存到程序目录下的 JSON 文件（None 表示不保存）
+METRICS_PORT = 9464
+METRICS_DUMP_FILE = "metrics_standard.json"
+telemetry = metrics.Registry()
+
+
+def collect_metrics():
+    """导出指标时读取各统计对象的计数"""
+    return (metrics.budget_samples(text_budget) + metrics.action_samples(actions)
+            + metrics.decision_samples(decisions))
+
+
+telemetry.add_collector(collect_metrics)
+
+# 日志：后台线程写控制台和程序目录下的滚动日志文件（None 表示不写文件），
+# 逐个控件的详细信息只在 DEBUG 级别输出
+LOG_LEVEL = logging.INFO
+LOG_FILE = "cdr_popup_standard.log"
+logger = async_log.get_logger('cdr_popup.standard')
+
+# 控制接口：Windows 下的命名管道（None 表示不开启），
+# 用 python control_api.py 查看统计、暂停/恢复、dry-run、热更新规则
+CONTROL_ADDRESS = control_api.default_address('standard')
+
+# 批量打开模式（--batch）：每个文件的结果写到程序目录下的 CSV 报告
+BATCH_REPORT_FILE = "batch_report_standard.csv"
 
-# Windows API
-user32 = ctypes.windll.user32
-kernel32 = ctypes.windll.kernel32
 
-# 消息常量
-BM_CLICK = 0x00F5
-WM_GETTEXT = 0x000D
-WM_GETTEXTLENGTH = 0x000E
+def log(msg, storm=None):
+    """记录日志（只入队，由后台线程输出）；storm 相同的记录短时间内重复出现时合并成一行汇总"""
+    logger.info(msg, extra={'storm': storm} if storm else None)
 
-# 回调函数类型
-EnumWindowsProc = ctypes.WINFUNCTYPE(ctypes.c_bool, wintypes.HWND, wintypes.LPARAM)
-EnumChildProc = ctypes.WINFUNCTYPE(ctypes.c_bool, wintypes.HWND, wintypes.LPARAM)
 
+def warn(msg):
+    logger.warning(msg)
 
-def log(msg):
-    """打印带时间戳的日志"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] {msg}")
+
+def debug(msg, *args):
+    """调试日志（参数在输出时才格式化）"""
+    logger.debug(msg, *args)
 
 
 def get_window_text(hwnd):
     """获取窗口标题"""
-    length = user32.GetWindowTextLengthW(hwnd) + 1
-    buffer = ctypes.create_unicode_buffer(length)
-    user32.GetWindowTextW(hwnd, buffer, length)
-    return buffer.value
+    return backend.get_window_text(hwnd)
 
 
 def get_control_text(hwnd):
-    """获取控件文本（包括静态文本控件）"""
-    # 先尝试 GetWindowText
-    text = get_window_text(hwnd)
-    if text:
-        return text
-    
-    # 再尝试 WM_GETTEXT（对静态控件更有效）
-    length = user32.SendMessageW(hwnd, WM_GETTEXTLENGTH, 0, 0)
-    if length > 0:
-        buffer = ctypes.create_unicode_buffer(length + 1)
-        user32.SendMessageW(hwnd, WM_GETTEXT, length + 1, buffer)
-        return buffer.value
-    
-    return ""
+    """获取控件文本（包括静态文本控件），窗口无响应时返回 None"""
+    return text_budget.get_text(backend, hwnd)
 
 
 def get_class_name(hwnd):
     """获取窗口类名"""
-    buffer = ctypes.create_unicode_buffer(256)
-    user32.GetClassNameW(hwnd, buffer, 256)
-    return buffer.value
+    return backend.get_class_name(hwnd)
 
 
 def is_window_visible(hwnd):
     """检查窗口是否可见"""
-    return user32.IsWindowVisible(hwnd)
+    return backend.is_window_visible(hwnd)
 
 
 def find_child_windows(parent_hwnd):
     """查找所有子窗口"""
-    children = []
-    
-    def callback(hwnd, lparam):
-        children.append(hwnd)
-        return True
-    
-    user32.EnumChildWindows(parent_hwnd, EnumChildProc(callback), 0)
-    return children
+    return backend.enum_child_windows(parent_hwnd)
+
+
+def click_button(snapshot, control):
+    """点击按钮，确认对话框已经关闭返回 True，没有关闭返回 click_actions.ATTEMPTED"""
+    debug("    -> 点击按钮 hwnd=%s", control.hwnd)
+    method = actions.press_button(snapshot.hwnd, control.hwnd, control.control_id)
+    if method == click_actions.ATTEMPTED:
+        warn("    ⚠️ 点击后对话框没有关闭")
+        return method
+    if method != 'click':
+        log(f"    -> BM_CLICK 无效，已通过 {method} 关闭对话框")
+    return True
 
 
-def click_button(hwnd):
-    """点击按钮"""
-    log(f"    -> 点击按钮 hwnd={hwnd}")
-    result = user32.SendMessageW(hwnd, BM_CLICK, 0, 0)
-    time.sleep(0.1)
-    return True
+def get_dialog_snapshot(hwnd, title=None):
+    """一次遍历获取对话框快照（所有子控件的类名、ID、文本、样式）"""
+    telemetry.inc('child_walks_total')
+    return dialog_snapshot.take_snapshot(backend, hwnd, title, text_budget)
 
 
 def get_all_dialog_content(hwnd):
     """获取对话框中的所有文本内容（包括静态文本）"""
-    all_texts = []
-    children = find_child_windows(hwnd)
-    
-    for child in children:
-        class_name = get_class_name(child)
-        text = get_control_text(child)
-        
-        if text:
-            all_texts.append(text)
-        
-        # 特别处理静态文本控件
-        if class_name == 'Static' or 'STATIC' in class_name.upper():
-            # 确保获取静态文本
-            static_text = get_control_text(child)
-            if static_text and static_text not in all_texts:
-                all_texts.append(static_text)
-    
-    return ' '.join(all_texts)
+    return get_dialog_snapshot(hwnd).content
 
 
-def find_and_click_button_by_text(parent_hwnd, button_texts):
-    """根据按钮文本查找并点击按钮"""
-    if isinstance(button_texts, str):
-        button_texts = [button_texts]
-    
-    children = find_child_windows(parent_hwnd)
-    
-    for child in children:
-        text = get_control_text(child)
-        class_name = get_class_name(child)
-        
-        # 检查是否是按钮
-        if 'Button' in class_name or 'BUTTON' in class_name.upper():
-            for btn_text in button_texts:
-                # 支持多种匹配方式
-                if (btn_text.lower() in text.lower() or 
-                    btn_text.replace('&', '') in text or
-                    text.replace('&', '') in btn_text or
-                    btn_text == text):
-                    log(f"  >>> 找到按钮: '{text}' (匹配: '{btn_text}')")
-                    click_button(child)
-                    return True
-    
-    return False
+def find_button_by_text(snapshot, button_texts):
+    """根据按钮文本或语义动作（button_labels）在快照中精确查找按钮"""
+    control = snapshot.find_button(button_texts)
+    if control is not None:
+        debug("  >>> 找到按钮: '%s'", control.text)
+    return control
 
 
-def select_radio_and_click_ok(parent_hwnd, radio_text):
-    """选择单选按钮并点击OK"""
-    children = find_child_windows(parent_hwnd)
-    
-    # 先找并点击单选按钮
-    for child in children:
-        text = get_control_text(child)
-        class_name = get_class_name(child)
-        
-        if 'Button' in class_name and radio_text.lower() in text.lower():
-            log(f"  >>> 选择单选按钮: '{text}'")
-            click_button(child)
-            time.sleep(0.3)
-            break
+def find_and_click_button_by_text(snapshot, button_texts):
+    """根据按钮文本查找并点击按钮"""
+    button = find_button_by_text(snapshot, button_texts)
+    if button is None:
+        return False
+    return click_button(snapshot, button) is True
+
+
+def find_button_by_label(snapshot, label):
+    """按完整的按钮文本查找按钮（用于重放缓存的决策）"""
+    for control in snapshot.controls:
+        if control.is_button and control.text == label:
+            debug("  >>> 找到按钮: '%s'", label)
+            return control
+    return None
+
+
+def check_radio(control):
+    """选中单选按钮，确认选中状态"""
+    debug("  >>> 选择单选按钮: '%s'", control.text)
+    if not actions.check_radio(control.hwnd):
+        warn("    ⚠️ 单选按钮没有变为选中状态")
+
+
+def select_radio(snapshot, radio_texts):
+    """选择单选按钮，返回选中的按钮文本"""
+    control = snapshot.find_button(radio_texts)
+    if control is None:
+        return None
+    check_radio(control)
+    return control.text
+
+
+def execute_rule(snapshot, rule):
+    """
+    执行规则对应的动作，成功时返回可缓存的决策；找不到按钮（没有点击任何控件）返回 None，
+    点击后对话框没有关闭返回 click_actions.ATTEMPTED
+    """
+    # 先找到要点击的按钮，找不到时不动这个对话框
+    button = find_button_by_text(snapshot, rule.targets)
+    if button is None:
+        return None
+    radio = None
+    if rule.action == popup_rules.ACTION_RADIO_OK:
+        radio = select_radio(snapshot, rule.radio)
     
     # 再点击 OK
-    time.sleep(0.2)
-    return find_and_click_button_by_text(parent_hwnd, ['OK', '确定'])
-
-
-def handle_popup(hwnd, title):
-    """根据弹窗处理"""
-    # 获取完整的对话框内容
-    content = get_all_dialog_content(hwnd)
+    if click_button(snapshot, button) is not True:
+        return click_actions.ATTEMPTED
+    return {'rule': rule.name, 'radio': radio, 'button': button.text}
+
+
+def replay_decision(snapshot, decision):
+    """重放缓存的决策：返回 True、False（找不到控件，没有点击）或 click_actions.ATTEMPTED"""
+    button = find_button_by_label(snapshot, decision['button'])
+    if button is None:
+        return False
+    if decision.get('radio'):
+        radio = find_button_by_label(snapshot, decision['radio'])
+        if radio is None:
+            return False
+        check_radio(radio)
+    return click_button(snapshot, button)
+
+
+def record_outcome(hwnd, pid, title, fingerprint, decision, source, started):
+    """把处理结果记入结果日志（只入队，后台线程批量写入）"""
+    action = decision['button'] if not decision.get('radio') else f"{decision['radio']} + {decision['button']}"
+    latency = time.perf_counter() - started if started is not None else None
+    journal.record_dialog(pid, scope.image_name(pid), title, fingerprint, decision['rule'], source, action, latency,
+                          hwnd=hwnd)
+
+
+def unconfirmed(title):
+    """点击消息已经发出但对话框没有关闭：不再尝试其它规则"""
+    log(f"点击后对话框没有关闭，不再重复点击: '{title}'", storm=('unconfirmed', title))
+    return click_actions.ATTEMPTED
+
+
+def handle_popup(hwnd, title, snapshot=None, started=None):
+    """
+    根据弹窗处理（started 是开始处理的时间，用于结果日志中的耗时）
+    返回 True（已处理）、False（没有匹配的规则，没有点击）或 click_actions.ATTEMPTED（已点击但对话框没有关闭）
+    """
+    # 一次遍历获取完整的对话框快照，后续全部使用快照
+    if snapshot is None:
+        snapshot = get_dialog_snapshot(hwnd, title)
+    # 点击后窗口就关闭了，进程在处理前取
+    pid = backend.get_window_pid(hwnd) if journal is not None else 0
+    content = snapshot.content
+    # 整个弹窗使用同一个规则集（控制接口可能在处理过程中替换规则）
+    engine = rule_engine
     
-    log(f"弹窗标题: '{title}'")
-    log(f"弹窗内容: {content[:300]}...")
+    debug("弹窗标题: '%s'", title)
+    debug("弹窗内容: %s...", content[:300])
     
     # 列出所有子控件（调试用）
-    children = find_child_windows(hwnd)
-    log(f"  子控件数量: {len(children)}")
-    for child in children:
-        child_text = get_control_text(child)
-        child_class = get_class_name(child)
-        if child_text:
-            log(f"    - [{child_class}] '{child_text}'")
-    
-    # === 规则匹配 ===
+    if logger.isEnabledFor(logging.DEBUG):
+        debug("  子控件数量: %d", len(snapshot.controls))
+        for control in snapshot.controls:
+            if control.text:
+                debug("    - [%s] '%s'", control.class_name, control.text)
     
-    # 1. 无效的轮廓 ID - 点击忽略
-    # 关键词匹配：检查内容或按钮是否包含相关关键词
-    if ('无效' in content and '轮廓' in content) or '轮廓 ID' in content or '轮廓ID' in content:
-        log("  -> 匹配规则: 无效的轮廓 ID")
-        if find_and_click_button_by_text(hwnd, ['忽略(&I)', '忽略', 'Ignore']):
-            log("  ✅ 成功点击忽略")
-            return True
-    
-    # 2. 检查按钮组合：如果有"关于、重试、忽略"三个按钮，通常是轮廓ID错误
-    if '关于' in content and '重试' in content and '忽略' in content:
-        log("  -> 匹配规则: 关于/重试/忽略 按钮组合（可能是轮廓ID错误）")
-        if find_and_click_button_by_text(hwnd, ['忽略(&I)', '忽略', 'Ignore']):
-            log("  ✅ 成功点击忽略")
-            return True
+    # === 决策缓存 ===
+    # 每个弹窗只查一次，按 Win32 快照的指纹
     
-    # 3. 无效标头 / 无法打开文件 - 点击 OK
-    if '无法打开文件' in content or '无效标头' in content:
-        log("  -> 匹配规则: 无效标头")
-        if find_and_click_button_by_text(hwnd, ['OK', '确定']):
-            log("  ✅ 成功点击 OK")
-            return True
+    fingerprint = decision_cache.dialog_fingerprint(
+        title, snapshot.structure, snapshot.button_texts, content
+    )
+    if decisions is not None:
+        decision = decisions.get(fingerprint)
+        if decision:
+            debug("  -> 命中决策缓存: %s", decision['rule'])
+            replayed = replay_decision(snapshot, decision)
+            if replayed is True:
+                log(f"✅ 成功重放决策: '{title}' -> {decision['rule']}", storm=('handled', title, decision['rule']))
+                telemetry.inc('rule_hits_total', labels=(('rule', decision['rule']), ('source', 'cache')))
+                if journal is not None:
+                    record_outcome(hwnd, pid, title, fingerprint, decision, 'cache', started)
+                return True
+            decisions.discard(fingerprint)
+            if replayed == click_actions.ATTEMPTED:
+                return unconfirmed(title)
     
-    # 4. 文件被损坏 - 点击 OK
-    if '文件被损坏' in content or ('文件' in content and '损坏' in content):
-        log("  -> 匹配规则: 文件被损坏")
-        if find_and_click_button_by_text(hwnd, ['OK', '确定']):
-            log("  ✅ 成功点击 OK")
-            return True
+    # === 文本分层 + 规则匹配 ===
+    # 先只用 Win32 快照；补充文本可能改变要执行的规则时再用 UI Automation 补充（代价从低到高）
+    tiers = (None,) if uia is None else (None, uia)
+    extra = []
+    # 用到了补充文本来源的弹窗不缓存决策：只凭 Win32 快照的指纹不能确定规则
+    cacheable = True
+    for provider in tiers:
+        if provider is not None:
+            cacheable = False
+            added = provider.texts(hwnd, snapshot)
+            if not added:
+                continue
+            extra += added
+            content = ' '.join([snapshot.content] + extra)
+            debug("  UI Automation 文本: %s...", added[:5])
+        telemetry.inc('text_tier_total', labels=(('tier', provider.name if provider else 'win32'),))
+        
+        start = time.perf_counter()
+        matched = engine.match(content, title)
+        telemetry.observe('rule_eval_seconds', time.perf_counter() - start)
+        if not popup_rules.needs_more_text(engine, matched, snapshot):
+            break
     
-    # 5. 导入 PS/PRN - 选择曲线，点击 OK
-    if 'PS/PRN' in content or 'PS/PRN' in title:
-        log("  -> 匹配规则: 导入 PS/PRN")
-        if select_radio_and_click_ok(hwnd, '曲线'):
-            log("  ✅ 成功选择曲线并点击 OK")
+    for rule in matched:
+        debug("  -> 匹配规则: %s", rule.description)
+        decision = execute_rule(snapshot, rule)
+        if decision == click_actions.ATTEMPTED:
+            return unconfirmed(title)
+        if decision:
+            log(f"✅ 成功处理: '{title}' -> {rule.description}", storm=('handled', title, rule.name))
+            telemetry.inc('rule_hits_total', labels=(('rule', rule.name), ('source', 'rules')))
+            if decisions is not None and cacheable:
+                decisions.put(fingerprint, decision, engine.version)
+            if journal is not None:
+                record_outcome(hwnd, pid, title, fingerprint, decision, 'rules', started)
             return True
     
-    log("  -> 未匹配任何规则")
+    log(f"未匹配任何规则: '{title}'", storm=('unmatched', title))
     return False
 
 
+def take_snapshot(hwnd):
+    """在控制接口的线程中读取对话框快照（单独计算文本读取预算）"""
+    text_budget.start()
+    return get_dialog_snapshot(hwnd)
+
+
+def dry_run(snapshot):
+    """只匹配规则不点击（控制接口）：匹配的规则、会点击的按钮、缓存中的决策"""
+    engine = rule_engine
+    content = snapshot.content
+    cached = None
+    if decisions is not None:
+        cached = decisions.peek(decision_cache.dialog_fingerprint(
+            snapshot.title, snapshot.structure, snapshot.button_texts, content
+        ))
+    return control_api.dry_run_report(snapshot, engine.match(content, snapshot.title), cached)
+
+
+def swap_rules(rules):
+    """原子地替换规则集（控制接口热更新规则），返回新的规则集版本"""
+    global rule_engine
+    engine = popup_rules.compile_rules(rules)
+    rule_engine = engine
+    if decisions is not None:
+        decisions.set_rules_version(engine.version)
+    log(f"规则已更新: {len(engine.rules)} 条 (版本 {engine.version})")
+    return engine.version
+
+
 def find_all_windows():
     """查找所有顶层窗口"""
     windows = []
     
-    def callback(hwnd, lparam):
+    for hwnd in backend.enum_windows():
         if is_window_visible(hwnd):
             title = get_window_text(hwnd)
             class_name = get_class_name(hwnd)
             windows.append((hwnd, title, class_name))
-        return True
     
-    user32.EnumWindows(EnumWindowsProc(callback), 0)
     return windows
 
 
+def is_coreldraw_dialog(hwnd, title=None, class_name=None):
+    """判断顶层窗口是否是 CorelDRAW 相关的对话框"""
+    if class_name is None:
+        class_name = get_class_name(hwnd)
+    # 只关注 #32770 类（标准对话框）
+    if class_name != '#32770':
+        return False
+    
+    # 只关注 CorelDRAW 进程的对话框，其它程序的窗口不读取内容
+    if not scope.contains(hwnd):
+        return False
+    
+    if title is None:
+        title = get_window_text(hwnd)
+    # 检查标题是否包含 CorelDRAW
+    if 'CorelDRAW' in title or 'Corel' in title:
+        return True
+    
+    # 检查内容是否相关
+    snapshot = get_dialog_snapshot(hwnd, title)
+    if not snapshot.complete:
+        # 窗口没有响应，先当作候选，由主循环放进重试队列
+        return True
+    if any(kw in snapshot.content for kw in ['轮廓', 'CorelDRAW', '文件', 'PS/PRN', '损坏']):
+        detected_snapshots[hwnd] = (time.monotonic(), snapshot)
+        return True
+    return False
+
+
+def take_detected_snapshot(hwnd):
+    """is_coreldraw_dialog 刚读取的快照（没有或已过期返回 None）"""
+    entry = detected_snapshots.pop(hwnd, None)
+    if entry is None or time.monotonic() - entry[0] > SNAPSHOT_REUSE_AGE:
+        return None
+    return entry[1]
+
+
+def prune_detected_snapshots():
+    """丢弃过期的快照（对话框没有被处理，例如正在处理或已经处理过）"""
+    now = time.monotonic()
+    for hwnd, (taken, _) in list(detected_snapshots.items()):
+        if now - taken > SNAPSHOT_REUSE_AGE:
+            detected_snapshots.pop(hwnd, None)
+
+
 def find_coreldraw_dialogs():
     """查找 CorelDRAW 相关的对话框"""
     dialogs = []
     all_windows = find_all_windows()
     
     for hwnd, title, class_name in all_windows:
-        # 只关注 #32770 类（标准对话框）
-        if class_name == '#32770':
-            # 检查标题是否包含 CorelDRAW
-            if 'CorelDRAW' in title or 'Corel' in title:
-                dialogs.append((hwnd, title))
-            else:
-                # 检查内容是否相关
-                content = get_all_dialog_content(hwnd)
-                if any(kw in content for kw in ['轮廓', 'CorelDRAW', '文件', 'PS/PRN', '损坏']):
-                    dialogs.append((hwnd, title))
+        if is_coreldraw_dialog(hwnd, title, class_name):
+            dialogs.append((hwnd, title))
     
     return dialogs
 
 
-def main():
+def process_dialog(watcher, hwnd):
+    """处理一个对话框（在工作线程中运行），返回是否已处理；没处理掉的放回 watcher 的重试队列"""
+    started = time.perf_counter()
+    # 每个对话框单独计算文本读取预算
+    text_budget.start()
+    snapshot = take_detected_snapshot(hwnd)
+    if snapshot is not None:
+        title = snapshot.title
+    else:
+        title = get_window_text(hwnd)
+        snapshot = get_dialog_snapshot(hwnd, title)
+    if not snapshot.complete:
+        # 窗口没有响应（程序正忙），不阻塞其它弹窗，稍后重试
+        log(f"对话框暂无响应，稍后重试: '{title}'", storm=('busy', title))
+        watcher.defer(hwnd, slow=True)
+        return False
+    
+    debug("检测到对话框: hwnd=%s", hwnd)
+    
+    # 内容和规则集都没变的未匹配对话框不再匹配规则，只推迟下次复查
+    version = (title, snapshot.signature)
+    rules_version = rule_engine.version
+    if unmatched.seen(hwnd, version, rules_version):
+        telemetry.inc('unmatched_skips_total')
+        watcher.defer(hwnd, delay=unmatched.record(hwnd, version, rules_version), hold=True)
+        return False
+    
+    result = handle_popup(hwnd, title, snapshot, started)
+    if result == click_actions.ATTEMPTED:
+        # 点击消息已经发出，不能再操作这个对话框：当作已处理（DialogWorkers 不再提交它），
+        # 暂缓到兜底扫描间隔后再看是否关闭
+        unmatched.discard(hwnd)
+        watcher.defer(hwnd, delay=watcher.safety_interval, hold=True)
+        return True
+    if result:
+        unmatched.discard(hwnd)
+        telemetry.inc('popups_handled_total')
+        debug("弹窗已处理: hwnd=%s", hwnd)
+        return True
+    watcher.defer(hwnd, delay=unmatched.record(hwnd, version, rules_version), hold=True)
+    return False
+
+
+def dialog_lane(hwnd):
+    """同一条所有者链上的对话框按顺序处理，其它对话框并发处理"""
+    return dialog_workers.dialog_lane(backend, hwnd)
+
+
+def main(argv=()):
+    parser = argparse.ArgumentParser(description='CorelDRAW 弹窗自动处理工具')
+    parser.add_argument('--daemon', action='store_true',
+                        help='常驻模式：日志只写文件，通过控制接口（control_api.py）管理')
+    parser.add_argument('--batch', nargs='+', metavar='路径',
+                        help='依次打开目录（或 .txt 文件列表）中的 .cdr/.ps/.prn 文件，全部打开后退出')
+    parser.add_argument('--opener', choices=sorted(batch_open.OPENERS), default='com',
+                        help='批量打开的方式：com（CorelDRAW 自动化）或 shell（关联程序）')
+    parser.add_argument('--batch-timeout', type=float, default=batch_open.DEFAULT_TIMEOUT,
+                        help='单个文件的超时（秒），超时后跳过')
+    parser.add_argument('--no-preflight', action='store_true',
+                        help='批量打开前不检查文件头（默认跳过 CorelDRAW 打不开的文件）')
+    parser.add_argument('--retry-bad', action='store_true',
+                        help='批量打开时重新打开结果日志中之前打不开的文件（默认跳过）')
+    args = parser.parse_args(argv)
+    
+    log_writer = async_log.setup(
+        logger, LOG_LEVEL, app_paths.app_file(LOG_FILE) if LOG_FILE else None,
+        console=not args.daemon
+    )
     print("=" * 60)
     print("CorelDRAW 弹窗自动处理工具 v3.0")
     print("=" * 60)
@@ -267,45 +515,128 @@ def main():
     print()
     print("-" * 60)
     
-    handled_count = 0
+    global decisions, journal
+    decisions = decision_cache.DecisionCache(
+        rule_engine.version, app_paths.app_file(DECISION_CACHE_FILE)
+    )
+    if decisions.load():
+        log(f"已加载决策缓存: {len(decisions.entries)} 条")
+    if JOURNAL_FILE:
+        try:
+            journal = outcome_journal.OutcomeJournal(app_paths.app_file(JOURNAL_FILE))
+        except OSError as e:
+            warn(f"⚠️ {e}")
+    
     scan_count = 0
-    handled_hwnds = set()
+    
+    # 窗口创建/显示事件触发检测，全量扫描只作为兜底
+    watcher = window_backend.DialogWatcher(
+        backend, is_coreldraw_dialog, safety_interval=SAFETY_SCAN_INTERVAL,
+        budget=text_budget, metrics=telemetry
+    )
+    if watcher.event_driven:
+        log(f"事件驱动检测已启用（兜底扫描间隔 {SAFETY_SCAN_INTERVAL} 秒）")
+    else:
+        warn("⚠️ 无法注册窗口事件，使用轮询检测")
+    
+    # 检测在主线程，处理交给工作线程；每个 hwnd 同时只有一个任务，处理成功后不再提交
+    workers = dialog_workers.DialogWorkers(
+        lambda hwnd: process_dialog(watcher, hwnd), dialog_lane, max_workers=MAX_WORKERS
+    )
+    
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = metrics.serve(telemetry, METRICS_PORT)
+            log(f"运行指标: http://127.0.0.1:{METRICS_PORT}/metrics")
+        except OSError as e:
+            warn(f"⚠️ 无法开启指标端口 {METRICS_PORT}: {e}")
+    
+    control = control_api.HandlerControl(
+        sys.modules[__name__], workers,
+        take_snapshot=take_snapshot, dry_run=dry_run, wake=watcher.request_sweep
+    )
+    control_server = None
+    if CONTROL_ADDRESS:
+        try:
+            control_server = control_api.ControlServer(CONTROL_ADDRESS, control.commands())
+            log(f"控制接口: {CONTROL_ADDRESS}")
+        except OSError as e:
+            warn(f"⚠️ 无法开启控制接口 {CONTROL_ADDRESS}: {e}")
+    
+    if args.batch:
+        files = batch_open.collect_files(args.batch)
+        log(f"批量打开: {len(files)} 个文件")
+        control.batch = batch_open.start_batch(
+            files, batch_open.OPENERS[args.opener](), batch_open.HandlerSignal(watcher, workers),
+            log, control.stop, timeout=args.batch_timeout,
+            report=app_paths.app_file(BATCH_REPORT_FILE), check=not args.no_preflight,
+            journal=journal, retry_bad=args.retry_bad
+        )
     
     try:
-        while True:
-            scan_count += 1
-            if scan_count % 20 == 0:
-                log(f"扫描中... (已扫描 {scan_count} 次, 已处理 {handled_count} 个弹窗)")
+        while not control.stopping:
+            dialogs = watcher.next_dialogs()
             
-            dialogs = find_coreldraw_dialogs()
+            if watcher.swept:
+                scope.refresh()
+                scan_count += 1
+                if scan_count % 20 == 0:
+                    log(f"扫描中... (已扫描 {scan_count} 次, 已处理 {workers.handled_count} 个弹窗)")
+                    log(f"  {decisions.stats()}")
+                    log(f"  {text_budget.stats()}")
+                    log(f"  {actions.stats()}")
+                    decisions.save()
             
-            for hwnd, title in dialogs:
-                if hwnd in handled_hwnds:
-                    continue
-                
-                log(f"=" * 50)
-                log(f"检测到对话框: hwnd={hwnd}")
-                
-                if handle_popup(hwnd, title):
-                    handled_count += 1
-                    handled_hwnds.add(hwnd)
-                    log(f"✅ 已处理 {handled_count} 个弹窗")
-                    log(f"=" * 50)
+            # 随兜底扫描清理已关闭的窗口记录（hwnd 可能被新窗口复用）
+            if watcher.swept:
+                workers.prune(backend.is_window)
+                unmatched.prune(backend.is_window)
+                if journal is not None:
+                    journal.forget_closed(backend.is_window)
+                prune_detected_snapshots()
             
-            # 清理已关闭的窗口记录
-            handled_hwnds = {h for h in handled_hwnds if user32.IsWindow(h)}
+            # 在检测时记下正在打开的文件，超时后才处理完的弹窗仍归到原来的文件
+            if journal is not None and dialogs:
+                journal.note_dialogs(dialogs)
             
-            time.sleep(0.5)
+            # 暂停时照常检测，恢复后由下一次全量扫描重新发现
+            if not control.paused:
+                workers.submit(dialogs)
             
     except KeyboardInterrupt:
         print()
+    finally:
         log("-" * 60)
-        log(f"程序已退出，共处理 {handled_count} 个弹窗")
+        log(f"程序已退出，共处理 {workers.handled_count} 个弹窗")
+        log(decisions.stats())
+        log(unmatched.stats())
+        log(text_budget.stats())
+        log(actions.stats())
+        if isinstance(backend, window_backend.CachingBackend):
+            log(backend.stats())
+        if control.batch is not None:
+            control.batch.stop()
+        if control_server:
+            control_server.close()
+        workers.close()
+        watcher.close()
+        decisions.save()
+        if journal is not None:
+            log(journal.stats())
+            journal.stop()
+        if metrics_server:
+            metrics_server.shutdown()
+        if METRICS_DUMP_FILE:
+            telemetry.dump(app_paths.app_file(METRICS_DUMP_FILE))
+        log_writer.stop()
 
 
 if __name__ == "__main__":
+    # 打包成 exe 后预检的进程池需要（子进程从 exe 启动）
+    multiprocessing.freeze_support()
     if sys.platform != 'win32':
         print("❌ 此程序只能在 Windows 上运行！")
         sys.exit(1)
     
-    main()
+    main(sys.argv[1:])
@@ -4,21 +4,40 @@ CorelDRAW 弹窗自动处理工具 v5.0
 结合 Hook 获取 GDI 文本 + 精确获取当前弹窗的按钮
 """
 
-import time
 import sys
 import os
+import time
 import ctypes
-from ctypes import wintypes
-from datetime import datetime
-
-# Windows API
-user32 = ctypes.windll.user32
-kernel32 = ctypes.windll.kernel32
+import argparse
+import multiprocessing
+import threading
+import logging
+
+import app_paths
+import async_log
+import batch_open
+import click_actions
+import control_api
+import decision_cache
+import dialog_snapshot
+import dialog_workers
+import hook_protocol
+import metrics
+import outcome_journal
+import popup_rules
+import process_scope
+import process_watch
+import text_providers
+import win32_api
+import window_backend
+
+# Windows API（注入和共享内存只在 Windows 下可用；函数原型见 win32_api，句柄和地址不会被截断）
+kernel32 = win32_api.kernel32
+
+# 窗口系统后端（非 Windows 下可替换为 window_backend.FakeDesktop）
+backend = window_backend.default_backend()
 
 # 常量
-BM_CLICK = 0x00F5
-WM_GETTEXT = 0x000D
-WM_GETTEXTLENGTH = 0x000E
 GWL_STYLE = -16
 BS_DEFPUSHBUTTON = 0x0001
 BS_PUSHBUTTON = 0x0000
@@ -29,199 +48,315 @@ MEM_RESERVE = 0x2000
 PAGE_READWRITE = 0x04
 MEM_RELEASE = 0x8000
 
-# 共享内存
-SHARED_MEM_NAME = "CDRPopupHandlerSharedMem"
-MAX_TEXT_LENGTH = 4096
-MAX_TEXT_COUNT = 100
+# 共享内存（协议见 hook_protocol.py）
+SHARED_MEM_NAME = "CDRPopupHandlerSharedMemV3"
+
+# 检查 CorelDRAW 进程启动/退出的间隔（秒）
+PROCESS_POLL_INTERVAL = 2.0
+
+# 事件驱动模式下的兜底全量扫描间隔（秒）
+SAFETY_SCAN_INTERVAL = 5.0
+
+# 并发处理对话框的工作线程数（不同进程、互不相关的对话框同时处理）
+MAX_WORKERS = dialog_workers.DEFAULT_WORKERS
+
+# 读取控件文本的时间预算：单次最多等待 0.1 秒，每轮扫描累计最多 0.25 秒
+text_budget = window_backend.TextBudget(call_timeout=0.1, scan_budget=0.25)
+
+# CorelDRAW 进程范围：只检查 CorelDRAW 进程的对话框
+scope = process_scope.ProcessScope(backend)
+
+# 点击动作（确认状态，代替固定等待）
+actions = click_actions.ActionExecutor(backend)
+
+# 编译后的弹窗规则
+rule_engine = popup_rules.compile_rules(popup_rules.HOOK_RULES)
+
+# 弹窗决策缓存（main 中加载）
+DECISION_CACHE_FILE = "decision_cache_hook.json"
+decisions = None
+
+# 未匹配任何规则的对话框：内容（控件和 Hook 文本）和规则集都没变时不再重复匹配，按计划拉长复查间隔
+unmatched = decision_cache.UnmatchedCache()
+
+# UI Automation 文本来源（Windows 下装有 comtypes 时可用，None 表示不使用）：
+# Win32 快照无法确定规则时先用它补充文本，仍无法确定时才读取 Hook 文本
+uia = text_providers.default_uia()
+
+# 结果日志：每个处理过的弹窗和批量打开的每个文件的结果（程序目录下的 SQLite 数据库，None 表示不记录），
+# 批量打开时跳过之前打不开的文件（main 中打开）
+JOURNAL_FILE = "outcomes_hook.db"
+journal = None
+
+# 运行指标：本机 http://127.0.0.1:9465/metrics（Prometheus 格式，0 表示不开启），
+# 退出时保存到程序目录下的 JSON 文件（None 表示不保存）
+METRICS_PORT = 9465
+METRICS_DUMP_FILE = "metrics_hook.json"
+telemetry = metrics.Registry()
+
+
+def collect_metrics():
+    """导出指标时读取各统计对象的计数"""
+    return (metrics.budget_samples(text_budget) + metrics.action_samples(actions)
+            + metrics.decision_samples(decisions))
+
+
+telemetry.add_collector(collect_metrics)
+
+# 日志：后台线程写控制台和程序目录下的滚动日志文件（None 表示不写文件），
+# 逐个控件的详细信息只在 DEBUG 级别输出
+LOG_LEVEL = logging.INFO
+LOG_FILE = "cdr_popup_hook.log"
+logger = async_log.get_logger('cdr_popup.hook')
+
+# 控制接口：Windows 下的命名管道（None 表示不开启），
+# 用 python control_api.py --hook 查看统计、暂停/恢复、dry-run、热更新规则
+CONTROL_ADDRESS = control_api.default_address('hook')
+
+# 批量打开模式（--batch）：每个文件的结果写到程序目录下的 CSV 报告
+BATCH_REPORT_FILE = "batch_report_hook.csv"
+
+
+def log(msg, storm=None):
+    """记录日志（只入队，由后台线程输出）；storm 相同的记录短时间内重复出现时合并成一行汇总"""
+    logger.info(msg, extra={'storm': storm} if storm else None)
 
-# 回调类型
-EnumWindowsProc = ctypes.WINFUNCTYPE(ctypes.c_bool, wintypes.HWND, wintypes.LPARAM)
-EnumChildProc = ctypes.WINFUNCTYPE(ctypes.c_bool, wintypes.HWND, wintypes.LPARAM)
 
+def warn(msg):
+    logger.warning(msg)
 
-def log(msg):
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] {msg}")
+
+def debug(msg, *args):
+    """调试日志（参数在输出时才格式化）"""
+    logger.debug(msg, *args)
 
 
 def get_window_text(hwnd):
     """获取窗口标题"""
-    length = user32.GetWindowTextLengthW(hwnd) + 1
-    buffer = ctypes.create_unicode_buffer(length)
-    user32.GetWindowTextW(hwnd, buffer, length)
-    return buffer.value
+    return backend.get_window_text(hwnd)
 
 
 def get_control_text(hwnd):
-    """获取控件文本（包括用 WM_GETTEXT）"""
-    # 先用 GetWindowText
-    text = get_window_text(hwnd)
-    if text:
-        return text
-    
-    # 再用 WM_GETTEXT
-    length = user32.SendMessageW(hwnd, WM_GETTEXTLENGTH, 0, 0)
-    if length > 0:
-        buffer = ctypes.create_unicode_buffer(length + 1)
-        user32.SendMessageW(hwnd, WM_GETTEXT, length + 1, buffer)
-        return buffer.value
-    
-    return ""
+    """获取控件文本（包括用 WM_GETTEXT），窗口无响应时返回 None"""
+    return text_budget.get_text(backend, hwnd)
 
 
 def get_class_name(hwnd):
     """获取类名"""
-    buffer = ctypes.create_unicode_buffer(256)
-    user32.GetClassNameW(hwnd, buffer, 256)
-    return buffer.value
-
-
-def is_button(hwnd):
-    """检查是否是按钮"""
-    class_name = get_class_name(hwnd)
-    return 'Button' in class_name or 'BUTTON' in class_name.upper()
+    return backend.get_class_name(hwnd)
 
 
 def find_child_windows(parent_hwnd):
     """获取所有子窗口"""
-    children = []
-    def callback(hwnd, lparam):
-        children.append(hwnd)
-        return True
-    user32.EnumChildWindows(parent_hwnd, EnumChildProc(callback), 0)
-    return children
+    return backend.enum_child_windows(parent_hwnd)
 
 
 def get_dialog_info(hwnd):
-    """获取对话框的所有信息"""
-    info = {
-        'title': get_window_text(hwnd),
-        'buttons': [],
-        'texts': [],
-        'all_content': []
-    }
-    
-    children = find_child_windows(hwnd)
-    
-    for child in children:
-        text = get_control_text(child)
-        class_name = get_class_name(child)
-        
-        if not text:
-            continue
-        
-        info['all_content'].append(text)
-        
-        if is_button(child):
-            info['buttons'].append({
-                'hwnd': child,
-                'text': text,
-                'class': class_name
-            })
-        else:
-            info['texts'].append(text)
-    
-    return info
-
-
-def click_button(hwnd):
-    """点击按钮"""
-    user32.SendMessageW(hwnd, BM_CLICK, 0, 0)
-    time.sleep(0.1)
+    """获取对话框的所有信息（一次遍历生成快照）"""
+    telemetry.inc('child_walks_total')
+    return dialog_snapshot.take_snapshot(backend, hwnd, budget=text_budget)
+
+
+def click_button(dialog_info, btn):
+    """点击按钮，确认对话框已经关闭返回 True，没有关闭返回 click_actions.ATTEMPTED"""
+    method = actions.press_button(dialog_info.hwnd, btn.hwnd, btn.control_id)
+    if method == click_actions.ATTEMPTED:
+        warn("  ⚠️ 点击后对话框没有关闭")
+        return method
+    if method != 'click':
+        log(f"  -> BM_CLICK 无效，已通过 {method} 关闭对话框")
     return True
 
 
+def check_radio(btn):
+    """选中单选按钮，确认选中状态"""
+    debug("  >>> 选择: '%s'", btn.text)
+    if not actions.check_radio(btn.hwnd):
+        warn("  ⚠️ 单选按钮没有变为选中状态")
+
+
+def find_button_by_text(dialog_info, button_texts):
+    """根据按钮文本或语义动作（button_labels）精确查找按钮"""
+    return dialog_info.find_button(button_texts)
+
+
 def click_button_by_text(dialog_info, button_texts):
-    """根据文本点击按钮"""
-    if isinstance(button_texts, str):
-        button_texts = [button_texts]
-    
-    for btn in dialog_info['buttons']:
-        btn_text = btn['text']
-        for target in button_texts:
-            # 多种匹配方式
-            if (target.lower() == btn_text.lower() or
-                target.lower() in btn_text.lower() or
-                target.replace('&', '') == btn_text.replace('&', '') or
-                target in btn_text):
-                log(f"  >>> 点击按钮: '{btn_text}'")
-                click_button(btn['hwnd'])
-                return True
-    
-    return False
+    """根据文本点击按钮，返回点击的按钮文本"""
+    btn = find_button_by_text(dialog_info, button_texts)
+    if btn is None:
+        return None
+    debug("  >>> 点击按钮: '%s'", btn.text)
+    if click_button(dialog_info, btn) is not True:
+        return None
+    return btn.text
+
+
+def select_radio(dialog_info, radio_texts):
+    """选中单选按钮，返回选中的按钮文本"""
+    btn = find_button_by_text(dialog_info, radio_texts)
+    if btn is None:
+        return None
+    check_radio(btn)
+    return btn.text
+
+
+def find_button_by_label(dialog_info, label):
+    """按完整的按钮文本查找（用于重放缓存的决策）"""
+    for btn in dialog_info.buttons:
+        if btn.text == label:
+            return btn
+    return None
+
+
+def execute_rule(dialog_info, rule):
+    """
+    执行规则对应的动作，成功时返回可缓存的决策；找不到按钮（没有点击任何控件）返回 None，
+    点击后对话框没有关闭返回 click_actions.ATTEMPTED
+    """
+    # 先找到要点击的按钮，找不到时不动这个对话框
+    btn = find_button_by_text(dialog_info, rule.targets)
+    if btn is None:
+        return None
+    radio = None
+    if rule.action == popup_rules.ACTION_RADIO_OK:
+        radio = select_radio(dialog_info, rule.radio)
+    debug("  >>> 点击按钮: '%s'", btn.text)
+    if click_button(dialog_info, btn) is not True:
+        return click_actions.ATTEMPTED
+    return {'rule': rule.name, 'radio': radio, 'button': btn.text}
+
+
+def replay_decision(dialog_info, decision):
+    """重放缓存的决策：返回 True、False（找不到控件，没有点击）或 click_actions.ATTEMPTED"""
+    btn = find_button_by_label(dialog_info, decision['button'])
+    if btn is None:
+        return False
+    if decision.get('radio'):
+        radio = find_button_by_label(dialog_info, decision['radio'])
+        if radio is None:
+            return False
+        check_radio(radio)
+    debug("  >>> 点击按钮: '%s'", btn.text)
+    return click_button(dialog_info, btn)
 
 
 class SharedMemory:
-    """共享内存读取"""
+    """
+    共享内存读取（协议 v3：环形缓冲区 + 读取游标，不再清空）
+    视图在进程生命周期内只映射一次，文本直接从 memoryview 解码，
+    并按来源顶层窗口建立索引
+    """
     
     def __init__(self):
         self.handle = None
-        self.size = 4 + 8 + (MAX_TEXT_COUNT * MAX_TEXT_LENGTH * 2) + 4
+        self.address = None
+        self.view = None
+        self.size = hook_protocol.total_size()
+        self.reader = hook_protocol.RingReader()
+        self.index = hook_protocol.WindowTextIndex()
+        self.version_warned = False
+        # 多个工作线程同时读取，读取游标和索引需要加锁
+        self._lock = threading.RLock()
     
     def create(self):
         self.handle = kernel32.CreateFileMappingW(
             ctypes.c_void_p(-1), None, PAGE_READWRITE, 0, self.size, SHARED_MEM_NAME
         )
-        return self.handle is not None
-    
-    def read_texts(self):
         if not self.handle:
-            return []
+            return False
         
-        pBuf = kernel32.MapViewOfFile(self.handle, 0xF001F, 0, 0, self.size)
-        if not pBuf:
-            return []
+        self.address = kernel32.MapViewOfFile(self.handle, 0xF001F, 0, 0, self.size)
+        if not self.address:
+            self.close()
+            return False
         
-        try:
-            import struct
-            count_buf = (ctypes.c_char * 4)()
-            ctypes.memmove(count_buf, pBuf, 4)
-            text_count = struct.unpack('I', bytes(count_buf))[0]
-            
-            if text_count > MAX_TEXT_COUNT:
-                text_count = MAX_TEXT_COUNT
-            
-            texts = []
-            offset = 4 + 8
-            
-            for i in range(text_count):
-                text_buf = (ctypes.c_wchar * MAX_TEXT_LENGTH)()
-                ctypes.memmove(text_buf, pBuf + offset, MAX_TEXT_LENGTH * 2)
-                text = text_buf.value
-                if text and len(text) > 1:  # 过滤单字符噪音
-                    texts.append(text)
-                offset += MAX_TEXT_LENGTH * 2
-            
-            return texts
-        finally:
-            kernel32.UnmapViewOfFile(pBuf)
+        self.view = memoryview((ctypes.c_char * self.size).from_address(self.address)).cast('B')
+        # DLL 可能已经先初始化过（处理程序重启的情况）
+        if not hook_protocol.is_initialized(self.view):
+            hook_protocol.init_header(self.view)
+        return True
     
-    def clear(self):
-        if not self.handle:
+    def attach(self, buf):
+        """使用进程内的缓冲区代替文件映射（回放基准中由 hook_protocol.RingWriter 写入）"""
+        self.view = memoryview(buf).cast('B')
+        if not hook_protocol.is_initialized(self.view):
+            hook_protocol.init_header(self.view)
+    
+    @property
+    def seq(self):
+        """最近读到的记录序号"""
+        return self.reader.seq
+    
+    def update(self):
+        """把上次读取之后新写入的记录加入窗口索引"""
+        if self.view is None:
             return
-        pBuf = kernel32.MapViewOfFile(self.handle, 0xF001F, 0, 0, self.size)
-        if pBuf:
-            zero = (ctypes.c_char * 4)()
-            ctypes.memmove(pBuf, zero, 4)
-            kernel32.UnmapViewOfFile(pBuf)
+        
+        with self._lock:
+            try:
+                records = self.reader.read(self.view)
+            except hook_protocol.ProtocolError as e:
+                if not self.version_warned:
+                    warn(f"⚠️ 共享内存协议不匹配（{e}），请更新 gdi_hook.dll")
+                    self.version_warned = True
+                return
+            
+            self.index.add(records)
+    
+    def window_seq(self, hwnd):
+        """指定弹窗最近一条 Hook 文本的序号（用于判断弹窗是否还在绘制）"""
+        with self._lock:
+            self.update()
+            return self.index.seq(hwnd)
+    
+    def read_texts(self, hwnd):
+        """读取绘制在指定弹窗（及其子控件）上的文本"""
+        with self._lock:
+            self.update()
+            texts = self.index.get(hwnd)
+        # 过滤单字符噪音
+        return [text for text in texts if len(text) > 1]
+    
+    def prune(self, is_alive):
+        """丢弃已关闭窗口的文本"""
+        with self._lock:
+            self.index.prune(is_alive)
+    
+    def metric_samples(self):
+        """读取共享内存的指标"""
+        return [
+            (metrics.COUNTER, 'hook_bytes_read_total', (), self.reader.bytes_read),
+            (metrics.COUNTER, 'hook_records_lost_total', (), self.reader.lost),
+        ]
     
     def close(self):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.address:
+            kernel32.UnmapViewOfFile(ctypes.c_void_p(self.address))
+            self.address = None
         if self.handle:
             kernel32.CloseHandle(self.handle)
             self.handle = None
 
 
 class DLLInjector:
-    """DLL 注入器"""
+    """
+    DLL 注入器（按 (pid, 启动时间) 跟踪 CorelDRAW 进程，重启后自动重新注入）
+    Hook DLL 只修补注入时已经加载的模块，所以等进程显示主窗口（ready(pid)）后才注入
+    """
     
-    def __init__(self, dll_path):
+    def __init__(self, dll_path, table=None, ready=None):
         self.dll_path = os.path.abspath(dll_path)
-        self.injected_pids = set()
+        if table is None:
+            table = process_watch.Win32ProcessTable()
+        watcher = process_watch.ProcessWatcher(
+            table, process_scope.CORELDRAW_IMAGES, interval=PROCESS_POLL_INTERVAL
+        )
+        self.tracker = process_watch.InjectionTracker(watcher, self.inject, ready)
     
     def inject(self, pid):
-        if pid in self.injected_pids:
-            return True
-        
         hProcess = kernel32.OpenProcess(PROCESS_ALL_ACCESS, False, pid)
         if not hProcess:
             return False
@@ -255,111 +390,244 @@ class DLLInjector:
             kernel32.CloseHandle(hThread)
             kernel32.VirtualFreeEx(hProcess, pRemoteMem, 0, MEM_RELEASE)
             
-            self.injected_pids.add(pid)
             log(f"✅ DLL 注入成功: PID {pid}")
             return True
         finally:
             kernel32.CloseHandle(hProcess)
     
     def inject_coreldraw(self):
-        def callback(hwnd, lparam):
-            if user32.IsWindowVisible(hwnd):
-                title = get_window_text(hwnd)
-                if 'CorelDRAW' in title:
-                    pid = ctypes.c_ulong()
-                    user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
-                    if pid.value and pid.value not in self.injected_pids:
-                        log(f"发现 CorelDRAW: PID {pid.value}")
-                        self.inject(pid.value)
-            return True
-        user32.EnumWindows(EnumWindowsProc(callback), 0)
-
-
-def handle_popup(hwnd, dialog_info, hook_texts):
-    """处理弹窗"""
-    title = dialog_info['title']
-    buttons = [b['text'] for b in dialog_info['buttons']]
-    texts = dialog_info['texts']
-    
-    # 合并所有文本来源
-    all_text = ' '.join(dialog_info['all_content'] + hook_texts)
-    
-    log(f"=" * 50)
-    log(f"弹窗标题: '{title}'")
-    log(f"按钮列表: {buttons}")
-    log(f"静态文本: {texts}")
-    log(f"Hook文本: {hook_texts[:5]}...")  # 只显示前5个
-    log(f"合并内容: {all_text[:200]}...")
-    
-    # ========== 规则匹配 ==========
-    
-    # 规则1: 无效的轮廓 ID -> 点击忽略
-    if '无效' in all_text and '轮廓' in all_text:
-        log("  -> 匹配: 无效的轮廓 ID")
-        if click_button_by_text(dialog_info, ['忽略', '忽略(&I)', 'Ignore']):
-            return True
-    
-    # 规则2: 如果只有一个 OK 按钮，直接点击
-    if len(buttons) == 1 and ('OK' in buttons[0] or '确定' in buttons[0]):
-        log("  -> 匹配: 单个 OK 按钮")
-        if click_button_by_text(dialog_info, ['OK', '确定']):
-            return True
-    
-    # 规则3: 无效标头 / 无法打开 -> OK
-    if '无法打开' in all_text or '无效标头' in all_text or '无效的' in all_text:
-        log("  -> 匹配: 无效/无法打开")
-        if click_button_by_text(dialog_info, ['OK', '确定', '忽略', '忽略(&I)']):
-            return True
-    
-    # 规则4: 文件损坏 -> OK
-    if '损坏' in all_text:
-        log("  -> 匹配: 文件损坏")
-        if click_button_by_text(dialog_info, ['OK', '确定']):
-            return True
-    
-    # 规则5: PS/PRN 导入
-    if 'PS/PRN' in all_text:
-        log("  -> 匹配: PS/PRN")
-        click_button_by_text(dialog_info, ['曲线', '曲线(&C)'])
-        time.sleep(0.2)
-        if click_button_by_text(dialog_info, ['OK', '确定']):
-            return True
-    
-    # 规则6: 有 忽略 按钮且包含错误关键词
-    if any('忽略' in b for b in buttons):
-        if any(kw in all_text for kw in ['错误', '无效', '失败', '问题', 'error', 'invalid']):
-            log("  -> 匹配: 错误 + 忽略按钮")
-            if click_button_by_text(dialog_info, ['忽略', '忽略(&I)']):
+        """检查 CorelDRAW 进程的启动/退出（到期才真正检查），注入新启动的进程"""
+        injected, exited = self.tracker.update()
+        for proc in exited:
+            log(f"CorelDRAW 已退出: PID {proc.pid}")
+        return injected
+
+
+def merge_text(dialog_info, hook_texts):
+    """合并所有文本来源（Hook 文本只包含绘制在该弹窗上的文本）"""
+    return ' '.join([dialog_info.content] + list(hook_texts)) if hook_texts else dialog_info.content
+
+
+def record_outcome(hwnd, pid, title, fingerprint, decision, source, started):
+    """把处理结果记入结果日志（只入队，后台线程批量写入）"""
+    action = decision['button'] if not decision.get('radio') else f"{decision['radio']} + {decision['button']}"
+    latency = time.perf_counter() - started if started is not None else None
+    journal.record_dialog(pid, scope.image_name(pid), title, fingerprint, decision['rule'], source, action, latency,
+                          hwnd=hwnd)
+
+
+def unconfirmed(title):
+    """点击消息已经发出但对话框没有关闭：不再尝试其它规则"""
+    log(f"点击后对话框没有关闭，不再重复点击: '{title}'", storm=('unconfirmed', title))
+    return click_actions.ATTEMPTED
+
+
+def handle_popup(hwnd, dialog_info, providers=(), started=None):
+    """
+    处理弹窗（started 是开始处理的时间，用于结果日志中的耗时）
+    providers 是按代价从低到高排列的补充文本来源（text_providers），补充文本可能改变要执行的规则时才使用下一个
+    返回 True（已处理）、False（没有匹配的规则，没有点击）或 click_actions.ATTEMPTED（已点击但对话框没有关闭）
+    """
+    title = dialog_info.title
+    # 点击后窗口就关闭了，进程在处理前取
+    pid = backend.get_window_pid(hwnd) if journal is not None else 0
+    buttons = dialog_info.button_texts
+    texts = list(dialog_info.texts)
+    all_text = dialog_info.content
+    # 整个弹窗使用同一个规则集（控制接口可能在处理过程中替换规则）
+    engine = rule_engine
+    
+    debug("弹窗标题: '%s'", title)
+    debug("按钮列表: %s", buttons)
+    debug("静态文本: %s", texts)
+    
+    # ========== 决策缓存 ==========
+    # 每个弹窗只查一次，按 Win32 快照的指纹
+    
+    fingerprint = decision_cache.dialog_fingerprint(title, dialog_info.structure, buttons, all_text)
+    if decisions is not None:
+        decision = decisions.get(fingerprint)
+        if decision:
+            debug("  -> 命中决策缓存: %s", decision['rule'])
+            replayed = replay_decision(dialog_info, decision)
+            if replayed is True:
+                log(f"✅ 成功重放决策: '{title}' -> {decision['rule']}", storm=('handled', title, decision['rule']))
+                telemetry.inc('rule_hits_total', labels=(('rule', decision['rule']), ('source', 'cache')))
+                if journal is not None:
+                    record_outcome(hwnd, pid, title, fingerprint, decision, 'cache', started)
                 return True
-    
-    # 规则7: 通用 - 如果有 OK/确定 按钮且是 CorelDRAW 弹窗
-    if 'CorelDRAW' in title:
-        if click_button_by_text(dialog_info, ['OK', '确定', '是', '是(&Y)', 'Yes']):
-            log("  -> 匹配: CorelDRAW 通用弹窗")
+            decisions.discard(fingerprint)
+            if replayed == click_actions.ATTEMPTED:
+                return unconfirmed(title)
+    
+    # ========== 文本分层 + 规则匹配 ==========
+    # 先只用 Win32 快照，补充文本可能改变要执行的规则时依次补充 UI Automation 文本、Hook 文本
+    extra = []
+    # 用到了补充文本来源的弹窗不缓存决策：只凭 Win32 快照的指纹不能确定规则
+    cacheable = True
+    for provider in (None,) + tuple(providers):
+        if provider is not None:
+            cacheable = False
+            added = provider.texts(hwnd, dialog_info)
+            if not added:
+                continue
+            extra += added
+            all_text = merge_text(dialog_info, extra)
+            debug("%s 文本: %s...", provider.name, added[:5])  # 只显示前5个
+        telemetry.inc('text_tier_total', labels=(('tier', provider.name if provider else 'win32'),))
+        debug("合并内容: %s...", all_text[:200])
+        
+        start = time.perf_counter()
+        matched = engine.match(all_text, title, buttons)
+        telemetry.observe('rule_eval_seconds', time.perf_counter() - start)
+        if not popup_rules.needs_more_text(engine, matched, dialog_info, buttons):
+            break
+    
+    for rule in matched:
+        debug("  -> 匹配: %s", rule.description)
+        decision = execute_rule(dialog_info, rule)
+        if decision == click_actions.ATTEMPTED:
+            return unconfirmed(title)
+        if decision:
+            log(f"✅ 成功处理: '{title}' -> {rule.description}", storm=('handled', title, rule.name))
+            telemetry.inc('rule_hits_total', labels=(('rule', rule.name), ('source', 'rules')))
+            if decisions is not None and cacheable:
+                decisions.put(fingerprint, decision, engine.version)
+            if journal is not None:
+                record_outcome(hwnd, pid, title, fingerprint, decision, 'rules', started)
             return True
     
-    log("  -> 未匹配任何规则")
+    log(f"未匹配任何规则: '{title}'", storm=('unmatched', title))
     return False
 
 
+def take_snapshot(hwnd):
+    """在控制接口的线程中读取对话框快照（单独计算文本读取预算）"""
+    text_budget.start()
+    return get_dialog_info(hwnd)
+
+
+def dry_run(dialog_info, hook_texts=()):
+    """只匹配规则不点击（控制接口）：匹配的规则、会点击的按钮、缓存中的决策"""
+    engine = rule_engine
+    buttons = dialog_info.button_texts
+    all_text = merge_text(dialog_info, hook_texts)
+    cached = None
+    if decisions is not None:
+        cached = decisions.peek(decision_cache.dialog_fingerprint(
+            dialog_info.title, dialog_info.structure, buttons, all_text
+        ))
+    return control_api.dry_run_report(dialog_info, engine.match(all_text, dialog_info.title, buttons), cached)
+
+
+def swap_rules(rules):
+    """原子地替换规则集（控制接口热更新规则），返回新的规则集版本"""
+    global rule_engine
+    engine = popup_rules.compile_rules(rules)
+    rule_engine = engine
+    if decisions is not None:
+        decisions.set_rules_version(engine.version)
+    log(f"规则已更新: {len(engine.rules)} 条 (版本 {engine.version})")
+    return engine.version
+
+
+def is_coreldraw_dialog(hwnd):
+    """判断顶层窗口是否是 CorelDRAW 对话框"""
+    # #32770 是标准对话框类
+    if get_class_name(hwnd) != '#32770':
+        return False
+    # 只关注 CorelDRAW 进程的对话框
+    if not scope.contains(hwnd):
+        return False
+    title = get_window_text(hwnd)
+    return 'CorelDRAW' in title or 'Corel' in title
+
+
 def find_coreldraw_dialogs():
     """查找 CorelDRAW 对话框"""
-    dialogs = []
-    
-    def callback(hwnd, lparam):
-        if user32.IsWindowVisible(hwnd):
-            title = get_window_text(hwnd)
-            class_name = get_class_name(hwnd)
-            # #32770 是标准对话框类
-            if class_name == '#32770' and ('CorelDRAW' in title or 'Corel' in title):
-                dialogs.append(hwnd)
+    return [hwnd for hwnd in backend.enum_windows()
+            if backend.is_window_visible(hwnd) and is_coreldraw_dialog(hwnd)]
+
+
+def process_dialog(watcher, hwnd, stability, shared_mem=None):
+    """处理一个对话框（在工作线程中运行），返回是否已处理；没处理掉的放回 watcher 的重试队列"""
+    started = time.perf_counter()
+    # 每个对话框单独计算文本读取预算
+    text_budget.start()
+    # 获取对话框信息
+    dialog_info = get_dialog_info(hwnd)
+    if not dialog_info.complete:
+        # 窗口没有响应（CorelDRAW 正忙），不阻塞其它弹窗，稍后重试
+        log(f"对话框暂无响应，稍后重试: '{dialog_info.title}'", storm=('busy', dialog_info.title))
+        watcher.defer(hwnd, slow=True)
+        return False
+    
+    # 内容还在变化（控件文本、Hook 文本）时稍后再看，不阻塞其它弹窗
+    hook_seq = shared_mem.window_seq(hwnd) if shared_mem else 0
+    wait = stability.observe(hwnd, (dialog_info.signature, hook_seq))
+    if wait:
+        watcher.defer(hwnd, delay=wait)
+        return False
+    
+    # 内容和规则集都没变的未匹配对话框不再读取 Hook 文本、匹配规则，只推迟下次复查
+    version = (dialog_info.title, dialog_info.signature, hook_seq)
+    rules_version = rule_engine.version
+    if unmatched.seen(hwnd, version, rules_version):
+        telemetry.inc('unmatched_skips_total')
+        watcher.defer(hwnd, delay=unmatched.record(hwnd, version, rules_version), hold=True)
+        return False
+    
+    # 补充文本来源：Win32 快照无法确定规则时才使用（UI Automation 不需要注入，比 Hook 文本优先）
+    providers = [uia] if uia is not None else []
+    if shared_mem:
+        providers.append(text_providers.HookTextProvider(shared_mem))
+    
+    result = handle_popup(hwnd, dialog_info, providers, started)
+    if result == click_actions.ATTEMPTED:
+        # 点击消息已经发出，不能再操作这个对话框：当作已处理（DialogWorkers 不再提交它），
+        # 暂缓到兜底扫描间隔后再看是否关闭
+        unmatched.discard(hwnd)
+        watcher.defer(hwnd, delay=watcher.safety_interval, hold=True)
         return True
-    
-    user32.EnumWindows(EnumWindowsProc(callback), 0)
-    return dialogs
+    if result:
+        unmatched.discard(hwnd)
+        telemetry.inc('popups_handled_total')
+        debug("弹窗已处理: hwnd=%s", hwnd)
+        return True
+    watcher.defer(hwnd, delay=unmatched.record(hwnd, version, rules_version), hold=True)
+    return False
 
 
-def main():
+def changed_unmatched(shared_mem):
+    """Hook 文本有更新的未匹配对话框（只比较共享内存中的序号，不读取控件）"""
+    return [hwnd for hwnd, version in unmatched.versions() if version[2] != shared_mem.window_seq(hwnd)]
+
+
+def dialog_lane(hwnd):
+    """同一条所有者链上的对话框按顺序处理，其它对话框并发处理"""
+    return dialog_workers.dialog_lane(backend, hwnd)
+
+
+def main(argv=()):
+    parser = argparse.ArgumentParser(description='CorelDRAW 弹窗自动处理工具（Hook 版）')
+    parser.add_argument('--daemon', action='store_true',
+                        help='常驻模式：日志只写文件，通过控制接口（control_api.py --hook）管理')
+    parser.add_argument('--batch', nargs='+', metavar='路径',
+                        help='依次打开目录（或 .txt 文件列表）中的 .cdr/.ps/.prn 文件，全部打开后退出')
+    parser.add_argument('--opener', choices=sorted(batch_open.OPENERS), default='com',
+                        help='批量打开的方式：com（CorelDRAW 自动化）或 shell（关联程序）')
+    parser.add_argument('--batch-timeout', type=float, default=batch_open.DEFAULT_TIMEOUT,
+                        help='单个文件的超时（秒），超时后跳过')
+    parser.add_argument('--no-preflight', action='store_true',
+                        help='批量打开前不检查文件头（默认跳过 CorelDRAW 打不开的文件）')
+    parser.add_argument('--retry-bad', action='store_true',
+                        help='批量打开时重新打开结果日志中之前打不开的文件（默认跳过）')
+    args = parser.parse_args(argv)
+    
+    log_writer = async_log.setup(
+        logger, LOG_LEVEL, app_paths.app_file(LOG_FILE) if LOG_FILE else None,
+        console=not args.daemon
+    )
     print("=" * 60)
     print("CorelDRAW 弹窗自动处理工具 v5.0")
     print("=" * 60)
@@ -381,9 +649,10 @@ def main():
         log(f"Hook DLL: {dll_path}")
         shared_mem = SharedMemory()
         shared_mem.create()
-        injector = DLLInjector(dll_path)
+        telemetry.add_collector(shared_mem.metric_samples)
+        injector = DLLInjector(dll_path, ready=lambda pid: scope.has_main_window(pid))
     else:
-        log("⚠️ 未找到 gdi_hook.dll，将只使用标准 API")
+        warn("⚠️ 未找到 gdi_hook.dll，将只使用标准 API")
         shared_mem = None
         injector = None
     
@@ -392,61 +661,146 @@ def main():
     log("按 Ctrl+C 退出")
     print("-" * 60)
     
-    handled_count = 0
-    handled_hwnds = set()
+    global decisions, journal
+    decisions = decision_cache.DecisionCache(
+        rule_engine.version, app_paths.app_file(DECISION_CACHE_FILE)
+    )
+    if decisions.load():
+        log(f"已加载决策缓存: {len(decisions.entries)} 条")
+    if JOURNAL_FILE:
+        try:
+            journal = outcome_journal.OutcomeJournal(app_paths.app_file(JOURNAL_FILE))
+        except OSError as e:
+            warn(f"⚠️ {e}")
+    
+    # 快照和 Hook 序号都不再变化时才处理弹窗
+    stability = window_backend.StabilityTracker()
+    
+    # 窗口创建/显示事件触发检测，全量扫描只作为兜底
+    watcher = window_backend.DialogWatcher(
+        backend, is_coreldraw_dialog, safety_interval=SAFETY_SCAN_INTERVAL,
+        budget=text_budget, metrics=telemetry
+    )
+    if watcher.event_driven:
+        log(f"事件驱动检测已启用（兜底扫描间隔 {SAFETY_SCAN_INTERVAL} 秒）")
+    else:
+        warn("⚠️ 无法注册窗口事件，使用轮询检测")
+    
+    # 检测在主线程，处理交给工作线程；每个 hwnd 同时只有一个任务，处理成功后不再提交
+    workers = dialog_workers.DialogWorkers(
+        lambda hwnd: process_dialog(watcher, hwnd, stability, shared_mem), dialog_lane, max_workers=MAX_WORKERS
+    )
+    
+    metrics_server = None
+    if METRICS_PORT:
+        try:
+            metrics_server = metrics.serve(telemetry, METRICS_PORT)
+            log(f"运行指标: http://127.0.0.1:{METRICS_PORT}/metrics")
+        except OSError as e:
+            warn(f"⚠️ 无法开启指标端口 {METRICS_PORT}: {e}")
+    
+    def dry_run_with_hook(dialog_info):
+        hook_texts = shared_mem.read_texts(dialog_info.hwnd) if shared_mem and dialog_info.hwnd else ()
+        return dry_run(dialog_info, hook_texts)
+    
+    control = control_api.HandlerControl(
+        sys.modules[__name__], workers,
+        take_snapshot=take_snapshot, dry_run=dry_run_with_hook, wake=watcher.request_sweep
+    )
+    control_server = None
+    if CONTROL_ADDRESS:
+        try:
+            control_server = control_api.ControlServer(CONTROL_ADDRESS, control.commands())
+            log(f"控制接口: {CONTROL_ADDRESS}")
+        except OSError as e:
+            warn(f"⚠️ 无法开启控制接口 {CONTROL_ADDRESS}: {e}")
+    
+    if args.batch:
+        files = batch_open.collect_files(args.batch)
+        log(f"批量打开: {len(files)} 个文件")
+        control.batch = batch_open.start_batch(
+            files, batch_open.OPENERS[args.opener](), batch_open.HandlerSignal(watcher, workers),
+            log, control.stop, timeout=args.batch_timeout,
+            report=app_paths.app_file(BATCH_REPORT_FILE), check=not args.no_preflight,
+            journal=journal, retry_bad=args.retry_bad
+        )
     
     try:
-        while True:
-            # 注入 DLL
+        while not control.stopping:
+            # 查找对话框
+            dialogs = watcher.next_dialogs()
+            
+            # 注入新启动的 CorelDRAW 进程（按 PROCESS_POLL_INTERVAL 检查）
             if injector:
                 injector.inject_coreldraw()
             
-            # 查找对话框
-            dialogs = find_coreldraw_dialogs()
+            # 保存决策缓存（随兜底扫描进行）
+            if watcher.swept:
+                scope.refresh()
+                decisions.save()
             
-            for hwnd in dialogs:
-                if hwnd in handled_hwnds:
-                    continue
-                
-                # 等待一下让内容稳定
-                time.sleep(0.3)
-                
-                # 获取对话框信息
-                dialog_info = get_dialog_info(hwnd)
-                
-                # 获取 Hook 文本
-                hook_texts = []
+            # 随兜底扫描清理已关闭的窗口（hwnd 可能被新窗口复用）
+            if watcher.swept:
+                workers.prune(backend.is_window)
+                stability.prune(backend.is_window)
+                unmatched.prune(backend.is_window)
+                if journal is not None:
+                    journal.forget_closed(backend.is_window)
                 if shared_mem:
-                    hook_texts = shared_mem.read_texts()
-                
-                if handle_popup(hwnd, dialog_info, hook_texts):
-                    handled_count += 1
-                    handled_hwnds.add(hwnd)
-                    log(f"✅ 已处理 {handled_count} 个弹窗")
-                
-                # 清空 Hook 缓存
-                if shared_mem:
-                    shared_mem.clear()
+                    shared_mem.prune(backend.is_window)
+            
+            # 未匹配的对话框上有新的 Hook 文本时重新检查：只比较共享内存中的序号，每次循环都做。
+            # Hook 文本不产生窗口事件，最晚在下一次窗口事件、到期复查或兜底扫描唤醒循环时发现
+            if shared_mem:
+                changed = changed_unmatched(shared_mem)
+                if changed:
+                    watcher.recheck(changed)
             
-            # 清理已关闭的窗口
-            handled_hwnds = {h for h in handled_hwnds if user32.IsWindow(h)}
+            # 在检测时记下正在打开的文件，超时后才处理完的弹窗仍归到原来的文件
+            if journal is not None and dialogs:
+                journal.note_dialogs(dialogs)
             
-            time.sleep(0.5)
+            # 暂停时照常检测，恢复后由下一次全量扫描重新发现
+            if not control.paused:
+                workers.submit(dialogs)
             
     except KeyboardInterrupt:
         print()
-        log(f"程序退出，共处理 {handled_count} 个弹窗")
     finally:
+        log(f"程序退出，共处理 {workers.handled_count} 个弹窗")
+        log(decisions.stats())
+        log(unmatched.stats())
+        log(text_budget.stats())
+        log(actions.stats())
+        if isinstance(backend, window_backend.CachingBackend):
+            log(backend.stats())
+        if control.batch is not None:
+            control.batch.stop()
+        if control_server:
+            control_server.close()
+        workers.close()
+        watcher.close()
+        decisions.save()
+        if journal is not None:
+            log(journal.stats())
+            journal.stop()
+        if metrics_server:
+            metrics_server.shutdown()
+        if METRICS_DUMP_FILE:
+            telemetry.dump(app_paths.app_file(METRICS_DUMP_FILE))
+        log_writer.stop()
         if shared_mem:
             shared_mem.close()
 
 
 if __name__ == "__main__":
+    # 打包成 exe 后预检的进程池需要（子进程从 exe 启动）
+    multiprocessing.freeze_support()
     if sys.platform != 'win32':
         print("❌ 此程序只能在 Windows 上运行！")
         sys.exit(1)
     
-    if ctypes.windll.shell32.IsUserAnAdmin() == 0:
-        log("⚠️ 建议以管理员权限运行")
+    if not win32_api.shell32.IsUserAnAdmin():
+        print("⚠️ 建议以管理员权限运行")
     
-    main()
+    main(sys.argv[1:])
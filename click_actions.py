@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+点击动作执行器
+每一步都通过观察窗口状态确认完成（单选按钮已选中、按钮可用、对话框已关闭），
+用短间隔、有上限的轮询代替固定的 sleep；BM_CLICK 没有关闭对话框时，
+依次改用 PostMessage(BM_CLICK) 和 WM_COMMAND（与按下助记符/快捷键效果相同）
+"""
+
+import time
+import bisect
+import threading
+import collections
+
+# 依次尝试的点击方式
+CLICK_METHODS = ('click', 'post', 'command')
+
+# press_button 的结果：点击消息已经发出，但对话框没有关闭
+# （消息可能还在队列中，不能再点击其它按钮，也不能再次处理这个对话框）
+ATTEMPTED = 'attempted'
+
+
+class LatencyHistogram:
+    """按毫秒分桶的耗时直方图"""
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        """p 分位数所在桶的上界（毫秒），超过最大桶返回 inf"""
+        if not self.count:
+            return 0
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for bound, n in zip(self.BOUNDS_MS + (float('inf'),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def format(self):
+        labels = [f"≤{b}ms" for b in self.BOUNDS_MS] + [f">{self.BOUNDS_MS[-1]}ms"]
+        return ' '.join(f"{label}:{n}" for label, n in zip(labels, self.counts) if n)
+
+
+class ActionExecutor:
+    """确认状态的点击动作"""
+
+    def __init__(self, backend, timeout=0.25, poll_interval=0.01):
+        self.backend = backend
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.histograms = collections.defaultdict(LatencyHistogram)
+        self.fallbacks = collections.Counter()
+        self.failures = collections.Counter()
+        # 多个工作线程同时点击时保护统计数据
+        self._lock = threading.Lock()
+
+    def _record(self, name, seconds):
+        with self._lock:
+            self.histograms[name].record(seconds)
+
+    def _count(self, counter, key):
+        with self._lock:
+            counter[key] += 1
+
+    def wait_for(self, condition, timeout=None):
+        """轮询 condition，成立返回 True，超时返回 False"""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            if condition():
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+    def check_radio(self, hwnd):
+        """选中单选按钮，确认已选中"""
+        backend = self.backend
+        start = time.perf_counter()
+        if not backend.is_checked(hwnd):
+            backend.click(hwnd)
+            if not self.wait_for(lambda: backend.is_checked(hwnd)):
+                self._count(self.failures, 'radio')
+                return False
+        self._record('radio', time.perf_counter() - start)
+        return True
+
+    def press_button(self, dialog, button, control_id=0):
+        """
+        点击按钮并确认对话框已关闭
+        返回实际生效的点击方式（CLICK_METHODS 之一），对话框始终没有关闭返回 ATTEMPTED
+        """
+        backend = self.backend
+        start = time.perf_counter()
+        if not self.wait_for(lambda: backend.is_window_enabled(button)):
+            self._count(self.failures, 'disabled')
+
+        def closed():
+            return not backend.is_window(dialog) or not backend.is_window_visible(dialog)
+
+        for method in CLICK_METHODS:
+            if method == 'click':
+                backend.click(button)
+            elif method == 'post':
+                backend.post_click(button)
+            else:
+                backend.post_command(dialog, control_id, button)
+            if self.wait_for(closed):
+                self._record('button', time.perf_counter() - start)
+                if method != 'click':
+                    self._count(self.fallbacks, method)
+                return method
+        self._count(self.failures, 'button')
+        return ATTEMPTED
+
+    def stats(self):
+        parts = [f"{name} p50≤{h.percentile(50)}ms p95≤{h.percentile(95)}ms ({h.count} 次)"
+                 for name, h in sorted(self.histograms.items())]
+        if self.fallbacks:
+            parts.append('备用点击 ' + ', '.join(f"{k} {v}" for k, v in sorted(self.fallbacks.items())))
+        if self.failures:
+            parts.append('失败 ' + ', '.join(f"{k} {v}" for k, v in sorted(self.failures.items())))
+        return "动作耗时: " + ('; '.join(parts) if parts else '无')
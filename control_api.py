@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+本机控制接口
+处理程序常驻运行时，在命名管道（Windows）或 Unix 套接字（基准）上接受控制命令，
+不用重启（重新解压 onefile、重新注入 DLL、丢失缓存和统计）就可以：
+  - stats:      查看统计
+  - pause / resume: 暂停 / 恢复处理弹窗（检测照常进行）
+  - dry_run:    对某个对话框（hwnd）或给定的控件列表只匹配规则不点击
+  - rules / load_rules: 导出当前规则 / 原子地替换规则集
+  - stop:       退出（和 Ctrl+C 一样保存缓存和指标）
+请求和响应都是一条 JSON：{"cmd": ..., 参数...} -> {"ok": true, "result": ...} 或 {"ok": false, "error": ...}
+用法: python control_api.py [--hook | --address 地址] 命令 [参数]
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+import multiprocessing.connection
+
+import batch_open
+import dialog_snapshot
+import popup_rules
+
+# 命名管道的名称（标准版 / Hook 版各一个）
+PIPE_NAMES = {
+    'standard': 'cdr_popup_standard',
+    'hook': 'cdr_popup_hook',
+}
+
+# 单条消息的最大字节数（规则文件也通过它传送）
+MAX_MESSAGE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def pipe_address(name):
+    """命名管道地址（multiprocessing.connection 按 \\\\.\\pipe\\ 前缀识别为 AF_PIPE）"""
+    return '\\\\.\\pipe\\' + name
+
+
+def default_address(handler_name):
+    """处理程序的默认控制地址：Windows 下是命名管道，其它平台没有（需显式给出 Unix 套接字路径）"""
+    if sys.platform != 'win32':
+        return None
+    return pipe_address(PIPE_NAMES[handler_name])
+
+
+class ControlServer:
+    """
+    控制接口服务端：后台线程接受连接，每个连接一个线程，
+    每条请求调用 commands[cmd](**参数)，返回值（可 JSON 序列化）作为 result
+    """
+
+    def __init__(self, address, commands, authkey=None):
+        self.address = address
+        self.commands = commands
+        self.authkey = authkey
+        self.listener = multiprocessing.connection.Listener(address, authkey=authkey)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._serve, name='control', daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stopping:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                if self._stopping:
+                    return
+                continue
+            if self._stopping:
+                conn.close()
+                return
+            threading.Thread(target=self._session, args=(conn,), name='control-session',
+                             daemon=True).start()
+
+    def _session(self, conn):
+        with conn:
+            while True:
+                try:
+                    data = conn.recv_bytes(MAX_MESSAGE)
+                except (OSError, EOFError):
+                    return
+                conn.send_bytes(json.dumps(self.dispatch(data), ensure_ascii=False).encode('utf-8'))
+
+    def dispatch(self, data):
+        """执行一条请求（JSON 字节串），返回响应 dict"""
+        try:
+            request = json.loads(data)
+            if not isinstance(request, dict):
+                raise ValueError("请求必须是 JSON 对象")
+            args = dict(request)
+            command = self.commands.get(args.pop('cmd', None))
+            if command is None:
+                raise ValueError(f"未知命令: {request.get('cmd')!r}（可用: {', '.join(sorted(self.commands))}）")
+            return {'ok': True, 'result': command(**args)}
+        except (ValueError, TypeError, KeyError) as e:
+            return {'ok': False, 'error': str(e)}
+        except Exception as e:
+            logger.exception("控制命令出错")
+            return {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    def close(self):
+        self._stopping = True
+        # accept() 阻塞时关闭监听不一定能唤醒它（命名管道），先自己连一次
+        try:
+            multiprocessing.connection.Client(self.address, authkey=self.authkey).close()
+        except (OSError, EOFError, multiprocessing.AuthenticationError):
+            pass
+        self.listener.close()
+        self._thread.join(1.0)
+
+
+class ControlClient:
+    """控制接口客户端"""
+
+    def __init__(self, address, authkey=None):
+        self.conn = multiprocessing.connection.Client(address, authkey=authkey)
+
+    def call(self, cmd, **args):
+        """发送一条命令，返回 result；服务端报错时抛出 RuntimeError"""
+        self.conn.send_bytes(json.dumps(dict(args, cmd=cmd), ensure_ascii=False).encode('utf-8'))
+        response = json.loads(self.conn.recv_bytes(MAX_MESSAGE))
+        if not response.get('ok'):
+            raise RuntimeError(response.get('error'))
+        return response.get('result')
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def snapshot_from_spec(title, controls):
+    """dry-run 用的快照：controls 是 [[类名, 文本, 控件 ID, 样式], ...]（ID 和样式可省略）"""
+    records = []
+    for spec in controls:
+        class_name, text = spec[0], spec[1]
+        control_id = spec[2] if len(spec) > 2 else 0
+        style = spec[3] if len(spec) > 3 else 0
+        records.append(dialog_snapshot.ControlRecord(0, class_name, control_id, text, style))
+    return dialog_snapshot.DialogSnapshot(0, title, records)
+
+
+def dry_run_report(snapshot, matched, cached=None):
+    """dry-run 的结果：匹配的规则、会执行的规则和要点击的按钮、缓存中的决策"""
+    result = {
+        'title': snapshot.title,
+        'complete': snapshot.complete,
+        'buttons': snapshot.button_texts,
+        'matched': [rule.name for rule in matched],
+        'rule': None,
+        'radio': None,
+        'button': None,
+        'cached': cached,
+    }
+    planned = popup_rules.plan(matched, snapshot)
+    if planned is not None:
+        rule, radio, button = planned
+        result['rule'] = rule.name
+        result['radio'] = radio.text if radio is not None else None
+        result['button'] = button.text
+    return result
+
+
+class HandlerControl:
+    """
+    一个处理程序（cdr_popup_handler / cdr_popup_handler_hook 模块）的控制命令
+    take_snapshot(hwnd) 读取对话框快照，dry_run(snapshot) 只匹配规则不点击，
+    wake() 唤醒检测循环（恢复、退出时立即生效）
+    """
+
+    def __init__(self, handler, workers, take_snapshot, dry_run, wake=None):
+        self.handler = handler
+        self.workers = workers
+        self.take_snapshot = take_snapshot
+        self.dry_run_snapshot = dry_run
+        self.wake = wake or (lambda: None)
+        self.started = time.time()
+        self.paused = False
+        self.stopping = False
+        self.rules_loaded = 0
+        # 批量打开模式下的 batch_open.BatchDriver
+        self.batch = None
+
+    def commands(self):
+        return {
+            'ping': lambda: 'pong',
+            'stats': self.stats,
+            'pause': self.pause,
+            'resume': self.resume,
+            'dry_run': self.dry_run,
+            'rules': self.rules,
+            'load_rules': self.load_rules,
+            'stop': self.stop,
+        }
+
+    def stats(self):
+        handler = self.handler
+        decisions = handler.decisions
+        return {
+            'uptime': time.time() - self.started,
+            'paused': self.paused,
+            'handled': self.workers.handled_count,
+            'busy': self.workers.busy(),
+            'rules_version': handler.rule_engine.version,
+            'rules_loaded': self.rules_loaded,
+            'decisions': decisions.stats() if decisions is not None else None,
+            'unmatched': handler.unmatched.stats(),
+            'text': handler.text_budget.stats(),
+            'actions': handler.actions.stats(),
+            'counters': handler.telemetry.to_dict()['counters'],
+            'journal': handler.journal.stats() if handler.journal is not None else None,
+            'batch': batch_open.summarize(self.batch.results) if self.batch is not None else None,
+        }
+
+    def pause(self):
+        """暂停处理（检测照常进行，恢复后由下一次扫描重新发现暂停期间的弹窗）"""
+        self.paused = True
+        return {'paused': True}
+
+    def resume(self):
+        self.paused = False
+        self.wake()
+        return {'paused': False}
+
+    def dry_run(self, hwnd=None, title='', controls=None):
+        """对窗口 hwnd 或给定的控件列表只匹配规则，不点击"""
+        if hwnd is not None:
+            if not self.handler.backend.is_window(hwnd):
+                raise ValueError(f"窗口不存在: {hwnd}")
+            snapshot = self.take_snapshot(hwnd)
+        elif controls is not None:
+            snapshot = snapshot_from_spec(title, controls)
+        else:
+            raise ValueError("dry_run 需要 hwnd 或 controls")
+        return self.dry_run_snapshot(snapshot)
+
+    def rules(self):
+        """当前规则集（可以保存为规则文件，修改后用 load_rules 加载）"""
+        engine = self.handler.rule_engine
+        return {'version': engine.version, 'rules': [popup_rules.rule_to_dict(r) for r in engine.rules]}
+
+    def load_rules(self, path=None, rules=None):
+        """从规则文件（path）或直接给出的规则列表原子地替换规则集；规则有误时保持原规则"""
+        if path is not None:
+            new_rules = popup_rules.load_rules(path)
+        elif rules is not None:
+            new_rules = popup_rules.rules_from_json(rules)
+        else:
+            raise ValueError("load_rules 需要 path 或 rules")
+        version = self.handler.swap_rules(new_rules)
+        self.rules_loaded += 1
+        # 之前未匹配的对话框按新规则立即重新检查
+        self.wake()
+        return {'version': version, 'rules': [r.name for r in new_rules]}
+
+    def stop(self):
+        if self.batch is not None:
+            self.batch.stop()
+        self.stopping = True
+        self.wake()
+        return {'stopping': True}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='CorelDRAW 弹窗处理程序的控制接口客户端')
+    parser.add_argument('--hook', action='store_true', help='连接 Hook 版（默认标准版）')
+    parser.add_argument('--address', help='控制地址（命名管道或 Unix 套接字路径）')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    for name in ('ping', 'stats', 'pause', 'resume', 'rules', 'stop'):
+        sub.add_parser(name)
+    dry = sub.add_parser('dry_run', help='只匹配规则不点击')
+    dry.add_argument('hwnd', type=lambda s: int(s, 0))
+    load = sub.add_parser('load_rules', help='从 JSON 规则文件替换规则集')
+    load.add_argument('path')
+    args = parser.parse_args(argv)
+
+    address = args.address or default_address('hook' if args.hook else 'standard')
+    if address is None:
+        parser.error('非 Windows 平台需要 --address')
+    params = {}
+    if args.cmd == 'dry_run':
+        params['hwnd'] = args.hwnd
+    elif args.cmd == 'load_rules':
+        # 规则文件在客户端读取，处理程序可能运行在别的目录或以管理员身份运行
+        try:
+            with open(args.path, encoding='utf-8') as f:
+                params['rules'] = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"❌ 无法读取规则文件 {args.path}: {e}", file=sys.stderr)
+            return 1
+    try:
+        with ControlClient(address) as client:
+            result = client.call(args.cmd, **params)
+    except (OSError, RuntimeError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
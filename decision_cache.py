@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+弹窗决策缓存
+同一种弹窗（标题、控件结构、按钮、文本都相同）反复出现时，
+直接重放上次的决策（点哪个按钮 / 先选哪个单选按钮再点哪个按钮），跳过规则匹配。
+缓存按 LRU 淘汰，保存到磁盘，规则集版本变化时整体失效
+未匹配任何规则的对话框记在 UnmatchedCache 中，内容和规则集都不变时不再重复匹配
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import collections
+
+CACHE_FORMAT = 1
+
+# 未匹配的对话框内容不变时，第 n 次复查前等待的秒数（超出后一直用最后一个值）
+UNMATCHED_RETRY = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+logger = logging.getLogger(__name__)
+
+
+def dialog_fingerprint(title, controls, buttons, text):
+    """
+    弹窗指纹
+    controls: [(class_name, control_id), ...]（按子窗口顺序）
+    buttons:  按钮文本
+    text:     参与规则匹配的全部文本
+    """
+    h = hashlib.sha1()
+    h.update(title.encode('utf-8', 'replace'))
+    h.update(b'\0')
+    for class_name, control_id in controls:
+        h.update(f"{class_name}#{control_id};".encode('utf-8', 'replace'))
+    h.update(b'\0')
+    h.update('\n'.join(sorted(set(buttons))).encode('utf-8', 'replace'))
+    h.update(b'\0')
+    h.update(hashlib.sha1(text.encode('utf-8', 'replace')).digest())
+    return h.hexdigest()
+
+
+class DecisionCache:
+    """指纹 -> 决策 的 LRU 缓存（可以在多个工作线程中同时使用）"""
+
+    def __init__(self, rules_version, path=None, capacity=512):
+        self.rules_version = rules_version
+        self.path = path
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        # 上一次保存失败（连续失败只警告一次）
+        self.save_failed = False
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint):
+        with self._lock:
+            decision = self.entries.get(fingerprint)
+            if decision is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(fingerprint)
+            self.hits += 1
+            return decision
+
+    def peek(self, fingerprint):
+        """查看缓存的决策（不计入命中率，不调整 LRU 顺序）"""
+        with self._lock:
+            return self.entries.get(fingerprint)
+
+    def put(self, fingerprint, decision, rules_version=None):
+        """rules_version 是做出决策时的规则集版本，规则已被替换时丢弃这个决策"""
+        with self._lock:
+            if rules_version is not None and rules_version != self.rules_version:
+                return
+            self.entries[fingerprint] = decision
+            self.entries.move_to_end(fingerprint)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def discard(self, fingerprint):
+        """重放失败的决策（弹窗已变化）"""
+        with self._lock:
+            if self.entries.pop(fingerprint, None) is not None:
+                self.dirty = True
+
+    def set_rules_version(self, rules_version):
+        """规则集变化后缓存整体失效"""
+        with self._lock:
+            if rules_version != self.rules_version:
+                self.rules_version = rules_version
+                self.entries.clear()
+                self.dirty = True
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return f"决策缓存: {len(self.entries)} 条, 命中 {self.hits}, 未命中 {self.misses}, 命中率 {self.hit_rate():.0%}"
+
+    def load(self):
+        """从磁盘加载；文件不存在、损坏或规则版本不同时返回 False"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(data, dict):
+            return False
+        if data.get('format') != CACHE_FORMAT or data.get('rules_version') != self.rules_version:
+            return False
+        entries = data.get('entries', [])
+        if not isinstance(entries, list) or not all(_valid_entry(item) for item in entries):
+            return False
+        for fingerprint, decision in entries[-self.capacity:]:
+            self.entries[fingerprint] = decision
+        return True
+
+    def save(self):
+        """
+        写回磁盘（先写临时文件再替换，避免写到一半退出）
+        目录只读、磁盘已满、临时文件被占用时只记一条警告，下次再试
+        """
+        if not self.path or not self.dirty:
+            return
+        with self._lock:
+            data = {
+                'format': CACHE_FORMAT,
+                'rules_version': self.rules_version,
+                'entries': list(self.entries.items()),
+            }
+            self.dirty = False
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            self.dirty = True
+            if not self.save_failed:
+                logger.warning("无法保存决策缓存 %s: %s", self.path, e)
+            self.save_failed = True
+            return
+        self.save_failed = False
+
+
+def _valid_entry(item):
+    """缓存文件中的一条 [指纹, 决策]"""
+    return (isinstance(item, list) and len(item) == 2 and isinstance(item[0], str)
+            and isinstance(item[1], dict) and 'rule' in item[1] and 'button' in item[1])
+
+
+class UnmatchedCache:
+    """
+    未匹配任何规则的对话框：hwnd -> [内容版本, 规则集版本, 连续未变化次数]
+    内容版本（快照哈希、Hook 序号等）和规则集版本都没变时不必再匹配规则，
+    复查间隔按 schedule 逐次拉长；内容或规则变化后重新从头开始
+    """
+
+    def __init__(self, schedule=UNMATCHED_RETRY):
+        self.schedule = schedule
+        self.entries = {}
+        self.skips = 0
+        self._lock = threading.Lock()
+
+    def seen(self, hwnd, version, rules_version):
+        """同样的内容在同一个规则集下已经确认不匹配"""
+        with self._lock:
+            entry = self.entries.get(hwnd)
+            if entry is None or entry[0] != version or entry[1] != rules_version:
+                return False
+            self.skips += 1
+            return True
+
+    def record(self, hwnd, version, rules_version):
+        """记录一次不匹配，返回下次复查前的等待时间"""
+        with self._lock:
+            entry = self.entries.get(hwnd)
+            if entry is not None and entry[0] == version and entry[1] == rules_version:
+                entry[2] += 1
+            else:
+                entry = self.entries[hwnd] = [version, rules_version, 0]
+            return self.schedule[min(entry[2], len(self.schedule) - 1)]
+
+    def discard(self, hwnd):
+        with self._lock:
+            self.entries.pop(hwnd, None)
+
+    def versions(self):
+        """[(hwnd, 内容版本), ...]"""
+        with self._lock:
+            return [(hwnd, entry[0]) for hwnd, entry in self.entries.items()]
+
+    def prune(self, is_alive):
+        """清理已关闭的窗口（hwnd 可能被新窗口复用）"""
+        with self._lock:
+            for hwnd in [h for h in self.entries if not is_alive(h)]:
+                del self.entries[hwnd]
+
+    def stats(self):
+        return f"未匹配缓存: {len(self.entries)} 个对话框, 跳过重复匹配 {self.skips} 次"
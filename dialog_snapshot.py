@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+对话框快照
+一次遍历子窗口，把每个控件的 hwnd、类名、控件 ID、文本、规范化文本和样式记录下来，
+内容提取、规则匹配、按钮查找和点击都使用同一份快照，不再重复跨进程读取
+"""
+
+import button_labels
+
+# 按钮样式
+BS_TYPEMASK = 0x000F
+BS_CHECKBOX = 0x0002
+BS_AUTOCHECKBOX = 0x0003
+BS_RADIOBUTTON = 0x0004
+BS_GROUPBOX = 0x0007
+BS_AUTORADIOBUTTON = 0x0009
+
+
+def is_button_class(class_name):
+    """是否是按钮类控件"""
+    return 'Button' in class_name or 'BUTTON' in class_name.upper()
+
+
+def normalize_text(text):
+    """用于比较的规范化文本：去掉助记符、全角转半角、大小写折叠"""
+    return button_labels.normalize_label(text)
+
+
+class ControlRecord:
+    """对话框中的一个控件"""
+
+    __slots__ = ('hwnd', 'class_name', 'control_id', 'text', 'norm_text', 'style')
+
+    def __init__(self, hwnd, class_name, control_id, text, style):
+        self.hwnd = hwnd
+        self.class_name = class_name
+        self.control_id = control_id
+        self.text = text
+        # 规范化文本在创建时算一次（按钮查找、规则匹配多次使用）
+        self.norm_text = normalize_text(text)
+        self.style = style
+
+    @property
+    def is_button(self):
+        return is_button_class(self.class_name)
+
+    @property
+    def is_radio(self):
+        return self.is_button and (self.style & BS_TYPEMASK) in (BS_RADIOBUTTON, BS_AUTORADIOBUTTON)
+
+    def __repr__(self):
+        return f"[{self.class_name}] {self.text!r}"
+
+
+class DialogSnapshot:
+    """
+    对话框快照（创建后不再修改）
+    complete 为 False 表示读取文本时窗口没有响应或本轮预算已用完，快照只包含部分控件
+    """
+
+    __slots__ = ('hwnd', 'title', 'controls', 'buttons', 'texts', 'content', 'complete', '_button_index')
+
+    def __init__(self, hwnd, title, controls, complete=True):
+        self.hwnd = hwnd
+        self.title = title
+        self.complete = complete
+        self.controls = tuple(controls)
+        # 有文本的按钮 / 非按钮文本
+        self.buttons = tuple(c for c in self.controls if c.text and c.is_button)
+        self.texts = tuple(c.text for c in self.controls if c.text and not c.is_button)
+        self.content = ' '.join(c.text for c in self.controls if c.text)
+        self._button_index = None
+
+    @property
+    def button_index(self):
+        """按钮索引（button_labels.ButtonIndex），第一次查找按钮时建立"""
+        if self._button_index is None:
+            self._button_index = button_labels.ButtonIndex(self.buttons)
+        return self._button_index
+
+    def find_button(self, targets):
+        """按规则的 targets（语义动作或按钮文本）精确查找按钮"""
+        return self.button_index.find(targets)
+
+    @property
+    def button_texts(self):
+        return [b.text for b in self.buttons]
+
+    @property
+    def signature(self):
+        """控件结构和文本的哈希，用于判断内容是否还在变化"""
+        return hash(tuple((c.class_name, c.control_id, c.text) for c in self.controls))
+
+    @property
+    def structure(self):
+        """控件结构 [(类名, 控件 ID), ...]，用于弹窗指纹"""
+        return [(c.class_name, c.control_id) for c in self.controls]
+
+
+def take_snapshot(backend, hwnd, title=None, budget=None):
+    """
+    遍历一次子窗口，生成快照
+    budget（window_backend.TextBudget）限制读取文本的等待时间；
+    某个控件没有响应时停止遍历，返回不完整的快照
+    """
+    if title is None:
+        title = backend.get_window_text(hwnd)
+    controls = []
+    for child in backend.enum_child_windows(hwnd):
+        if budget is not None:
+            text = budget.get_text(backend, child)
+        else:
+            text = backend.get_control_text(child)
+        if text is None:
+            return DialogSnapshot(hwnd, title, controls, complete=False)
+        controls.append(ControlRecord(
+            child,
+            backend.get_class_name(child),
+            backend.get_control_id(child),
+            text,
+            backend.get_window_style(child),
+        ))
+    return DialogSnapshot(hwnd, title, controls)
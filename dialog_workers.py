@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+并发处理对话框
+检测线程只负责发现对话框，处理（快照、规则匹配、点击确认）交给有界线程池：
+  - 互不相关的对话框（不同 CorelDRAW 进程的、同一进程中所有者不同的）并发处理
+  - 同一条所有者链上的对话框（对话框弹出的子对话框）属于同一条通道，按顺序处理
+  - 每个 hwnd 同时只有一个任务；处理成功的 hwnd 在窗口关闭前不会再次提交，
+    保证同一个对话框不会被操作两次
+"""
+
+import logging
+import threading
+import collections
+import concurrent.futures
+
+# 默认的工作线程数
+DEFAULT_WORKERS = 4
+
+# 所有者链最多向上查找的层数
+MAX_OWNER_DEPTH = 8
+
+logger = logging.getLogger(__name__)
+
+
+def dialog_lane(backend, hwnd, dialog_class='#32770'):
+    """对话框所属的通道：所有者链最上层的对话框（hwnd 在整个系统内唯一，不需要再区分进程）"""
+    lane = hwnd
+    owner = backend.get_window_owner(hwnd)
+    for _ in range(MAX_OWNER_DEPTH):
+        if not owner or backend.get_class_name(owner) != dialog_class:
+            break
+        lane = owner
+        owner = backend.get_window_owner(owner)
+    return lane
+
+
+class DialogWorkers:
+    """
+    handle(hwnd) 在工作线程中处理一个对话框，返回 True 表示已处理（对话框已关闭，
+    或者已经发出点击消息、不能再次操作），窗口关闭前不再提交
+    lane_of(hwnd) 返回对话框所属的通道，同一通道的对话框按提交顺序依次处理
+    """
+
+    def __init__(self, handle, lane_of, max_workers=DEFAULT_WORKERS):
+        self.handle = handle
+        self.lane_of = lane_of
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='dialog')
+        self.handled = set()
+        self.handled_count = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._lanes = {}
+        self._inflight = set()
+        self._resubmit = set()
+
+    def submit(self, dialogs):
+        """提交检测到的对话框，返回实际提交的数量（正在处理和已处理的 hwnd 被忽略）"""
+        submitted = 0
+        for hwnd in dialogs:
+            with self._lock:
+                if hwnd in self.handled:
+                    self.duplicates += 1
+                    continue
+                if hwnd in self._inflight:
+                    # 正在处理：这次检查结束时如果还没处理掉，立即再检查一次
+                    self._resubmit.add(hwnd)
+                    self.duplicates += 1
+                    continue
+                self._inflight.add(hwnd)
+            # 通道只在提交时计算一次（需要跨进程调用，不持锁）
+            self._enqueue(self.lane_of(hwnd), hwnd)
+            submitted += 1
+        return submitted
+
+    def _enqueue(self, lane, hwnd):
+        with self._lock:
+            queue = self._lanes.get(lane)
+            if queue is not None:
+                queue.append(hwnd)
+                return
+            self._lanes[lane] = collections.deque([hwnd])
+        self.pool.submit(self._run_lane, lane)
+
+    def _run_lane(self, lane):
+        while True:
+            with self._lock:
+                queue = self._lanes[lane]
+                if not queue:
+                    del self._lanes[lane]
+                    if not self._lanes:
+                        self._idle.notify_all()
+                    return
+                hwnd = queue[0]
+
+            try:
+                handled = self.handle(hwnd)
+            except Exception:
+                logger.exception("处理对话框出错: hwnd=%s", hwnd)
+                handled = False
+
+            with self._lock:
+                queue.popleft()
+                if handled:
+                    self.handled.add(hwnd)
+                    self.handled_count += 1
+                    self._resubmit.discard(hwnd)
+                    self._inflight.discard(hwnd)
+                elif hwnd in self._resubmit:
+                    self._resubmit.discard(hwnd)
+                    queue.append(hwnd)
+                else:
+                    self._inflight.discard(hwnd)
+
+    def prune(self, is_alive):
+        """清理已关闭窗口的记录（hwnd 可能被系统复用）"""
+        with self._lock:
+            handled = list(self.handled)
+        closed = [h for h in handled if not is_alive(h)]
+        if closed:
+            with self._lock:
+                self.handled.difference_update(closed)
+
+    def active(self):
+        """已提交、还没有处理完的对话框（hwnd 集合）"""
+        with self._lock:
+            return set(self._inflight)
+
+    def busy(self):
+        with self._lock:
+            return bool(self._lanes)
+
+    def wait_idle(self, timeout=None):
+        """等待所有已提交的对话框处理完，超时返回 False"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._lanes, timeout)
+
+    def close(self, wait=True):
+        self.pool.shutdown(wait=wait)
@@ -6,25 +6,51 @@
 #include <stdio.h>
 #include <string>
 #include <vector>
-#include <mutex>
 
-// 共享内存结构
-#define SHARED_MEM_NAME L"CDRPopupHandlerSharedMem"
+// 共享内存协议 v3（与 hook_protocol.py 保持一致）
+// 头部 + 环形区；记录为 32 字节对齐的变长记录，不跨越环尾
+#define SHARED_MEM_NAME L"CDRPopupHandlerSharedMemV3"
+#define SHARED_MUTEX_NAME L"CDRPopupHandlerSharedMemV3Mutex"
+#define PROTOCOL_MAGIC 0x48524443  // 'CDRH'
+#define PROTOCOL_VERSION 3
+#define RING_CAPACITY (1 << 20)
+#define RECORD_ALIGN 32
+#define PAD_MARKER 0xFFFFFFFF
 #define MAX_TEXT_LENGTH 4096
-#define MAX_TEXT_COUNT 100
 
-struct SharedData {
-    DWORD textCount;
-    HWND targetHwnd;
-    wchar_t texts[MAX_TEXT_COUNT][MAX_TEXT_LENGTH];
-    DWORD ready;
+#pragma pack(push, 1)
+struct SharedHeader {
+    DWORD magic;
+    DWORD version;
+    DWORD capacity;
+    DWORD headerSize;
+    volatile LONG64 writeSeq;    // 已提交的最后一条记录序号
+    volatile LONG64 reservePos;  // 已预留到的字节位置（写数据之前发布）
+    volatile LONG64 writePos;    // 已提交的字节位置（写完数据之后发布）
+    volatile LONG64 tailPos;     // 最旧的完整记录位置
+    BYTE reserved[16];
 };
 
+struct RecordHeader {
+    DWORD size;       // 记录总长度（含记录头和填充）
+    DWORD textBytes;  // UTF-16LE 文本字节数，PAD_MARKER 表示环尾填充
+    ULONG64 seq;
+    ULONG64 hwnd;     // 绘制目标 DC 所属窗口（内存 DC 为 0）
+    ULONG64 root;     // 所属顶层窗口
+};
+#pragma pack(pop)
+
+static_assert(sizeof(SharedHeader) == 64, "SharedHeader 必须是 64 字节");
+static_assert(sizeof(RecordHeader) == 32, "RecordHeader 必须是 32 字节");
+
+#define SHARED_MEM_SIZE (sizeof(SharedHeader) + RING_CAPACITY)
+
 // 全局变量
 static HMODULE g_hModule = NULL;
 static HANDLE g_hMapFile = NULL;
-static SharedData* g_pSharedData = NULL;
-static std::mutex g_mutex;
+static HANDLE g_hMutex = NULL;  // 跨进程互斥（可能注入了多个 CorelDRAW 进程）
+static SharedHeader* g_pHeader = NULL;
+static BYTE* g_pRing = NULL;
 
 // 原始函数指针
 typedef BOOL (WINAPI *TextOutW_t)(HDC, int, int, LPCWSTR, int);
@@ -76,24 +102,76 @@ void* HookIAT(HMODULE hModule, const char* dllName, const char* funcName, void*
     return NULL;
 }
 
-// 保存捕获的文本
-void SaveCapturedText(const wchar_t* text, int len) {
-    if (!g_pSharedData || !text || len <= 0) return;
+static inline ULONG64 AlignRecord(ULONG64 n) {
+    return (n + RECORD_ALIGN - 1) & ~(ULONG64)(RECORD_ALIGN - 1);
+}
+
+// 文本来源窗口：DC 所属窗口及其顶层窗口
+// 双缓冲绘制使用内存 DC，取不到窗口时归到当前线程的活动窗口（通常是模态弹窗）
+static void GetTextOrigin(HDC hdc, HWND* hwnd, HWND* root) {
+    *hwnd = hdc ? WindowFromDC(hdc) : NULL;
+    HWND base = *hwnd ? *hwnd : GetActiveWindow();
+    *root = base ? GetAncestor(base, GA_ROOT) : NULL;
+}
+
+// 保存捕获的文本：追加一条记录，必要时覆盖最旧的记录
+void SaveCapturedText(HDC hdc, const wchar_t* text, int len) {
+    if (!g_pHeader || !g_hMutex || !text || len <= 0) return;
+    
+    HWND hwnd, root;
+    GetTextOrigin(hdc, &hwnd, &root);
+    
+    int copyLen = min(len, MAX_TEXT_LENGTH - 1);
+    DWORD textBytes = copyLen * sizeof(wchar_t);
+    ULONG64 size = AlignRecord(sizeof(RecordHeader) + textBytes);
+    
+    DWORD wait = WaitForSingleObject(g_hMutex, 100);
+    if (wait != WAIT_OBJECT_0 && wait != WAIT_ABANDONED) return;
     
-    std::lock_guard<std::mutex> lock(g_mutex);
+    ULONG64 capacity = g_pHeader->capacity;
+    ULONG64 pos = g_pHeader->writePos;
+    ULONG64 offset = pos % capacity;
+    ULONG64 pad = (capacity - offset < size) ? capacity - offset : 0;
+    ULONG64 start = pos + pad;
+    ULONG64 end = start + size;
     
-    if (g_pSharedData->textCount < MAX_TEXT_COUNT) {
-        int copyLen = min(len, MAX_TEXT_LENGTH - 1);
-        wcsncpy_s(g_pSharedData->texts[g_pSharedData->textCount], MAX_TEXT_LENGTH, text, copyLen);
-        g_pSharedData->texts[g_pSharedData->textCount][copyLen] = L'\0';
-        g_pSharedData->textCount++;
+    // 推进 tail，跳过即将被覆盖的记录
+    ULONG64 tail = g_pHeader->tailPos;
+    while (end - tail > capacity) {
+        tail += ((RecordHeader*)(g_pRing + tail % capacity))->size;
     }
+    InterlockedExchange64(&g_pHeader->tailPos, tail);
+    InterlockedExchange64(&g_pHeader->reservePos, end);
+    
+    if (pad) {
+        RecordHeader* padRec = (RecordHeader*)(g_pRing + offset);
+        padRec->size = (DWORD)pad;
+        padRec->textBytes = PAD_MARKER;
+        padRec->seq = 0;
+        padRec->hwnd = 0;
+        padRec->root = 0;
+    }
+    
+    ULONG64 seq = g_pHeader->writeSeq + 1;
+    RecordHeader* rec = (RecordHeader*)(g_pRing + start % capacity);
+    rec->size = (DWORD)size;
+    rec->textBytes = textBytes;
+    rec->seq = seq;
+    rec->hwnd = (ULONG64)(ULONG_PTR)hwnd;
+    rec->root = (ULONG64)(ULONG_PTR)root;
+    memcpy(rec + 1, text, textBytes);
+    
+    MemoryBarrier();
+    InterlockedExchange64(&g_pHeader->writeSeq, seq);
+    InterlockedExchange64(&g_pHeader->writePos, end);
+    
+    ReleaseMutex(g_hMutex);
 }
 
 // Hook 函数实现
 BOOL WINAPI Hook_TextOutW(HDC hdc, int x, int y, LPCWSTR lpString, int c) {
     if (lpString && c > 0) {
-        SaveCapturedText(lpString, c);
+        SaveCapturedText(hdc, lpString, c);
     }
     return Real_TextOutW(hdc, x, y, lpString, c);
 }
@@ -106,7 +184,7 @@ BOOL WINAPI Hook_TextOutA(HDC hdc, int x, int y, LPCSTR lpString, int c) {
             wchar_t* wstr = new wchar_t[wlen + 1];
             MultiByteToWideChar(CP_ACP, 0, lpString, c, wstr, wlen);
             wstr[wlen] = L'\0';
-            SaveCapturedText(wstr, wlen);
+            SaveCapturedText(hdc, wstr, wlen);
             delete[] wstr;
         }
     }
@@ -117,7 +195,7 @@ int WINAPI Hook_DrawTextW(HDC hdc, LPCWSTR lpchText, int cchText, LPRECT lprc, U
     if (lpchText) {
         int len = (cchText == -1) ? wcslen(lpchText) : cchText;
         if (len > 0) {
-            SaveCapturedText(lpchText, len);
+            SaveCapturedText(hdc, lpchText, len);
         }
     }
     return Real_DrawTextW(hdc, lpchText, cchText, lprc, format);
@@ -132,7 +210,7 @@ int WINAPI Hook_DrawTextA(HDC hdc, LPCSTR lpchText, int cchText, LPRECT lprc, UI
                 wchar_t* wstr = new wchar_t[wlen + 1];
                 MultiByteToWideChar(CP_ACP, 0, lpchText, len, wstr, wlen);
                 wstr[wlen] = L'\0';
-                SaveCapturedText(wstr, wlen);
+                SaveCapturedText(hdc, wstr, wlen);
                 delete[] wstr;
             }
         }
@@ -144,7 +222,7 @@ int WINAPI Hook_DrawTextExW(HDC hdc, LPWSTR lpchText, int cchText, LPRECT lprc,
     if (lpchText) {
         int len = (cchText == -1) ? wcslen(lpchText) : cchText;
         if (len > 0) {
-            SaveCapturedText(lpchText, len);
+            SaveCapturedText(hdc, lpchText, len);
         }
     }
     return Real_DrawTextExW(hdc, lpchText, cchText, lprc, format, lpdtp);
@@ -159,7 +237,7 @@ int WINAPI Hook_DrawTextExA(HDC hdc, LPSTR lpchText, int cchText, LPRECT lprc, U
                 wchar_t* wstr = new wchar_t[wlen + 1];
                 MultiByteToWideChar(CP_ACP, 0, lpchText, len, wstr, wlen);
                 wstr[wlen] = L'\0';
-                SaveCapturedText(wstr, wlen);
+                SaveCapturedText(hdc, wstr, wlen);
                 delete[] wstr;
             }
         }
@@ -170,7 +248,7 @@ int WINAPI Hook_DrawTextExA(HDC hdc, LPSTR lpchText, int cchText, LPRECT lprc, U
 // 初始化共享内存
 BOOL InitSharedMemory() {
     g_hMapFile = CreateFileMappingW(
-        INVALID_HANDLE_VALUE, NULL, PAGE_READWRITE, 0, sizeof(SharedData), SHARED_MEM_NAME);
+        INVALID_HANDLE_VALUE, NULL, PAGE_READWRITE, 0, SHARED_MEM_SIZE, SHARED_MEM_NAME);
     
     if (!g_hMapFile) {
         g_hMapFile = OpenFileMappingW(FILE_MAP_ALL_ACCESS, FALSE, SHARED_MEM_NAME);
@@ -178,13 +256,37 @@ BOOL InitSharedMemory() {
     
     if (!g_hMapFile) return FALSE;
     
-    g_pSharedData = (SharedData*)MapViewOfFile(g_hMapFile, FILE_MAP_ALL_ACCESS, 0, 0, sizeof(SharedData));
-    if (!g_pSharedData) {
+    g_pHeader = (SharedHeader*)MapViewOfFile(g_hMapFile, FILE_MAP_ALL_ACCESS, 0, 0, SHARED_MEM_SIZE);
+    if (!g_pHeader) {
+        CloseHandle(g_hMapFile);
+        g_hMapFile = NULL;
+        return FALSE;
+    }
+    g_pRing = (BYTE*)g_pHeader + sizeof(SharedHeader);
+    
+    g_hMutex = CreateMutexW(NULL, FALSE, SHARED_MUTEX_NAME);
+    if (!g_hMutex) {
+        UnmapViewOfFile(g_pHeader);
+        g_pHeader = NULL;
         CloseHandle(g_hMapFile);
         g_hMapFile = NULL;
         return FALSE;
     }
     
+    // 处理程序还没启动时由 DLL 初始化头部
+    DWORD wait = WaitForSingleObject(g_hMutex, 1000);
+    if (wait == WAIT_OBJECT_0 || wait == WAIT_ABANDONED) {
+        if (g_pHeader->magic != PROTOCOL_MAGIC || g_pHeader->version != PROTOCOL_VERSION) {
+            ZeroMemory(g_pHeader, sizeof(SharedHeader));
+            g_pHeader->capacity = RING_CAPACITY;
+            g_pHeader->headerSize = sizeof(SharedHeader);
+            g_pHeader->version = PROTOCOL_VERSION;
+            MemoryBarrier();
+            g_pHeader->magic = PROTOCOL_MAGIC;
+        }
+        ReleaseMutex(g_hMutex);
+    }
+    
     return TRUE;
 }
 
@@ -233,9 +335,14 @@ BOOL APIENTRY DllMain(HMODULE hModule, DWORD reason, LPVOID reserved) {
             break;
             
         case DLL_PROCESS_DETACH:
-            if (g_pSharedData) {
-                UnmapViewOfFile(g_pSharedData);
-                g_pSharedData = NULL;
+            if (g_pHeader) {
+                UnmapViewOfFile(g_pHeader);
+                g_pHeader = NULL;
+                g_pRing = NULL;
+            }
+            if (g_hMutex) {
+                CloseHandle(g_hMutex);
+                g_hMutex = NULL;
             }
             if (g_hMapFile) {
                 CloseHandle(g_hMapFile);
@@ -247,13 +354,6 @@ BOOL APIENTRY DllMain(HMODULE hModule, DWORD reason, LPVOID reserved) {
 }
 
 // 导出函数用于测试
-extern "C" __declspec(dllexport) void ClearTexts() {
-    if (g_pSharedData) {
-        std::lock_guard<std::mutex> lock(g_mutex);
-        g_pSharedData->textCount = 0;
-    }
-}
-
-extern "C" __declspec(dllexport) DWORD GetTextCount() {
-    return g_pSharedData ? g_pSharedData->textCount : 0;
+extern "C" __declspec(dllexport) ULONG64 GetWriteSequence() {
+    return g_pHeader ? (ULONG64)g_pHeader->writeSeq : 0;
 }
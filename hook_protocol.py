@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Hook 共享内存协议 v3（与 hook/gdi_hook.cpp 保持一致）
+
+布局（小端）:
+  头部 HEADER_SIZE 字节:
+    u32 magic        'CDRH'
+    u32 version      3
+    u32 capacity     环形区字节数（32 的倍数）
+    u32 header_size
+    u64 write_seq    已提交的最后一条记录序号（从 1 开始单调递增）
+    u64 reserve_pos  写入方已预留到的字节位置（写数据之前发布）
+    u64 write_pos    已提交的字节位置（写完数据之后发布）
+    u64 tail_pos     环中最旧的完整记录位置
+  环形区 capacity 字节，位置均为单调递增的绝对字节数，环内偏移 = pos % capacity
+
+记录（32 字节对齐，不跨越环尾）:
+    u32 size         记录总长度（含记录头和填充）
+    u32 text_bytes   UTF-16LE 文本字节数；PAD_MARKER 表示环尾填充
+    u64 seq          记录序号
+    u64 hwnd         绘制目标 DC 所属窗口（内存 DC 为 0）
+    u64 root         所属顶层窗口（弹窗 hwnd）
+    文本 ...
+
+读取方只保存游标，不清空共享内存；被覆盖的记录计入 lost
+v3 相比 v2 在记录头中增加了 hwnd / root，用于按窗口归属文本
+"""
+
+import struct
+import threading
+import collections
+
+MAGIC = 0x48524443          # b'CDRH'
+VERSION = 3
+HEADER_FORMAT = '<IIIIQQQQ'
+HEADER_SIZE = 64
+RECORD_FORMAT = '<IIQQQ'
+RECORD_HEADER_SIZE = 32
+ALIGN = 32
+PAD_MARKER = 0xFFFFFFFF
+
+DEFAULT_CAPACITY = 1 << 20
+MAX_TEXT_LENGTH = 4096
+
+# 头部各字段偏移
+OFF_MAGIC = 0
+OFF_VERSION = 4
+OFF_CAPACITY = 8
+OFF_WRITE_SEQ = 16
+OFF_RESERVE_POS = 24
+OFF_WRITE_POS = 32
+OFF_TAIL_POS = 40
+
+# 读取到的一条记录
+Record = collections.namedtuple('Record', 'seq hwnd root text')
+
+
+class ProtocolError(Exception):
+    """共享内存头部不是可识别的布局（或版本不一致）"""
+
+
+def total_size(capacity=DEFAULT_CAPACITY):
+    """共享内存总大小"""
+    return HEADER_SIZE + capacity
+
+
+def _align(n):
+    return (n + ALIGN - 1) & ~(ALIGN - 1)
+
+
+def init_header(buf, capacity=DEFAULT_CAPACITY):
+    """初始化（或重置）共享内存头部"""
+    if capacity % ALIGN or len(buf) < HEADER_SIZE + capacity:
+        raise ValueError(f"无效的环形区大小: {capacity}")
+    struct.pack_into(HEADER_FORMAT, buf, 0, MAGIC, VERSION, capacity, HEADER_SIZE, 0, 0, 0, 0)
+
+
+def is_initialized(buf):
+    magic, version = struct.unpack_from('<II', buf, 0)
+    return magic == MAGIC and version == VERSION
+
+
+def read_header(buf):
+    """返回 (capacity, write_seq, reserve_pos, write_pos, tail_pos)"""
+    # 连续两次读到相同的头部才采用，避免读到写入方更新了一半的字段
+    fields = struct.unpack_from(HEADER_FORMAT, buf, 0)
+    while True:
+        again = struct.unpack_from(HEADER_FORMAT, buf, 0)
+        if again == fields:
+            break
+        fields = again
+    magic, version, capacity, header_size, seq, reserve, write, tail = fields
+    if magic != MAGIC or version != VERSION or header_size != HEADER_SIZE:
+        raise ProtocolError(f"magic=0x{magic:08X} version={version}")
+    return capacity, seq, reserve, write, tail
+
+
+def _store_u64(buf, offset, value):
+    # 整体拷贝 8 字节（pack_into 会逐字节写入，读取方可能看到一半的值）
+    buf[offset:offset + 8] = value.to_bytes(8, 'little')
+
+
+class RingWriter:
+    """
+    纯 Python 写入方（与 DLL 中的 SaveCapturedText 行为一致）
+    多个写入方共享同一块内存时需要传入同一把锁（线程锁或 multiprocessing.Lock）
+    """
+
+    def __init__(self, buf, lock=None):
+        self.buf = buf
+        self.lock = lock or threading.Lock()
+
+    def write(self, text, hwnd=0, root=0):
+        """写入一条文本，返回其序号"""
+        data = text[:MAX_TEXT_LENGTH - 1].encode('utf-16-le')
+        size = _align(RECORD_HEADER_SIZE + len(data))
+        buf = self.buf
+
+        with self.lock:
+            capacity, seq, _, pos, tail = read_header(buf)
+            if size > capacity:
+                raise ValueError("记录大于环形区")
+
+            # 环尾放不下时先写一条填充记录
+            pad = 0
+            offset = pos % capacity
+            if capacity - offset < size:
+                pad = capacity - offset
+            start = pos + pad
+            end = start + size
+
+            # 推进 tail，跳过即将被覆盖的记录
+            while end - tail > capacity:
+                tail += struct.unpack_from('<I', buf, HEADER_SIZE + tail % capacity)[0]
+            _store_u64(buf, OFF_TAIL_POS, tail)
+            _store_u64(buf, OFF_RESERVE_POS, end)
+
+            if pad:
+                struct.pack_into(RECORD_FORMAT, buf, HEADER_SIZE + offset, pad, PAD_MARKER, 0, 0, 0)
+            seq += 1
+            at = HEADER_SIZE + start % capacity
+            struct.pack_into(RECORD_FORMAT, buf, at, size, len(data), seq, hwnd, root)
+            buf[at + RECORD_HEADER_SIZE:at + RECORD_HEADER_SIZE + len(data)] = data
+
+            _store_u64(buf, OFF_WRITE_SEQ, seq)
+            _store_u64(buf, OFF_WRITE_POS, end)
+            return seq
+
+
+class RingReader:
+    """
+    读取方：保存游标，每次只返回上次读取之后写入的记录
+    读取过程中被写入方覆盖的记录会被丢弃，按序号缺口计入 lost
+    （lost + 返回的记录数 = 写入方（重置后）写入的记录数）
+    """
+
+    def __init__(self):
+        self.cursor = None
+        self.seq = 0
+        self.lost = 0
+        self.bytes_read = 0
+
+    def read(self, buf):
+        """
+        返回 [Record, ...]
+        文本直接从 buf 的 memoryview 解码，开销只与新写入的字节数有关
+        """
+        if isinstance(buf, memoryview):
+            return self._read(buf)
+        with memoryview(buf) as view:
+            return self._read(view)
+
+    def _read(self, buf):
+        capacity, write_seq, _, write_pos, tail = read_header(buf)
+        if self.cursor is None:
+            self.cursor = tail
+        if write_seq < self.seq or self.cursor > write_pos:
+            # 写入方重置了共享内存
+            self.cursor = tail
+            self.seq = 0
+        if self.cursor == write_pos:
+            return []
+        if write_pos - self.cursor > capacity or self.cursor < tail:
+            self._resync(tail)
+
+        records = []
+        cursor = self.cursor
+        while cursor < write_pos:
+            at = HEADER_SIZE + cursor % capacity
+            size, text_bytes, seq, hwnd, root = struct.unpack_from(RECORD_FORMAT, buf, at)
+            if size < RECORD_HEADER_SIZE or size % ALIGN or size > capacity:
+                # 读到了正在被覆盖的数据
+                break
+            if text_bytes != PAD_MARKER:
+                if text_bytes > size - RECORD_HEADER_SIZE:
+                    break
+                start = at + RECORD_HEADER_SIZE
+                text = str(buf[start:start + text_bytes], 'utf-16-le', 'replace')
+                records.append((cursor, Record(seq, hwnd, root, text)))
+            cursor += size
+
+        # 读取期间写入方可能已经预留并覆盖了部分区域，丢弃这些记录
+        _, _, reserve_pos, _, tail = read_header(buf)
+        valid = [rec for pos, rec in records
+                 if reserve_pos - pos <= capacity and rec.seq > self.seq]
+
+        self.bytes_read += cursor - self.cursor
+        if cursor < write_pos:
+            self._resync(tail)
+        else:
+            self.cursor = cursor
+        # 序号不连续说明中间的记录已被覆盖；序号从 1 开始，开始读取之前就被覆盖的记录也计入
+        for rec in valid:
+            if rec.seq > self.seq + 1:
+                self.lost += rec.seq - self.seq - 1
+            self.seq = rec.seq
+        return valid
+
+    def _resync(self, tail):
+        self.cursor = tail
+
+
+class WindowTextIndex:
+    """
+    按顶层窗口归属的 Hook 文本索引
+    每个窗口保存去重后的文本（保持首次出现顺序）和最近一条记录的序号，
+    读取某个弹窗的文本只与该弹窗自己的文本量有关
+    """
+
+    def __init__(self, max_texts_per_window=256):
+        self.max_texts = max_texts_per_window
+        self.texts = {}
+        self.last_seq = {}
+        self.unattributed = 0
+
+    def add(self, records):
+        for rec in records:
+            if not rec.root:
+                self.unattributed += 1
+                continue
+            texts = self.texts.get(rec.root)
+            if texts is None:
+                texts = self.texts[rec.root] = {}
+            if rec.text in texts:
+                # 重绘的文本移到末尾，便于淘汰最旧的
+                del texts[rec.text]
+            elif len(texts) >= self.max_texts:
+                del texts[next(iter(texts))]
+            texts[rec.text] = rec.seq
+            self.last_seq[rec.root] = rec.seq
+
+    def get(self, root):
+        """某个顶层窗口的所有文本"""
+        return list(self.texts.get(root, ()))
+
+    def seq(self, root):
+        """某个顶层窗口最近一条文本的序号（没有为 0）"""
+        return self.last_seq.get(root, 0)
+
+    def prune(self, is_alive):
+        """移除已销毁窗口的文本"""
+        for root in [r for r in self.texts if not is_alive(r)]:
+            del self.texts[root]
+            self.last_seq.pop(root, None)
+
+    def forget(self, root):
+        self.texts.pop(root, None)
+        self.last_seq.pop(root, None)
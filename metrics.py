@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+运行指标
+计数器和耗时直方图，记录一次只是一次字典查找和整数加法，可以在正式运行时常开：
+  - Registry.render():   Prometheus 文本格式
+  - serve(registry):     本机 HTTP 端点（GET /metrics）
+  - Registry.dump(path): 保存为 JSON（程序退出时）
+已有统计对象（TextBudget、ActionExecutor 等）通过 add_collector 在导出时读取，不增加记录开销
+"""
+
+import json
+import time
+import bisect
+import threading
+import http.server
+
+# 耗时直方图的桶上界（秒）
+DEFAULT_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+# 指标说明（Prometheus 的 HELP 行）
+HELP = {
+    'sweep_seconds': '全量扫描耗时',
+    'windows_enumerated_total': '全量扫描枚举到的顶层窗口数',
+    'child_walks_total': '遍历对话框子控件的次数',
+    'rule_eval_seconds': '规则匹配耗时',
+    'rule_hits_total': '规则命中并成功执行的次数',
+    'popups_handled_total': '已处理的弹窗数',
+    'text_fetch_total': '读取控件文本的次数',
+    'text_fetch_timeouts_total': '读取控件文本超时的次数',
+    'text_fetch_skipped_total': '因本轮预算用尽而放弃的文本读取',
+    'text_budget_exhausted_total': '文本读取预算用尽的扫描轮数',
+    'action_seconds': '点击动作耗时（到状态确认为止）',
+    'action_fallbacks_total': 'BM_CLICK 无效时使用备用点击的次数',
+    'action_failures_total': '点击动作失败次数',
+    'decision_cache_hits_total': '决策缓存命中次数',
+    'decision_cache_misses_total': '决策缓存未命中次数',
+    'unmatched_skips_total': '内容和规则都没变、跳过规则匹配的未匹配对话框复查次数',
+    'text_tier_total': '按文本来源（win32 / uia / hook）匹配规则的次数',
+    'hook_bytes_read_total': '从共享内存读取的 Hook 记录字节数',
+    'hook_records_lost_total': '读取前已被覆盖的 Hook 记录数',
+}
+
+
+class Histogram:
+    """耗时直方图（秒）"""
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    @classmethod
+    def from_counts(cls, bounds, counts, total):
+        """由已有的分桶计数构造（例如 click_actions.LatencyHistogram）"""
+        h = cls(tuple(bounds))
+        h.counts = list(counts)
+        h.count = sum(counts)
+        h.sum = total
+        return h
+
+    def to_dict(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts),
+                'count': self.count, 'sum': self.sum}
+
+
+class Registry:
+    """
+    指标注册表
+    labels 是 ((名称, 值), ...) 元组，由调用方构造好以免每次记录都创建字典
+    每个线程记录到自己的分片中（不加锁），导出时合并
+    """
+
+    def __init__(self, prefix='cdr_popup'):
+        self.prefix = prefix
+        self.help = dict(HELP)
+        self.collectors = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def _shard(self):
+        """当前线程自己的 (计数器, 直方图) 字典：记录时不需要加锁，导出时合并"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def inc(self, name, value=1, labels=()):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=()):
+        histograms = self._shard()[1]
+        key = (name, labels)
+        h = histograms.get(key)
+        if h is None:
+            h = histograms[key] = Histogram()
+        h.observe(seconds)
+
+    def add_collector(self, collect):
+        """collect() 返回 [(COUNTER 或 HISTOGRAM, 名称, labels, 值), ...]，导出时调用"""
+        self.collectors.append(collect)
+
+    def samples(self):
+        """所有指标的当前值：[(类型, 名称, labels, 值), ...]"""
+        counters = {}
+        histograms = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard_counters, shard_histograms in shards:
+            # 复制一份再遍历，记录线程可能正在添加新的序列
+            for key, value in list(shard_counters.items()):
+                counters[key] = counters.get(key, 0) + value
+            for key, h in list(shard_histograms.items()):
+                merged = histograms.get(key)
+                if merged is None:
+                    merged = histograms[key] = Histogram(h.bounds)
+                merged.merge(h)
+        result = [(COUNTER, name, labels, value) for (name, labels), value in counters.items()]
+        result += [(HISTOGRAM, name, labels, h) for (name, labels), h in histograms.items()]
+        for collect in self.collectors:
+            result.extend(collect())
+        return result
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        seen = set()
+        for kind, name, labels, value in sorted(self.samples(), key=lambda s: (s[1], s[2])):
+            full = f"{self.prefix}_{name}"
+            if name not in seen:
+                seen.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {full} {self.help[name]}")
+                lines.append(f"# TYPE {full} {kind}")
+            if kind == COUNTER:
+                lines.append(f"{full}{_format_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, n in zip(value.bounds, value.counts):
+                cumulative += n
+                lines.append(f"{full}_bucket{_format_labels(labels + (('le', repr(float(bound))),))} {cumulative}")
+            lines.append(f"{full}_bucket{_format_labels(labels + (('le', '+Inf'),))} {value.count}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {value.sum}")
+            lines.append(f"{full}_count{_format_labels(labels)} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        counters = {}
+        histograms = {}
+        for kind, name, labels, value in self.samples():
+            key = name + _format_labels(labels)
+            if kind == COUNTER:
+                counters[key] = value
+            else:
+                histograms[key] = value.to_dict()
+        return {'started': self.started, 'time': time.time(),
+                'counters': counters, 'histograms': histograms}
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不把每次抓取都打印到控制台
+        pass
+
+
+def serve(registry, port, host='127.0.0.1'):
+    """在后台线程中提供 /metrics，返回 server（调用 shutdown() 停止）；端口被占用时抛出 OSError"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def budget_samples(budget):
+    """TextBudget 的计数"""
+    return [
+        (COUNTER, 'text_fetch_total', (), budget.calls),
+        (COUNTER, 'text_fetch_timeouts_total', (), budget.timeouts),
+        (COUNTER, 'text_fetch_skipped_total', (), budget.skipped),
+        (COUNTER, 'text_budget_exhausted_total', (), budget.budget_hits),
+    ]
+
+
+def action_samples(actions):
+    """ActionExecutor 的动作耗时直方图、备用点击和失败次数"""
+    result = []
+    for name, h in list(actions.histograms.items()):
+        bounds = [b / 1000.0 for b in h.BOUNDS_MS]
+        result.append((HISTOGRAM, 'action_seconds', (('action', name),),
+                       Histogram.from_counts(bounds, h.counts, h.total)))
+    for method, n in list(actions.fallbacks.items()):
+        result.append((COUNTER, 'action_fallbacks_total', (('method', method),), n))
+    for reason, n in list(actions.failures.items()):
+        result.append((COUNTER, 'action_failures_total', (('reason', reason),), n))
+    return result
+
+
+def decision_samples(decisions):
+    """决策缓存的命中/未命中"""
+    if decisions is None:
+        return []
+    return [
+        (COUNTER, 'decision_cache_hits_total', (), decisions.hits),
+        (COUNTER, 'decision_cache_misses_total', (), decisions.misses),
+    ]
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+结果日志
+把处理过的每个弹窗（时间、进程、正在打开的文件、指纹、规则、动作、耗时）和批量打开的每个文件的结果
+追加到 SQLite 数据库，程序退出后不丢失：
+  - 重新运行批量打开时用 known_bad(路径) 查询（按主键查找，O(log n)），跳过之前打不开的文件
+  - 热路径只把记录放进队列，后台线程按批写入（每批一个事务）
+"""
+
+import os
+import time
+import queue
+import sqlite3
+import threading
+
+# 每批最多写入的记录数 / 队列中的记录最多等这么久（秒）就写入
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+
+# 打开时弹出这些规则处理的弹窗，说明文件本身打不开
+BAD_RULES = frozenset(('invalid_header', 'file_corrupted'))
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dialogs (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    pid INTEGER,
+    process TEXT,
+    file TEXT,
+    title TEXT,
+    fingerprint TEXT,
+    rule TEXT,
+    source TEXT,
+    action TEXT,
+    latency REAL
+);
+CREATE INDEX IF NOT EXISTS dialogs_file ON dialogs(file);
+CREATE INDEX IF NOT EXISTS dialogs_fingerprint ON dialogs(fingerprint);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    outcome TEXT NOT NULL,
+    bad INTEGER NOT NULL,
+    reason TEXT,
+    seconds REAL,
+    popups INTEGER,
+    ts REAL NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 1
+) WITHOUT ROWID;
+"""
+
+_INSERT_DIALOG = ("INSERT INTO dialogs (ts, pid, process, file, title, fingerprint, rule, source, action, latency) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+_UPSERT_FILE = ("INSERT INTO files (path, outcome, bad, reason, seconds, popups, ts) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET outcome = excluded.outcome, bad = excluded.bad, "
+                "reason = excluded.reason, seconds = excluded.seconds, popups = excluded.popups, "
+                "ts = excluded.ts, runs = files.runs + 1")
+
+_DIALOG = 0
+_FILE = 1
+_FLUSH = 2
+_STOP = 3
+
+
+def normalize_path(path):
+    """同一个文件的不同写法（相对路径、大小写）对应同一条记录"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+class OutcomeJournal:
+    """
+    结果日志（SQLite，WAL 模式）
+    begin_file / end_file 标记正在批量打开的文件（由 batch_open 调用），其间检测到的弹窗记录会带上它
+    """
+
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.current_file = None
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        # 本次运行中弹出了 BAD_RULES 弹窗的文件
+        self._bad_files = set()
+        # 对话框首次检测到时正在打开的文件：hwnd -> 文件（工作线程可能在下一个文件开始后才处理完）
+        self._dialog_files = {}
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        try:
+            self._reader = self._connect()
+            self._reader.executescript(SCHEMA)
+        except sqlite3.Error as e:
+            raise OSError(f"无法打开结果日志 {path}: {e}") from e
+        self._thread = threading.Thread(target=self._run, name='journal', daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # ---------- 记录（任意线程，只入队） ----------
+
+    def begin_file(self, path):
+        self.current_file = normalize_path(path)
+
+    def end_file(self):
+        self.current_file = None
+
+    def note_dialogs(self, hwnds):
+        """记下对话框首次检测到时正在打开的文件（检测线程调用）"""
+        file = self.current_file
+        for hwnd in hwnds:
+            self._dialog_files.setdefault(hwnd, file)
+
+    def forget_closed(self, is_alive):
+        """清理已关闭窗口的检测记录（hwnd 可能被新窗口复用）"""
+        for hwnd in [h for h in list(self._dialog_files) if not is_alive(h)]:
+            self._dialog_files.pop(hwnd, None)
+
+    def record_dialog(self, pid, process, title, fingerprint, rule, source, action, latency, hwnd=None):
+        """记录一个已处理的弹窗，归到它首次检测到时正在打开的文件"""
+        file = self._dialog_files.pop(hwnd, self.current_file)
+        if file is not None and rule in BAD_RULES:
+            self._bad_files.add(file)
+        self._queue.put((_DIALOG, (time.time(), pid, process, file, title, fingerprint,
+                                   rule, source, action, latency)))
+
+    def record_file(self, path, outcome, seconds=0.0, popups=0, reason='', bad=False):
+        """
+        记录批量打开的一个文件
+        bad 表示文件本身打不开（预检判定文件头无效或损坏）；打开时弹出了 BAD_RULES 弹窗的文件也记为打不开。
+        其它结果（读取出错、打开出错、超时）可能只是暂时的，下次运行照常打开
+        """
+        path = normalize_path(path)
+        bad = bad or path in self._bad_files
+        if path in self._bad_files and not reason:
+            reason = '打开时弹出无效标头 / 文件被损坏'
+        self._queue.put((_FILE, (path, outcome, int(bad), reason, seconds, popups, time.time())))
+
+    def flush(self, timeout=5.0):
+        """等待已入队的记录全部写入"""
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def stop(self, timeout=5.0):
+        """写完队列中的记录后关闭"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put((_STOP, None))
+        self._thread.join(timeout)
+        with self._lock:
+            self._reader.close()
+
+    # ---------- 查询 ----------
+
+    def known_bad(self, path):
+        """之前的运行中这个文件是否打不开：返回原因（没有记录或能打开时返回 None）"""
+        with self._lock:
+            row = self._reader.execute(
+                "SELECT outcome, reason FROM files WHERE path = ? AND bad = 1", (normalize_path(path),)
+            ).fetchone()
+        if row is None:
+            return None
+        return f"{row[0]}: {row[1]}" if row[1] else row[0]
+
+    def dialogs_for(self, path):
+        """打开某个文件时处理过的弹窗：[(时间, 标题, 规则, 动作), ...]"""
+        with self._lock:
+            return self._reader.execute(
+                "SELECT ts, title, rule, action FROM dialogs WHERE file = ? ORDER BY id", (normalize_path(path),)
+            ).fetchall()
+
+    def stats(self):
+        return (f"结果日志: 已写入 {self.written} 条 ({self.batches} 批), "
+                f"待写入 {self._queue.qsize()} 条, 写入失败 {self.errors} 次")
+
+    # ---------- 写入线程 ----------
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                # 第一条记录到达后最多再等 flush_interval 秒凑成一批，flush / stop 请求立即写入
+                items = [self._queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while len(items) < self.batch_size and items[-1][0] < _FLUSH:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        items.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                if self._write(conn, items):
+                    return
+        finally:
+            conn.close()
+
+    def _write(self, conn, items):
+        """在一个事务中写入一批记录，处理其中的 flush / stop 请求，返回是否要退出"""
+        dialogs = [row for kind, row in items if kind == _DIALOG]
+        files = [row for kind, row in items if kind == _FILE]
+        if dialogs or files:
+            try:
+                with conn:
+                    if dialogs:
+                        conn.executemany(_INSERT_DIALOG, dialogs)
+                    if files:
+                        conn.executemany(_UPSERT_FILE, files)
+                self.written += len(dialogs) + len(files)
+                self.batches += 1
+            except sqlite3.Error:
+                # 数据库被锁或磁盘已满时丢弃这一批，不影响弹窗处理
+                self.errors += 1
+        stop = False
+        for kind, value in items:
+            if kind == _FLUSH:
+                value.set()
+            elif kind == _STOP:
+                stop = True
+        return stop
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+弹窗规则引擎
+规则以声明式表格描述（关键词、按钮条件、标题条件、优先级、动作），
+编译后一次扫描即可判定所有规则的关键词条件
+"""
+
+import re
+import json
+import hashlib
+
+import button_labels
+
+# 动作类型
+ACTION_CLICK = 'click'          # 点击 targets 中的按钮
+ACTION_RADIO_OK = 'radio_ok'    # 先选中 radio 中的单选按钮，再点击 targets
+
+
+class Rule:
+    """
+    一条弹窗规则
+    text / title / buttons 都是"析取范式"：若干子句任一成立即可，子句内关键词须全部出现
+      - text:    在合并后的弹窗内容中查找
+      - title:   在标题中查找
+      - buttons: 在某个按钮文本中查找
+    text 与 title 任一成立即可（都未指定视为成立），buttons / button_count 必须同时满足
+    targets / radio 是 button_labels 中的语义动作（也可以是具体的按钮文本），按顺序精确查找
+    """
+
+    __slots__ = ('name', 'description', 'action', 'targets', 'radio',
+                 'text', 'title', 'buttons', 'button_count', 'priority')
+
+    def __init__(self, name, description, action=ACTION_CLICK, targets=(), radio=(),
+                 text=(), title=(), buttons=(), button_count=None, priority=0):
+        self.name = name
+        self.description = description
+        self.action = action
+        self.targets = tuple(targets)
+        self.radio = tuple(radio)
+        self.text = _clauses(text)
+        self.title = _clauses(title)
+        self.buttons = _clauses(buttons)
+        self.button_count = button_count
+        self.priority = priority
+
+    def keywords(self):
+        """规则用到的所有关键词"""
+        return {kw for clauses in (self.text, self.title, self.buttons)
+                for clause in clauses for kw in clause}
+
+    def signature(self):
+        """规则内容的稳定表示（用于计算规则集版本）"""
+        return repr((self.name, self.action, self.targets, self.radio,
+                     [sorted(c) for c in self.text], [sorted(c) for c in self.title],
+                     [sorted(c) for c in self.buttons], self.button_count, self.priority))
+
+    def __repr__(self):
+        return f"Rule({self.name!r})"
+
+
+def _clauses(spec):
+    """'kw' / ('a', 'b') / [('a', 'b'), 'c'] -> (frozenset, ...)"""
+    if isinstance(spec, str):
+        spec = [spec]
+    clauses = []
+    for clause in spec:
+        if isinstance(clause, str):
+            clause = (clause,)
+        clauses.append(frozenset(clause))
+    return tuple(clauses)
+
+
+class KeywordMatcher:
+    """
+    多模式关键词匹配器
+    所有关键词编译为一个按长度降序的正则分支，由正则引擎单次扫描文本；
+    命中某个关键词时，被它包含的其它关键词（如 无效的 -> 无效）一并计入。
+    只有当某个关键词的后缀恰好是另一个关键词的前缀时，才需要从命中位置内部继续查找
+    """
+
+    def __init__(self, keywords):
+        keywords = sorted(set(keywords), key=lambda k: (-len(k), k))
+        self.keywords = keywords
+        self._pattern = re.compile('|'.join(re.escape(k) for k in keywords)) if keywords else None
+        self._contains = {k: frozenset(j for j in keywords if j in k) for k in keywords}
+
+        # 命中 k 之后下一次查找的起点偏移：第一个"后缀是其它关键词真前缀"的位置
+        self._resume = {}
+        for k in keywords:
+            self._resume[k] = len(k)
+            for i in range(1, len(k)):
+                suffix = k[i:]
+                if any(len(j) > len(suffix) and j.startswith(suffix) for j in keywords):
+                    self._resume[k] = i
+                    break
+        # 没有任何重叠时，非重叠的 findall 就是完整结果
+        self._exact = all(self._resume[k] == len(k) for k in keywords)
+
+    def find(self, text):
+        """返回 text 中出现过的关键词集合"""
+        found = set()
+        if not text or self._pattern is None:
+            return found
+        contains = self._contains
+
+        if self._exact:
+            for kw in set(self._pattern.findall(text)):
+                found |= contains[kw]
+            return found
+
+        search = self._pattern.search
+        resume = self._resume
+        m = search(text)
+        while m:
+            kw = m.group()
+            found |= contains[kw]
+            m = search(text, m.start() + resume[kw])
+        return found
+
+
+class RuleEngine:
+    """编译后的规则集"""
+
+    def __init__(self, rules):
+        # 优先级高的先匹配；同优先级保持表格顺序
+        order = sorted(range(len(rules)), key=lambda i: (-rules[i].priority, i))
+        self.rules = [rules[i] for i in order]
+        keywords = set()
+        for rule in self.rules:
+            keywords |= rule.keywords()
+        self.matcher = KeywordMatcher(keywords)
+        self._uses_title = any(r.title for r in self.rules)
+        self._uses_buttons = any(r.buttons for r in self.rules)
+        digest = hashlib.sha1('\n'.join(r.signature() for r in self.rules).encode('utf-8'))
+        self.version = digest.hexdigest()[:12]
+
+    def match(self, text, title='', buttons=()):
+        """按优先级返回所有条件成立的规则"""
+        find = self.matcher.find
+        text_hits = find(text)
+        title_hits = find(title) if self._uses_title else frozenset()
+        button_hits = find('\n'.join(buttons)) if self._uses_buttons else frozenset()
+        button_count = len(buttons)
+
+        matched = []
+        for rule in self.rules:
+            if rule.button_count is not None and rule.button_count != button_count:
+                continue
+            if rule.buttons and not _any_clause(rule.buttons, button_hits):
+                continue
+            if rule.text or rule.title:
+                if not (_any_clause(rule.text, text_hits) or _any_clause(rule.title, title_hits)):
+                    continue
+            matched.append(rule)
+        return matched
+
+    def text_pending(self, rule, matched, buttons=()):
+        """排在 rule 之前（rule 为 None 时是所有规则）、还没匹配、只差 text 条件的规则"""
+        button_hits = self.matcher.find('\n'.join(buttons)) if self._uses_buttons else frozenset()
+        matched = set(matched)
+        pending = []
+        for r in self.rules:
+            if r is rule:
+                break
+            if r in matched or not r.text:
+                continue
+            if r.button_count is not None and r.button_count != len(buttons):
+                continue
+            if r.buttons and not _any_clause(r.buttons, button_hits):
+                continue
+            pending.append(r)
+        return pending
+
+
+def _any_clause(clauses, hits):
+    for clause in clauses:
+        if clause <= hits:
+            return True
+    return False
+
+
+def compile_rules(rules):
+    return RuleEngine(list(rules))
+
+
+def plan(rules, snapshot):
+    """
+    不点击，按顺序找出第一条能在快照上执行的规则（控制接口的 dry-run）
+    返回 (规则, 单选按钮, 按钮)，没有能执行的规则返回 None
+    """
+    for rule in rules:
+        button = snapshot.find_button(rule.targets)
+        if button is None:
+            continue
+        radio = snapshot.find_button(rule.radio) if rule.action == ACTION_RADIO_OK else None
+        return rule, radio, button
+    return None
+
+
+def needs_more_text(engine, matched, snapshot, buttons=()):
+    """
+    补充文本（UI Automation / Hook 文本）能否改变 plan 的结果（文本分层时决定是否读取下一层）
+    补充文本只会让更多 text 条件成立：排在要执行的规则之前、目标按钮存在的待定规则才可能改变结果
+    """
+    planned = plan(matched, snapshot)
+    rule = planned[0] if planned is not None else None
+    return any(snapshot.find_button(r.targets) is not None
+               for r in engine.text_pending(rule, matched, buttons))
+
+
+# ========== 规则文件（JSON，控制接口热更新规则） ==========
+
+RULE_FIELDS = ('name', 'description', 'action', 'targets', 'radio',
+               'text', 'title', 'buttons', 'button_count', 'priority')
+
+
+def rule_from_dict(spec):
+    """{'name': ..., 'targets': [...], 'text': [...], ...} -> Rule，格式不对时抛出 ValueError"""
+    if not isinstance(spec, dict):
+        raise ValueError(f"规则必须是对象: {spec!r}")
+    unknown = set(spec) - set(RULE_FIELDS)
+    if unknown:
+        raise ValueError(f"未知的规则字段: {', '.join(sorted(unknown))}")
+    name = spec.get('name')
+    if not name or not isinstance(name, str):
+        raise ValueError(f"规则缺少 name: {spec!r}")
+    action = spec.get('action', ACTION_CLICK)
+    if action not in (ACTION_CLICK, ACTION_RADIO_OK):
+        raise ValueError(f"规则 {name}: 未知的动作 {action!r}")
+    if not spec.get('targets'):
+        raise ValueError(f"规则 {name}: 没有 targets")
+    if action == ACTION_RADIO_OK and not spec.get('radio'):
+        raise ValueError(f"规则 {name}: {ACTION_RADIO_OK} 需要 radio")
+    button_count = spec.get('button_count')
+    if button_count is not None and not isinstance(button_count, int):
+        raise ValueError(f"规则 {name}: button_count 必须是整数")
+    try:
+        return Rule(name, spec.get('description', name), action=action,
+                    targets=_strings(spec['targets']), radio=_strings(spec.get('radio', ())),
+                    text=spec.get('text', ()), title=spec.get('title', ()),
+                    buttons=spec.get('buttons', ()), button_count=button_count,
+                    priority=int(spec.get('priority', 0)))
+    except TypeError as e:
+        raise ValueError(f"规则 {name}: {e}")
+
+
+def _strings(value):
+    if isinstance(value, str):
+        return (value,)
+    return tuple(str(v) for v in value)
+
+
+def rule_to_dict(rule):
+    """Rule -> 可以写进规则文件的 dict"""
+    def clauses(value):
+        return [sorted(clause) for clause in value]
+    spec = {'name': rule.name, 'description': rule.description, 'action': rule.action,
+            'targets': list(rule.targets)}
+    if rule.radio:
+        spec['radio'] = list(rule.radio)
+    for field in ('text', 'title', 'buttons'):
+        if getattr(rule, field):
+            spec[field] = clauses(getattr(rule, field))
+    if rule.button_count is not None:
+        spec['button_count'] = rule.button_count
+    if rule.priority:
+        spec['priority'] = rule.priority
+    return spec
+
+
+def rules_from_json(data):
+    """规则文件的内容（[规则, ...] 或 {'rules': [规则, ...]}）-> [Rule, ...]"""
+    if isinstance(data, dict):
+        data = data.get('rules')
+    if not isinstance(data, list) or not data:
+        raise ValueError("规则文件中没有规则")
+    rules = [rule_from_dict(spec) for spec in data]
+    names = [r.name for r in rules]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"规则名重复: {', '.join(duplicates)}")
+    return rules
+
+
+def load_rules(path):
+    """读取规则文件，返回 [Rule, ...]；文件或规则格式不对时抛出 ValueError"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"无法读取规则文件 {path}: {e}")
+    return rules_from_json(data)
+
+
+OK_BUTTONS = ('OK', '确定')
+ERROR_KEYWORDS = ('错误', '无效', '失败', '问题', 'error', 'invalid')
+
+# 规则中用到的语义动作（button_labels）
+OK = button_labels.OK
+IGNORE = button_labels.IGNORE
+YES = button_labels.YES
+CURVES = button_labels.CURVES
+
+
+# 标准版规则（cdr_popup_handler.py）
+STANDARD_RULES = [
+    Rule('outline_id', '无效的轮廓 ID', targets=(IGNORE,),
+         text=[('无效', '轮廓'), '轮廓 ID', '轮廓ID']),
+    Rule('about_retry_ignore', '关于/重试/忽略 按钮组合（可能是轮廓ID错误）', targets=(IGNORE,),
+         text=[('关于', '重试', '忽略')]),
+    Rule('invalid_header', '无效标头', targets=(OK,),
+         text=['无法打开文件', '无效标头']),
+    Rule('file_corrupted', '文件被损坏', targets=(OK,),
+         text=['文件被损坏', ('文件', '损坏')]),
+    Rule('import_ps_prn', '导入 PS/PRN', action=ACTION_RADIO_OK, radio=(CURVES,), targets=(OK,),
+         text='PS/PRN', title='PS/PRN'),
+]
+
+# Hook 版规则（cdr_popup_handler_hook.py）
+HOOK_RULES = [
+    Rule('outline_id', '无效的轮廓 ID', targets=(IGNORE,),
+         text=[('无效', '轮廓')]),
+    Rule('single_ok', '单个 OK 按钮', targets=(OK,),
+         buttons=OK_BUTTONS, button_count=1),
+    Rule('invalid_header', '无效/无法打开', targets=(OK, IGNORE),
+         text=['无法打开', '无效标头', '无效的']),
+    Rule('file_corrupted', '文件损坏', targets=(OK,),
+         text='损坏'),
+    Rule('import_ps_prn', 'PS/PRN', action=ACTION_RADIO_OK, radio=(CURVES,), targets=(OK,),
+         text='PS/PRN'),
+    Rule('error_ignore', '错误 + 忽略按钮', targets=(IGNORE,),
+         text=ERROR_KEYWORDS, buttons='忽略'),
+    Rule('coreldraw_generic', 'CorelDRAW 通用弹窗', targets=(OK, YES),
+         title='CorelDRAW'),
+]
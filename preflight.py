@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+打开前预检
+在 CorelDRAW 打开文件之前检查文件头，把 CorelDRAW 打不开的文件挑出来跳过，
+省掉一次完整的打开和 "无效标头" / "文件被损坏" 弹窗：
+  - .cdr（X3 及以前）: RIFF 容器，检查 RIFF 头、版本和开头的块结构，声明的长度超过文件长度视为截断
+  - .cdr（X4 及以后）: ZIP 容器，检查本地文件头、结尾的中央目录和 content/ 下的文档数据
+  - .ps / .prn:        PostScript（可带 PJL 头或 DOS EPS 二进制头），有 DSC 注释的文件检查结尾的 %%EOF
+只用内存映射读取开头（和 ZIP / PS 的结尾）几 KB；大量文件用进程池并行检查
+用法: python preflight.py 目录或文件... [--workers N] [--valid-list 文件] [--report 文件]
+"""
+
+import io
+import os
+import sys
+import csv
+import mmap
+import struct
+import random
+import argparse
+import zipfile
+import concurrent.futures
+
+# 读取的文件开头 / 结尾字节数
+HEAD_SIZE = 4096
+TAIL_SIZE = 4096
+
+# ZIP 结尾的中央目录记录最多在文件末尾这么多字节内（22 字节记录 + 最长 65535 字节注释）
+EOCD_SEARCH = 22 + 65535
+
+# 中央目录最多读取这么多字节查找文档数据（条目很多时只看前面）
+CENTRAL_DIRECTORY_LIMIT = 64 * 1024
+
+# 文件数少于这个值时不启动进程池（进程启动比检查本身慢）
+POOL_THRESHOLD = 64
+
+# 结果
+VALID = 'valid'
+INVALID = 'invalid'           # 不是 CorelDRAW 能识别的格式（对应 "无效标头" 弹窗）
+CORRUPT = 'corrupt'           # 格式正确但被截断或结构损坏（对应 "文件被损坏" 弹窗）
+UNREADABLE = 'unreadable'     # 无法读取
+
+_RIFF_HEADER = struct.Struct('<4sI4s')
+_CHUNK_HEADER = struct.Struct('<4sI')
+_EOCD = struct.Struct('<4s4H2IH')
+_CENTRAL_ENTRY = struct.Struct('<4s6H3I5H2I')
+
+_PJL_UEL = b'\x1b%-12345X'
+_DOS_EPS = b'\xc5\xd0\xd3\xc6'
+
+
+class Verdict:
+    """一个文件的预检结果"""
+
+    __slots__ = ('path', 'status', 'reason')
+
+    def __init__(self, path, status, reason=''):
+        self.path = path
+        self.status = status
+        self.reason = reason
+
+    @property
+    def ok(self):
+        return self.status == VALID
+
+    def row(self):
+        return [self.path, self.status, self.reason]
+
+    def __repr__(self):
+        return f"Verdict({self.path!r}, {self.status!r}, {self.reason!r})"
+
+
+def classify(path):
+    """检查一个文件，返回 Verdict"""
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return Verdict(path, INVALID, '空文件')
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                status, reason = classify_bytes(data, size, os.path.splitext(path)[1].lower())
+    except (OSError, ValueError) as e:
+        return Verdict(path, UNREADABLE, f"{type(e).__name__}: {e}")
+    return Verdict(path, status, reason)
+
+
+def classify_bytes(data, size, ext):
+    """检查文件内容（bytes 或 mmap，只按需切片），返回 (结果, 原因)"""
+    head = data[:HEAD_SIZE]
+    if ext == '.cdr':
+        if head[:4] == b'RIFF':
+            return _check_riff(head, size)
+        if head[:4] == b'PK\x03\x04':
+            return _check_zip(data, size)
+        return INVALID, '不是 RIFF 或 ZIP 格式'
+    return _check_postscript(data, head, size)
+
+
+def _check_riff(head, size):
+    """CDR X3 及以前：RIFF 'CDRx' 头，随后是一串 [块 ID, 长度, 数据] 块"""
+    if len(head) < _RIFF_HEADER.size:
+        return CORRUPT, 'RIFF 头不完整'
+    _, declared, form = _RIFF_HEADER.unpack_from(head)
+    if form[:3] not in (b'CDR', b'cdr'):
+        return INVALID, f"RIFF 类型不是 CDR: {form!r}"
+    end = declared + 8
+    if declared < 4 or end > size:
+        return CORRUPT, f"文件被截断（声明 {end} 字节，实际 {size} 字节）"
+    # 检查读到的开头部分的块结构
+    offset = _RIFF_HEADER.size
+    while offset + _CHUNK_HEADER.size <= min(len(head), end):
+        chunk_id, length = _CHUNK_HEADER.unpack_from(head, offset)
+        if not all(32 <= c < 127 for c in chunk_id):
+            return CORRUPT, f"位置 {offset} 的块 ID 无效"
+        offset += _CHUNK_HEADER.size + length + (length & 1)
+        if offset > end:
+            return CORRUPT, f"块 {chunk_id.decode('ascii')} 超出文件范围"
+    return VALID, ''
+
+
+def _check_zip(data, size):
+    """CDR X4 及以后：ZIP 容器，结尾有中央目录，文档数据在 content/ 下"""
+    start = max(0, size - EOCD_SEARCH)
+    tail = data[start:size]
+    pos = tail.rfind(b'PK\x05\x06')
+    if pos < 0 or pos + _EOCD.size > len(tail):
+        return CORRUPT, 'ZIP 中央目录缺失（文件被截断）'
+    _, _, _, _, entries, cd_size, cd_offset, _ = _EOCD.unpack_from(tail, pos)
+    eocd = start + pos
+    if cd_offset == 0xFFFFFFFF or entries == 0xFFFF:
+        # ZIP64：中央目录位置在另一条记录中，只检查到这里
+        return VALID, ''
+    if entries == 0:
+        return INVALID, 'ZIP 中没有文件'
+    if cd_offset + cd_size > eocd:
+        return CORRUPT, 'ZIP 中央目录超出文件范围'
+    directory = data[cd_offset:cd_offset + min(cd_size, CENTRAL_DIRECTORY_LIMIT)]
+    offset = 0
+    while offset + _CENTRAL_ENTRY.size <= len(directory):
+        fields = _CENTRAL_ENTRY.unpack_from(directory, offset)
+        if fields[0] != b'PK\x01\x02':
+            return CORRUPT, 'ZIP 中央目录损坏'
+        name_len, extra_len, comment_len = fields[10], fields[11], fields[12]
+        local_offset = fields[16]
+        name = directory[offset + _CENTRAL_ENTRY.size:offset + _CENTRAL_ENTRY.size + name_len]
+        if local_offset >= cd_offset:
+            return CORRUPT, 'ZIP 条目位置超出范围'
+        if name.startswith(b'content/'):
+            return VALID, ''
+        offset += _CENTRAL_ENTRY.size + name_len + extra_len + comment_len
+    return INVALID, 'ZIP 中没有 CorelDRAW 文档数据（content/）'
+
+
+def _check_postscript(data, head, size):
+    """PS / PRN：跳过 PJL 头后应以 %! 开头；有 DSC 注释（%!PS-Adobe-）的文件结尾应有 %%EOF"""
+    if head[:4] == _DOS_EPS:
+        if len(head) < 12:
+            return CORRUPT, 'EPS 二进制头不完整'
+        ps_offset, ps_length = struct.unpack_from('<2I', head, 4)
+        if ps_offset + ps_length > size:
+            return CORRUPT, 'EPS 数据被截断'
+        return VALID, ''
+    body = head.lstrip(b'\x04 \t\r\n')
+    if body.startswith(_PJL_UEL):
+        body = body[len(_PJL_UEL):]
+        # PJL 命令每行以 @PJL 开头，之后是打印语言数据
+        while body.startswith(b'@PJL'):
+            newline = body.find(b'\n')
+            if newline < 0:
+                return CORRUPT if len(head) < HEAD_SIZE else INVALID, 'PJL 头不完整'
+            body = body[newline + 1:]
+    if not body.startswith(b'%!'):
+        return INVALID, '不是 PostScript 文件'
+    if body.startswith(b'%!PS-Adobe-'):
+        tail = data[max(0, size - TAIL_SIZE):size]
+        if b'%%EOF' not in tail and b'%%Trailer' not in tail:
+            return CORRUPT, '缺少结尾的 %%EOF（文件被截断）'
+    return VALID, ''
+
+
+def scan(paths, workers=None):
+    """检查一批文件，按原顺序返回 [Verdict, ...]；workers 为进程数（默认 CPU 数），1 表示不用进程池"""
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) < POOL_THRESHOLD:
+        return [classify(p) for p in paths]
+    chunksize = max(1, len(paths) // (workers * 8))
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(classify, paths, chunksize=chunksize))
+
+
+def write_report(verdicts, path):
+    """每个文件一行的 CSV 报告"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['path', 'status', 'reason'])
+        for v in verdicts:
+            writer.writerow(v.row())
+
+
+def make_corpus(directory, count=200, seed=0):
+    """
+    在 directory 下生成合成语料（基准用）：正常、截断、垃圾数据的 .cdr / .ps / .prn 文件，
+    返回 {路径: 预期结果}
+    """
+    rng = random.Random(seed)
+    kinds = list(_CORPUS_KINDS)
+    expected = {}
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        ext, status, build = _CORPUS_KINDS[kind]
+        path = os.path.join(directory, f"{i:05d}_{kind}{ext}")
+        with open(path, 'wb') as f:
+            f.write(build(rng))
+        expected[path] = status
+    return expected
+
+
+def _fake_riff(rng):
+    chunks = [(b'vrsn', struct.pack('<H', 1700)), (b'DISP', rng.randbytes(rng.randint(200, 2000)))]
+    for _ in range(rng.randint(5, 40)):
+        chunks.append((b'LIST', b'page' + rng.randbytes(rng.randint(500, 8000))))
+    body = b''.join(_CHUNK_HEADER.pack(cid, len(d)) + d + b'\0' * (len(d) & 1) for cid, d in chunks)
+    return _RIFF_HEADER.pack(b'RIFF', len(body) + 4, b'CDRD') + body
+
+
+def _fake_zip(rng, content=True):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as z:
+        z.writestr('META-INF/container.xml', '<container/>')
+        z.writestr('content/root.dat' if content else 'data/root.dat', _fake_riff(rng))
+        for n in range(rng.randint(0, 5) if content else 0):
+            z.writestr(f"content/data/{n}.dat", rng.randbytes(rng.randint(100, 5000)))
+        z.writestr('previews/thumbnail.png', rng.randbytes(2000))
+    return buffer.getvalue()
+
+
+def _fake_ps(rng, pjl=False, eof=True):
+    lines = [b'%!PS-Adobe-3.0', b'%%Creator: PScript5.dll', b'%%Pages: 1', b'%%EndComments']
+    lines += [b'%d %d moveto %d %d lineto stroke' % tuple(rng.randrange(1000) for _ in range(4))
+              for _ in range(rng.randint(200, 3000))]
+    if eof:
+        lines += [b'%%Trailer', b'%%EOF']
+    data = b'\n'.join(lines) + b'\n'
+    if pjl:
+        data = _PJL_UEL + b'@PJL JOB NAME="batch"\r\n@PJL ENTER LANGUAGE=POSTSCRIPT\r\n' + data + _PJL_UEL
+    return data
+
+
+def _truncate(build):
+    def truncated(rng):
+        data = build(rng)
+        return data[:rng.randint(len(data) // 4, len(data) * 3 // 4)]
+    return truncated
+
+
+# 语料中的文件种类: 名称 -> (扩展名, 预期结果, 生成函数)
+_CORPUS_KINDS = {
+    'riff': ('.cdr', VALID, _fake_riff),
+    'zip': ('.cdr', VALID, _fake_zip),
+    'ps': ('.ps', VALID, _fake_ps),
+    'prn': ('.prn', VALID, lambda rng: _fake_ps(rng, pjl=True)),
+    'riff_cut': ('.cdr', CORRUPT, _truncate(_fake_riff)),
+    'zip_cut': ('.cdr', CORRUPT, _truncate(_fake_zip)),
+    'ps_cut': ('.ps', CORRUPT, lambda rng: _fake_ps(rng, eof=False)),
+    'garbage': ('.cdr', INVALID, lambda rng: rng.randbytes(rng.randint(1000, 50000))),
+    'png': ('.cdr', INVALID, lambda rng: b'\x89PNG\r\n\x1a\n' + rng.randbytes(5000)),
+    'not_corel_zip': ('.cdr', INVALID, lambda rng: _fake_zip(rng, content=False)),
+    'pcl': ('.prn', INVALID, lambda rng: _PJL_UEL + b'@PJL ENTER LANGUAGE=PCL\r\n\x1bE' + rng.randbytes(3000)),
+    'empty': ('.ps', INVALID, lambda rng: b''),
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='检查 .cdr / .ps / .prn 文件能否被 CorelDRAW 打开')
+    parser.add_argument('paths', nargs='+', help='目录或文件（.txt 文件列表每行一个路径）')
+    parser.add_argument('--workers', type=int, help='进程数（默认 CPU 数）')
+    parser.add_argument('--valid-list', help='把可以打开的文件写到这个列表文件（可直接用于 --batch）')
+    parser.add_argument('--report', help='把每个文件的结果写到 CSV')
+    args = parser.parse_args(argv)
+
+    # batch_open 在批量打开前调用本模块，导入放在函数内避免循环依赖
+    import batch_open
+    verdicts = scan(batch_open.collect_files(args.paths), args.workers)
+    bad = [v for v in verdicts if not v.ok]
+    for v in bad:
+        print(f"{v.status}: {v.path}  {v.reason}")
+    print(f"{len(verdicts)} 个文件，{len(verdicts) - len(bad)} 个正常，{len(bad)} 个会被跳过")
+    if args.valid_list:
+        with open(args.valid_list, 'w', encoding='utf-8') as f:
+            f.writelines(v.path + '\n' for v in verdicts if v.ok)
+    if args.report:
+        write_report(verdicts, args.report)
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
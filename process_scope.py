@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+CorelDRAW 进程范围
+对话框发现只关心 CorelDRAW 进程（以及所有者链指向 CorelDRAW 窗口的对话框），
+判断只用 GetWindowThreadProcessId / GetWindow / 进程映像名，不向其它程序的窗口发送 WM_GETTEXT
+"""
+
+# CorelDRAW 主程序的映像名（不区分大小写）
+CORELDRAW_IMAGES = ('CorelDRW.exe',)
+
+# 映像名取不到时（例如权限不足），用主窗口标题识别 CorelDRAW 进程
+MAIN_WINDOW_KEYWORD = 'CorelDRAW'
+
+# 所有者链最多向上查找的层数
+MAX_OWNER_DEPTH = 8
+
+
+class ProcessScope:
+    """CorelDRAW 进程的 PID 索引，附带 PID -> 映像名缓存"""
+
+    def __init__(self, backend, images=CORELDRAW_IMAGES, keyword=MAIN_WINDOW_KEYWORD):
+        self.backend = backend
+        self.images = frozenset(name.casefold() for name in images)
+        self.keyword = keyword
+        self.pids = set()
+        self.image_names = {}
+        self.lookups = 0
+
+    def image_name(self, pid):
+        """进程映像名（按 PID 缓存，refresh 时淘汰已消失的进程）"""
+        name = self.image_names.get(pid)
+        if name is None:
+            self.lookups += 1
+            name = self.image_names[pid] = self.backend.get_process_image(pid) or ''
+        return name
+
+    def is_target_pid(self, pid):
+        if pid in self.pids:
+            return True
+        if pid and self.image_name(pid).casefold() in self.images:
+            self.pids.add(pid)
+            return True
+        return False
+
+    def refresh(self, windows=None):
+        """根据顶层窗口重建 PID 索引（随兜底扫描进行）"""
+        backend = self.backend
+        if windows is None:
+            windows = backend.enum_windows()
+        seen = set()
+        pids = set()
+        for hwnd in windows:
+            pid = backend.get_window_pid(hwnd)
+            if not pid:
+                continue
+            seen.add(pid)
+            name = self.image_name(pid)
+            if name.casefold() in self.images:
+                pids.add(pid)
+            elif (not name and not backend.get_window_owner(hwnd)
+                  and self.keyword in backend.get_window_text(hwnd)):
+                pids.add(pid)
+        self.image_names = {pid: name for pid, name in self.image_names.items() if pid in seen}
+        self.pids = pids
+
+    def has_main_window(self, pid, windows=None):
+        """进程是否已经显示主窗口（可见、没有所有者、标题含关键字的顶层窗口）"""
+        backend = self.backend
+        if windows is None:
+            windows = backend.enum_windows()
+        for hwnd in windows:
+            if (backend.get_window_pid(hwnd) == pid and backend.is_window_visible(hwnd)
+                    and not backend.get_window_owner(hwnd) and self.keyword in backend.get_window_text(hwnd)):
+                return True
+        return False
+
+    def contains(self, hwnd):
+        """窗口属于 CorelDRAW 进程，或所有者链上有 CorelDRAW 的窗口"""
+        backend = self.backend
+        for _ in range(MAX_OWNER_DEPTH):
+            if self.is_target_pid(backend.get_window_pid(hwnd)):
+                return True
+            hwnd = backend.get_window_owner(hwnd)
+            if not hwnd:
+                break
+        return False
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+进程监视
+以较低的频率对比进程快照，按 (pid, 启动时间) 跟踪 CorelDRAW 进程的启动和退出：
+  - Win32ProcessTable: Toolhelp 进程快照 + GetProcessTimes
+  - FakeProcessTable:  内存中的假进程表，Linux 下测试用
+PID 被系统复用时启动时间不同，会被当作新进程重新注入；取不到启动时间的进程先不跟踪，下一轮再试
+"""
+
+import time
+import ctypes
+import collections
+from ctypes import wintypes
+
+import win32_api
+
+# 一个进程；(pid, start_time) 唯一确定一个进程实例
+ProcessInfo = collections.namedtuple('ProcessInfo', 'pid start_time image')
+
+TH32CS_SNAPPROCESS = 0x00000002
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+# 函数原型见 win32_api（非 Windows 下为 None）
+kernel32 = win32_api.kernel32
+PROCESSENTRY32W = win32_api.PROCESSENTRY32W
+
+
+class Win32ProcessTable:
+    """基于 Toolhelp 快照的进程表"""
+
+    def snapshot(self, images):
+        """映像名（小写）在 images 中的所有进程"""
+        handle = kernel32.CreateToolhelp32Snapshot(TH32CS_SNAPPROCESS, 0)
+        if not handle or handle == win32_api.INVALID_HANDLE_VALUE:
+            return []
+        result = []
+        try:
+            entry = PROCESSENTRY32W()
+            entry.dwSize = ctypes.sizeof(PROCESSENTRY32W)
+            ok = kernel32.Process32FirstW(handle, ctypes.byref(entry))
+            while ok:
+                if entry.szExeFile.casefold() in images:
+                    pid = entry.th32ProcessID
+                    result.append(ProcessInfo(pid, self.start_time(pid), entry.szExeFile))
+                ok = kernel32.Process32NextW(handle, ctypes.byref(entry))
+        finally:
+            kernel32.CloseHandle(handle)
+        return result
+
+    def start_time(self, pid):
+        """进程创建时间（FILETIME 整数），取不到（权限不足、进程正在退出）返回 None"""
+        process = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not process:
+            return None
+        try:
+            times = [wintypes.FILETIME() for _ in range(4)]
+            if not kernel32.GetProcessTimes(process, *[ctypes.byref(t) for t in times]):
+                return None
+            return (times[0].dwHighDateTime << 32) | times[0].dwLowDateTime
+        finally:
+            kernel32.CloseHandle(process)
+
+
+class FakeProcessTable:
+    """内存中的假进程表"""
+
+    def __init__(self):
+        self.processes = {}
+        self.snapshots = 0
+        self._clock = 0
+        self._next_pid = 1000
+
+    def start(self, image, pid=None):
+        """启动进程（可以指定 pid，模拟 PID 复用），返回 pid"""
+        if pid is None:
+            self._next_pid += 4
+            pid = self._next_pid
+        self._clock += 1
+        self.processes[pid] = ProcessInfo(pid, self._clock, image)
+        return pid
+
+    def exit(self, pid):
+        self.processes.pop(pid, None)
+
+    def snapshot(self, images):
+        self.snapshots += 1
+        return [p for p in self.processes.values() if p.image.casefold() in images]
+
+
+class ProcessWatcher:
+    """每隔 interval 秒对比一次进程快照"""
+
+    def __init__(self, table, images, interval=2.0):
+        self.table = table
+        self.images = frozenset(name.casefold() for name in images)
+        self.interval = interval
+        self.processes = {}
+        self._next_poll = 0.0
+
+    def poll(self, now=None):
+        """到期时对比快照，返回 (新启动的进程, 已退出的进程)；未到期返回 None"""
+        if now is None:
+            now = time.monotonic()
+        if now < self._next_poll:
+            return None
+        self._next_poll = now + self.interval
+
+        current = {}
+        for p in self.table.snapshot(self.images):
+            if p.start_time is None:
+                # 没有启动时间就无法区分 PID 复用：已跟踪的同一 PID 保留原记录，新进程下一轮再试
+                current.update((key, q) for key, q in self.processes.items() if key[0] == p.pid)
+            else:
+                current[(p.pid, p.start_time)] = p
+        started = [p for key, p in current.items() if key not in self.processes]
+        exited = [p for key, p in self.processes.items() if key not in current]
+        self.processes = current
+        return started, exited
+
+
+class InjectionTracker:
+    """
+    按 (pid, 启动时间) 跟踪注入状态
+    每个进程实例只注入一次；进程退出后移除记录；注入失败的在之后的轮次重试，最多 max_attempts 次
+    ready(pid) 为 False 的进程（还在启动，界面模块没有全部加载）先不注入，之后每次 update 都重新检查
+    """
+
+    def __init__(self, watcher, inject, ready=None, max_attempts=5):
+        self.watcher = watcher
+        self.inject = inject
+        self.ready = ready
+        self.max_attempts = max_attempts
+        self.injected = set()
+        self.failures = {}
+        self.waiting = set()
+
+    def update(self, now=None):
+        """返回 (本轮注入成功的进程, 本轮发现已退出的进程)"""
+        changes = self.watcher.poll(now)
+        if changes is None:
+            if not self.waiting:
+                return [], []
+            # 没到对比快照的时间，只检查等待中的进程是否已经就绪
+            exited = []
+            candidates = [(key, self.watcher.processes[key]) for key in list(self.waiting)
+                          if key in self.watcher.processes]
+        else:
+            _, exited = changes
+            for proc in exited:
+                key = (proc.pid, proc.start_time)
+                self.injected.discard(key)
+                self.failures.pop(key, None)
+                self.waiting.discard(key)
+            candidates = list(self.watcher.processes.items())
+
+        injected = []
+        for key, proc in candidates:
+            if key in self.injected or self.failures.get(key, 0) >= self.max_attempts:
+                continue
+            if self.ready is not None and not self.ready(proc.pid):
+                self.waiting.add(key)
+                continue
+            self.waiting.discard(key)
+            if self.inject(proc.pid):
+                self.injected.add(key)
+                self.failures.pop(key, None)
+                injected.append(proc)
+            else:
+                self.failures[key] = self.failures.get(key, 0) + 1
+        return injected, exited
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+弹窗回放基准
+把记录下来的弹窗语料（replay_corpus.json）按时间戳在 FakeDesktop 上重新弹出，
+走两个处理程序完整的 检测 -> 快照 -> 规则 -> 点击 流程，统计：
+  - 每秒处理的弹窗数、检测到点击的 p50/p99 延迟
+  - 每个弹窗的跨进程调用次数（CountingBackend）
+  - 峰值内存（tracemalloc）
+并与基线文件（replay_baseline.json）对比，超出容差时返回非 0
+用法: python replay.py [--handler standard|hook] [--speed 倍速] [--update-baseline]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import threading
+import contextlib
+import tracemalloc
+
+import decision_cache
+import dialog_workers
+import hook_protocol
+import window_backend
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(HERE, 'replay_corpus.json')
+DEFAULT_BASELINE = os.path.join(HERE, 'replay_baseline.json')
+
+HANDLERS = {
+    'standard': 'cdr_popup_handler',
+    'hook': 'cdr_popup_handler_hook',
+}
+
+# 语料中非 CorelDRAW 进程的 pid
+FOREIGN_PROCESSES = {2: 'notepad.exe'}
+
+# 最后一个弹窗出现后，最多再等这么多秒让处理程序处理完
+DRAIN_TIMEOUT = 5.0
+
+# 与基线对比的容差：(指标, 方向, 相对容差, 绝对容差)
+# 方向 'max' 表示越小越好（超过 基线 * (1 + 相对) + 绝对 算回退），'min' 反之
+TOLERANCES = (
+    ('handled', 'min', 0.0, 0),
+    ('wrong', 'max', 0.0, 0),
+    ('duplicate_clicks', 'max', 0.0, 0),
+    ('calls_per_popup', 'max', 0.10, 1),
+    ('p50_ms', 'max', 0.50, 20),
+    ('p99_ms', 'max', 0.50, 50),
+    ('popups_per_sec', 'min', 0.35, 0),
+    ('peak_kb', 'max', 0.25, 64),
+)
+
+
+def load_corpus(path=DEFAULT_CORPUS):
+    """读取语料，返回按时间戳排序的弹窗列表"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return sorted(data['dialogs'], key=lambda d: d['t'])
+
+
+class ReplayDesktop(window_backend.FakeDesktop):
+    """记录每个对话框被按钮关闭的时间和按钮文本"""
+
+    def __init__(self):
+        super().__init__(events=True)
+        self.processes.update(FOREIGN_PROCESSES)
+        self.closed_by = {}
+
+    def _activate(self, win):
+        root = self.root_of(win.hwnd)
+        super()._activate(win)
+        if root not in self.closed_by and root not in self.windows:
+            self.closed_by[root] = (time.perf_counter(), win.text)
+
+
+class _ReplayLoop:
+    """处理程序主循环的一个实例（与 main 中的循环一致，只是可以停止）"""
+
+    def __init__(self, handler, shared_mem, max_workers):
+        self.handler = handler
+        self.shared_mem = shared_mem
+        self.watcher = window_backend.DialogWatcher(
+            handler.backend, handler.is_coreldraw_dialog,
+            safety_interval=handler.SAFETY_SCAN_INTERVAL, budget=handler.text_budget,
+            metrics=handler.telemetry
+        )
+        self.stability = window_backend.StabilityTracker()
+        if shared_mem is None:
+            handle = lambda hwnd: handler.process_dialog(self.watcher, hwnd)
+        else:
+            handle = lambda hwnd: handler.process_dialog(self.watcher, hwnd, self.stability, shared_mem)
+        self.workers = dialog_workers.DialogWorkers(handle, handler.dialog_lane, max_workers)
+
+    def step(self):
+        handler = self.handler
+        dialogs = self.watcher.next_dialogs()
+        if self.watcher.swept:
+            handler.scope.refresh()
+        if self.watcher.swept:
+            self.workers.prune(handler.backend.is_window)
+            handler.unmatched.prune(handler.backend.is_window)
+            if self.shared_mem is not None:
+                self.stability.prune(handler.backend.is_window)
+                self.shared_mem.prune(handler.backend.is_window)
+                changed = handler.changed_unmatched(self.shared_mem)
+                if changed:
+                    self.watcher.recheck(changed)
+        self.workers.submit(dialogs)
+
+    def close(self):
+        self.workers.close()
+        self.watcher.close()
+
+
+def replay(handler_name, corpus, speed=1.0, workers=dialog_workers.DEFAULT_WORKERS):
+    """
+    回放一遍语料，返回统计结果（dict）
+    speed:   时间轴倍速，0 表示所有弹窗同时出现
+    workers: 处理对话框的工作线程数（1 相当于逐个处理）
+    """
+    handler = importlib.import_module(HANDLERS[handler_name])
+    desktop = ReplayDesktop()
+    counting = window_backend.CountingBackend(desktop)
+    main_window = desktop.create_window('CorelDRAW X7 - [batch.cdr]', class_name='CorelDRAW')
+
+    shared_mem = writer = None
+    if handler_name == 'hook':
+        shared_mem = handler.SharedMemory()
+        shared_mem.attach(bytearray(hook_protocol.total_size()))
+        writer = hook_protocol.RingWriter(shared_mem.view)
+
+    # 基准只关心依赖后端的全局对象，导入放在函数内避免循环依赖
+    import benchmarks
+    saved = benchmarks._swap_handler(
+        handler, counting,
+        text_budget=window_backend.TextBudget(call_timeout=0.1, scan_budget=0.25),
+        decisions=decision_cache.DecisionCache(handler.rule_engine.version),
+    )
+
+    created = {}
+    expected = {}
+
+    def producer():
+        start = time.perf_counter()
+        for index, entry in enumerate(corpus):
+            if speed:
+                time.sleep(max(0.0, start + entry['t'] / speed - time.perf_counter()))
+            children = [tuple(c) for c in entry['controls']]
+            pid = entry.get('pid', 1)
+            # CorelDRAW 的对话框属于主窗口，其它程序的对话框没有所有者
+            hwnd = desktop.create_window(entry['title'], pid=pid, children=children,
+                                         owner=main_window if pid == 1 else 0)
+            if entry.get('busy'):
+                desktop.set_delay(hwnd, entry['busy'])
+            if writer is not None:
+                for text in entry.get('hook', ()):
+                    writer.write(text, hwnd=hwnd, root=hwnd)
+            created[hwnd] = (index, desktop.windows[hwnd].created_at)
+            expected[hwnd] = entry['expect'].get(handler_name)
+
+    loop = _ReplayLoop(handler, shared_mem, workers)
+    thread = threading.Thread(target=producer, daemon=True)
+    tracemalloc.start()
+    counting.reset()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            thread.start()
+            deadline = None
+            while True:
+                loop.step()
+                if deadline is None and not thread.is_alive():
+                    deadline = time.monotonic() + DRAIN_TIMEOUT
+                if deadline is not None and (
+                        time.monotonic() >= deadline
+                        or all(h in desktop.closed_by for h, label in expected.items() if label)):
+                    break
+            thread.join()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        loop.close()
+        benchmarks._restore_handler(handler, saved)
+
+    latencies = []
+    wrong = []
+    for hwnd, (index, created_at) in created.items():
+        closed = desktop.closed_by.get(hwnd)
+        label = closed[1] if closed else None
+        if label != expected[hwnd]:
+            wrong.append((index, expected[hwnd], label))
+        elif closed:
+            latencies.append(closed[0] - created_at)
+
+    first = min(t for _, t in created.values())
+    last = max([t for t, _ in desktop.closed_by.values()] or [first])
+    return {
+        'popups': len(corpus),
+        'handled': len(latencies),
+        'wrong': len(wrong),
+        'duplicate_clicks': duplicate_clicks(desktop),
+        'wrong_cases': wrong,
+        'popups_per_sec': len(latencies) / max(last - first, 1e-6),
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+        'calls_per_popup': counting.total() / len(corpus),
+        'calls': dict(counting.calls.most_common()),
+        'peak_kb': peak / 1024,
+    }
+
+
+def duplicate_clicks(desktop):
+    """被点击了不止一次的按钮数（正确时为 0；备用点击方式也会计入）"""
+    counts = {}
+    for hwnd, _ in desktop.clicks:
+        counts[hwnd] = counts.get(hwnd, 0) + 1
+    return sum(1 for n in counts.values() if n > 1)
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def compare(result, baseline):
+    """与基线对比，返回回退的指标说明列表"""
+    regressions = []
+    for name, direction, rel, absolute in TOLERANCES:
+        if name not in baseline:
+            continue
+        base, value = baseline[name], result[name]
+        if direction == 'max' and value > base * (1 + rel) + absolute:
+            regressions.append(f"{name} {value:.1f} > 基线 {base:.1f}")
+        elif direction == 'min' and value < base * (1 - rel) - absolute:
+            regressions.append(f"{name} {value:.1f} < 基线 {base:.1f}")
+    return regressions
+
+
+def load_baseline(path=DEFAULT_BASELINE, speed=1.0):
+    """读取基线；文件不存在或基线是用其它倍速记录的，返回空 dict"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('speed') != speed:
+        return {}
+    return data.get('handlers', {})
+
+
+def save_baseline(results, path=DEFAULT_BASELINE, speed=1.0):
+    fields = [name for name, *_ in TOLERANCES]
+    data = {
+        'speed': speed,
+        'handlers': {name: {k: round(r[k], 3) for k in fields} for name, r in results.items()},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+
+def format_result(name, result):
+    calls = ', '.join(f"{k} {v}" for k, v in list(result['calls'].items())[:5])
+    return (f"  {name}: {result['handled']}/{result['popups']} 个弹窗, 错误 {result['wrong']}, "
+            f"{result['popups_per_sec']:.1f} 个/秒, p50 {result['p50_ms']:.0f}ms, "
+            f"p99 {result['p99_ms']:.0f}ms, 每个弹窗 {result['calls_per_popup']:.1f} 次调用 "
+            f"({calls}), 峰值内存 {result['peak_kb']:.0f}KB")
+
+
+def run_suite(handlers=None, corpus_path=DEFAULT_CORPUS, baseline_path=DEFAULT_BASELINE,
+              speed=1.0, update_baseline=False):
+    """回放全部处理程序并与基线对比，返回回退数量"""
+    corpus = load_corpus(corpus_path)
+    baseline = load_baseline(baseline_path, speed)
+    results = {}
+    failures = 0
+    for name in handlers or list(HANDLERS):
+        result = results[name] = replay(name, corpus, speed)
+        print(format_result(name, result))
+        for index, expect, label in result['wrong_cases']:
+            print(f"    ⚠️ 第 {index} 个弹窗: 应点击 {expect!r}，实际 {label!r}")
+        if update_baseline:
+            continue
+        if name not in baseline:
+            print("    (没有基线)")
+            continue
+        regressions = compare(result, baseline[name])
+        for line in regressions:
+            print(f"    ❌ 回退: {line}")
+        failures += len(regressions)
+    if update_baseline:
+        save_baseline(results, baseline_path, speed)
+        print(f"  基线已更新: {baseline_path}")
+    return failures
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='弹窗回放基准')
+    parser.add_argument('--handler', choices=list(HANDLERS), action='append',
+                        help='只回放指定的处理程序（可重复）')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--speed', type=float, default=1.0, help='时间轴倍速，0 表示同时弹出')
+    parser.add_argument('--update-baseline', action='store_true', help='用本次结果覆盖基线')
+    args = parser.parse_args(argv)
+    failures = run_suite(args.handler, args.corpus, args.baseline, args.speed, args.update_baseline)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
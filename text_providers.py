@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+文本来源分层
+弹窗的文本按代价从低到高依次获取，补充文本可能改变要执行的规则时（popup_rules.needs_more_text）才使用下一层：
+  1. Win32 快照（dialog_snapshot，逐个控件 WM_GETTEXT）：处理程序本来就会读取
+  2. UIAProvider:        UI Automation 一次调用取回整个对话框子树（名称、控件类型、AutomationId、选中状态），
+                         不需要注入，能读到部分自绘控件的文本；需要 comtypes
+  3. HookTextProvider:   Hook DLL 写入共享内存的绘制文本（需要管理员权限注入，只有 Hook 版有）
+FakeUIAProvider 在 FakeDesktop 上模拟 UI Automation（基准用）
+"""
+
+import abc
+import sys
+import threading
+
+# UI Automation 属性 / 常量（UIAutomationClient.h）
+UIA_NamePropertyId = 30005
+UIA_ControlTypePropertyId = 30003
+UIA_AutomationIdPropertyId = 30011
+UIA_ToggleToggleStatePropertyId = 30086
+TreeScope_Descendants = 4
+AutomationElementMode_None = 0
+ToggleState_On = 1
+
+# 控件类型 ID -> 名称（只列出弹窗中常见的）
+CONTROL_TYPES = {
+    50000: 'Button',
+    50002: 'CheckBox',
+    50004: 'Edit',
+    50013: 'RadioButton',
+    50020: 'Text',
+    50032: 'Window',
+    50033: 'Pane',
+}
+
+
+class UiaElement:
+    """UI Automation 取回的一个元素"""
+
+    __slots__ = ('name', 'control_type', 'automation_id', 'toggled')
+
+    def __init__(self, name, control_type='', automation_id='', toggled=None):
+        self.name = name
+        self.control_type = control_type
+        self.automation_id = automation_id
+        self.toggled = toggled
+
+
+class TextProvider(abc.ABC):
+    """
+    文本来源接口
+    calls 是调用次数（基准中统计每层被用到的次数）
+    """
+
+    name = ''
+
+    def __init__(self):
+        self.calls = 0
+
+    @abc.abstractmethod
+    def texts(self, hwnd, snapshot):
+        """返回快照中没有的文本（用 new_texts 过滤，没有时返回空列表）"""
+
+
+def new_texts(snapshot, candidates):
+    """去掉快照中已有的文本和空文本（保持顺序、去重）"""
+    known = set(snapshot.texts) | set(snapshot.button_texts) | {snapshot.title}
+    result = []
+    for text in candidates:
+        text = text.strip() if text else ''
+        if text and text not in known:
+            known.add(text)
+            result.append(text)
+    return result
+
+
+class UIAProvider(TextProvider):
+    """
+    UI Automation：缓存请求（CacheRequest）中列出要取回的属性，
+    FindAllBuildCache 一次跨进程调用取回整个子树的这些属性（元素只保留缓存，不保留实时引用）
+    """
+
+    name = 'uia'
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def _automation(self):
+        # 每个工作线程单独初始化 COM 和 IUIAutomation
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            import comtypes
+            import comtypes.client
+            comtypes.CoInitializeEx(comtypes.COINIT_MULTITHREADED)
+            comtypes.client.GetModule('UIAutomationCore.dll')
+            from comtypes.gen import UIAutomationClient as uia
+            automation = comtypes.client.CreateObject(uia.CUIAutomation, interface=uia.IUIAutomation)
+            request = automation.CreateCacheRequest()
+            for prop in (UIA_NamePropertyId, UIA_ControlTypePropertyId,
+                         UIA_AutomationIdPropertyId, UIA_ToggleToggleStatePropertyId):
+                request.AddProperty(prop)
+            request.AutomationElementMode = AutomationElementMode_None
+            state = self._local.state = (automation, request, automation.CreateTrueCondition())
+        return state
+
+    def elements(self, hwnd):
+        """整个对话框子树的元素；UI Automation 不可用或窗口已关闭时返回空列表"""
+        self.calls += 1
+        try:
+            automation, request, condition = self._automation()
+            root = automation.ElementFromHandle(hwnd)
+            found = root.FindAllBuildCache(TreeScope_Descendants, condition, request)
+            result = []
+            for i in range(found.Length):
+                element = found.GetElement(i)
+                toggle = element.GetCachedPropertyValue(UIA_ToggleToggleStatePropertyId)
+                result.append(UiaElement(
+                    element.CachedName,
+                    CONTROL_TYPES.get(element.CachedControlType, str(element.CachedControlType)),
+                    element.CachedAutomationId,
+                    toggle == ToggleState_On if isinstance(toggle, int) else None,
+                ))
+            return result
+        except Exception:
+            # COM 错误（窗口已关闭、程序不支持 UI Automation）时当作没有补充文本
+            return []
+
+    def texts(self, hwnd, snapshot):
+        return new_texts(snapshot, [e.name for e in self.elements(hwnd)])
+
+
+class HookTextProvider(TextProvider):
+    """Hook DLL 绘制文本（shared_mem 是 Hook 版的 SharedMemory）"""
+
+    name = 'hook'
+
+    def __init__(self, shared_mem):
+        super().__init__()
+        self.shared_mem = shared_mem
+
+    def texts(self, hwnd, snapshot):
+        self.calls += 1
+        return new_texts(snapshot, self.shared_mem.read_texts(hwnd))
+
+
+def default_uia():
+    """Windows 下装有 comtypes 时返回 UIAProvider，否则返回 None"""
+    if sys.platform != 'win32':
+        return None
+    try:
+        import comtypes.client  # noqa: F401
+    except ImportError:
+        return None
+    return UIAProvider()
+
+
+class FakeUIAProvider(TextProvider):
+    """
+    在 FakeDesktop 上模拟 UI Automation：子树中的控件加上 drawn 中登记的自绘文本（hwnd -> [文本, ...]，
+    Win32 读不到、UI Automation 能读到），一次调用取回，记录调用次数
+    """
+
+    name = 'uia'
+
+    def __init__(self, desktop, drawn=None):
+        super().__init__()
+        self.desktop = desktop
+        self.drawn = drawn if drawn is not None else {}
+
+    def elements(self, hwnd):
+        self.calls += 1
+        desktop = self.desktop
+        result = []
+        for child in desktop.enum_child_windows(hwnd):
+            win = desktop.windows.get(child)
+            if win is not None:
+                result.append(UiaElement(win.text, win.class_name, str(win.control_id), win.checked))
+        result += [UiaElement(text, 'Text') for text in self.drawn.get(hwnd, ())]
+        return result
+
+    def texts(self, hwnd, snapshot):
+        return new_texts(snapshot, [e.name for e in self.elements(hwnd)])
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Windows API 绑定
+两个处理程序用到的 user32 / kernel32 / shell32 函数都在 PROTOTYPES 中声明 restype / argtypes，
+加载时一次绑定（未声明的函数 ctypes 默认按 C int 返回，64 位下句柄、地址会被截断）：
+  - user32 / kernel32 / shell32: 绑定好的 DLL（非 Windows 下为 None）
+  - Buffers:     每个线程复用的文本、类名缓冲区和输出参数，不再每次调用都分配
+  - collect_hwnd: 模块级的枚举回调（EnumWindows / EnumChildWindows 共用），不再每次枚举都创建回调
+  - FakeUser32:  在 window_backend.FakeDesktop 上模拟 user32（按 C 的方式写缓冲区、调用回调），
+                 Linux 下测量 Win32Backend 的调用开销用
+"""
+
+import sys
+import time
+import ctypes
+import threading
+from ctypes import wintypes
+
+# Windows 下是 stdcall 回调（64 位下与 cdecl 相同）
+FUNCTYPE = getattr(ctypes, 'WINFUNCTYPE', ctypes.CFUNCTYPE)
+
+# 回调函数类型
+EnumWindowsProc = FUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
+WinEventProc = FUNCTYPE(
+    None, wintypes.HANDLE, wintypes.DWORD, wintypes.HWND,
+    wintypes.LONG, wintypes.LONG, wintypes.DWORD, wintypes.DWORD
+)
+
+# 类名最长 256 个字符（WNDCLASS 的限制）
+CLASS_NAME_LENGTH = 256
+
+# 每个线程的文本缓冲区初始长度（字符），更长的文本按需扩大并保留
+TEXT_BUFFER_LENGTH = 512
+
+INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+
+class PROCESSENTRY32W(ctypes.Structure):
+    _fields_ = [
+        ('dwSize', wintypes.DWORD),
+        ('cntUsage', wintypes.DWORD),
+        ('th32ProcessID', wintypes.DWORD),
+        ('th32DefaultHeapID', ctypes.c_size_t),
+        ('th32ModuleID', wintypes.DWORD),
+        ('cntThreads', wintypes.DWORD),
+        ('th32ParentProcessID', wintypes.DWORD),
+        ('pcPriClassBase', wintypes.LONG),
+        ('dwFlags', wintypes.DWORD),
+        ('szExeFile', wintypes.WCHAR * 260),
+    ]
+
+
+_HWND = wintypes.HWND
+_HANDLE = wintypes.HANDLE
+_DWORD = wintypes.DWORD
+_UINT = wintypes.UINT
+_BOOL = wintypes.BOOL
+_INT = ctypes.c_int
+_LRESULT = wintypes.LPARAM
+_SIZE_T = ctypes.c_size_t
+_PVOID = ctypes.c_void_p
+
+# DLL -> 函数名 -> (restype, argtypes)
+PROTOTYPES = {
+    'user32': {
+        'EnumWindows': (_BOOL, [EnumWindowsProc, wintypes.LPARAM]),
+        'EnumChildWindows': (_BOOL, [_HWND, EnumWindowsProc, wintypes.LPARAM]),
+        'GetWindowTextLengthW': (_INT, [_HWND]),
+        'GetWindowTextW': (_INT, [_HWND, wintypes.LPWSTR, _INT]),
+        'GetClassNameW': (_INT, [_HWND, wintypes.LPWSTR, _INT]),
+        'GetWindowThreadProcessId': (_DWORD, [_HWND, ctypes.POINTER(_DWORD)]),
+        'GetWindow': (_HWND, [_HWND, _UINT]),
+        'GetAncestor': (_HWND, [_HWND, _UINT]),
+        'GetDlgCtrlID': (_INT, [_HWND]),
+        'GetWindowLongW': (wintypes.LONG, [_HWND, _INT]),
+        'IsWindowVisible': (_BOOL, [_HWND]),
+        'IsWindow': (_BOOL, [_HWND]),
+        'IsWindowEnabled': (_BOOL, [_HWND]),
+        'PostMessageW': (_BOOL, [_HWND, _UINT, wintypes.WPARAM, wintypes.LPARAM]),
+        'PostThreadMessageW': (_BOOL, [_DWORD, _UINT, wintypes.WPARAM, wintypes.LPARAM]),
+        'SendMessageTimeoutW': (_LRESULT, [_HWND, _UINT, wintypes.WPARAM, _PVOID,
+                                           _UINT, _UINT, ctypes.POINTER(_SIZE_T)]),
+        'SetWinEventHook': (_HANDLE, [_DWORD, _DWORD, wintypes.HMODULE, WinEventProc,
+                                      _DWORD, _DWORD, _DWORD]),
+        'UnhookWinEvent': (_BOOL, [_HANDLE]),
+        'PeekMessageW': (_BOOL, [ctypes.POINTER(wintypes.MSG), _HWND, _UINT, _UINT, _UINT]),
+        'TranslateMessage': (_BOOL, [ctypes.POINTER(wintypes.MSG)]),
+        'DispatchMessageW': (_LRESULT, [ctypes.POINTER(wintypes.MSG)]),
+        'MsgWaitForMultipleObjects': (_DWORD, [_DWORD, ctypes.POINTER(_HANDLE), _BOOL, _DWORD, _DWORD]),
+    },
+    'kernel32': {
+        'GetCurrentThreadId': (_DWORD, []),
+        'OpenProcess': (_HANDLE, [_DWORD, _BOOL, _DWORD]),
+        'CloseHandle': (_BOOL, [_HANDLE]),
+        'QueryFullProcessImageNameW': (_BOOL, [_HANDLE, _DWORD, wintypes.LPWSTR, ctypes.POINTER(_DWORD)]),
+        'GetProcessTimes': (_BOOL, [_HANDLE] + [ctypes.POINTER(wintypes.FILETIME)] * 4),
+        'CreateToolhelp32Snapshot': (_HANDLE, [_DWORD, _DWORD]),
+        'Process32FirstW': (_BOOL, [_HANDLE, ctypes.POINTER(PROCESSENTRY32W)]),
+        'Process32NextW': (_BOOL, [_HANDLE, ctypes.POINTER(PROCESSENTRY32W)]),
+        'CreateFileMappingW': (_HANDLE, [_HANDLE, _PVOID, _DWORD, _DWORD, _DWORD, wintypes.LPCWSTR]),
+        'MapViewOfFile': (_PVOID, [_HANDLE, _DWORD, _DWORD, _DWORD, _SIZE_T]),
+        'UnmapViewOfFile': (_BOOL, [_PVOID]),
+        'VirtualAllocEx': (_PVOID, [_HANDLE, _PVOID, _SIZE_T, _DWORD, _DWORD]),
+        'VirtualFreeEx': (_BOOL, [_HANDLE, _PVOID, _SIZE_T, _DWORD]),
+        'WriteProcessMemory': (_BOOL, [_HANDLE, _PVOID, _PVOID, _SIZE_T, ctypes.POINTER(_SIZE_T)]),
+        'GetModuleHandleW': (wintypes.HMODULE, [wintypes.LPCWSTR]),
+        'GetProcAddress': (_PVOID, [wintypes.HMODULE, wintypes.LPCSTR]),
+        'CreateRemoteThread': (_HANDLE, [_HANDLE, _PVOID, _SIZE_T, _PVOID, _PVOID, _DWORD,
+                                         ctypes.POINTER(_DWORD)]),
+        'WaitForSingleObject': (_DWORD, [_HANDLE, _DWORD]),
+    },
+    'shell32': {
+        'IsUserAnAdmin': (_BOOL, []),
+    },
+}
+
+# 返回句柄或地址的函数：restype 必须和指针一样宽
+POINTER_RESULTS = (
+    ('user32', 'GetWindow'), ('user32', 'GetAncestor'), ('user32', 'SetWinEventHook'),
+    ('kernel32', 'OpenProcess'), ('kernel32', 'CreateToolhelp32Snapshot'),
+    ('kernel32', 'CreateFileMappingW'), ('kernel32', 'MapViewOfFile'), ('kernel32', 'VirtualAllocEx'),
+    ('kernel32', 'GetModuleHandleW'), ('kernel32', 'GetProcAddress'), ('kernel32', 'CreateRemoteThread'),
+)
+
+
+def bind(dll, prototypes):
+    """按 prototypes 设置 dll 中各函数的 restype / argtypes，返回 dll"""
+    for name, (restype, argtypes) in prototypes.items():
+        function = getattr(dll, name)
+        function.restype = restype
+        function.argtypes = argtypes
+    return dll
+
+
+def load(name):
+    """
+    单独加载一个 DLL 实例并绑定（不使用共享的 ctypes.windll，
+    避免和其它模块对同一函数的 restype / argtypes 设置互相影响）
+    """
+    return bind(ctypes.WinDLL(name, use_last_error=True), PROTOTYPES[name])
+
+
+if sys.platform == 'win32':
+    user32 = load('user32')
+    kernel32 = load('kernel32')
+    shell32 = load('shell32')
+else:
+    user32 = kernel32 = shell32 = None
+
+
+class Buffers(threading.local):
+    """每个线程复用的缓冲区和输出参数（byref 也只创建一次）"""
+
+    def __init__(self):
+        self.text_length = TEXT_BUFFER_LENGTH
+        self.text = ctypes.create_unicode_buffer(TEXT_BUFFER_LENGTH)
+        self.class_name = ctypes.create_unicode_buffer(CLASS_NAME_LENGTH)
+        self.dword = _DWORD()
+        self.dword_ref = ctypes.byref(self.dword)
+        self.result = _SIZE_T()
+        self.result_ref = ctypes.byref(self.result)
+
+    def text_buffer(self, length):
+        """至少能放下 length 个字符的文本缓冲区（需要时按倍数扩大）"""
+        if length > self.text_length:
+            size = self.text_length
+            while size < length:
+                size *= 2
+            self.text = ctypes.create_unicode_buffer(size)
+            self.text_length = size
+        return self.text
+
+
+# 正在进行的枚举：lparam（id(列表)）-> 列表
+_collecting = {}
+
+
+@EnumWindowsProc
+def collect_hwnd(hwnd, lparam):
+    """枚举回调：把 hwnd 追加到 lparam 对应的列表中"""
+    _collecting[lparam].append(hwnd)
+    return True
+
+
+def _collect(call, *args):
+    found = []
+    key = id(found)
+    _collecting[key] = found
+    try:
+        call(*args, collect_hwnd, key)
+    finally:
+        del _collecting[key]
+    return found
+
+
+def enum_windows(dll):
+    """所有顶层窗口"""
+    return _collect(dll.EnumWindows)
+
+
+def enum_child_windows(dll, hwnd):
+    """所有子窗口"""
+    return _collect(dll.EnumChildWindows, hwnd)
+
+
+class FakeUser32:
+    """
+    在 FakeDesktop 上模拟 user32 的函数（只实现 Win32Backend 读取快照和过滤事件用到的）：
+    文本写入调用方传入的缓冲区，枚举通过 ctypes 调用回调，和真实 DLL 的用法一致
+    """
+
+    WM_GETTEXT = 0x000D
+    WM_GETTEXTLENGTH = 0x000E
+
+    def __init__(self, desktop):
+        self.desktop = desktop
+        # SetWinEventHook 注册的 (最小事件, 最大事件, 回调)
+        self._hooks = []
+
+    @staticmethod
+    def _out(ref):
+        # ctypes.byref 的结果，或者直接传入的 ctypes 对象
+        return getattr(ref, '_obj', ref)
+
+    def _text(self, hwnd):
+        win = self.desktop.windows.get(hwnd)
+        return win.text if win is not None else ''
+
+    def _window_text(self, hwnd):
+        # 和真实的 GetWindowText 一样，只对顶层窗口返回文本，其它进程的控件要用 WM_GETTEXT
+        win = self.desktop.windows.get(hwnd)
+        return win.text if win is not None and win.parent is None else ''
+
+    def EnumWindows(self, proc, lparam):
+        for hwnd in self.desktop.enum_windows():
+            if not proc(hwnd, lparam):
+                break
+        return True
+
+    def EnumChildWindows(self, hwnd, proc, lparam):
+        for child in self.desktop.enum_child_windows(hwnd):
+            if not proc(child, lparam):
+                break
+        return True
+
+    def GetWindowTextLengthW(self, hwnd):
+        return len(self._window_text(hwnd))
+
+    def GetWindowTextW(self, hwnd, buffer, count):
+        text = self._window_text(hwnd)[:count - 1]
+        buffer.value = text
+        return len(text)
+
+    def GetClassNameW(self, hwnd, buffer, count):
+        win = self.desktop.windows.get(hwnd)
+        name = win.class_name[:count - 1] if win is not None else ''
+        buffer.value = name
+        return len(name)
+
+    def GetWindowThreadProcessId(self, hwnd, pid):
+        win = self.desktop.windows.get(hwnd)
+        self._out(pid).value = win.pid if win is not None else 0
+        return 1 if win is not None else 0
+
+    def GetDlgCtrlID(self, hwnd):
+        win = self.desktop.windows.get(hwnd)
+        return win.control_id if win is not None else 0
+
+    def GetWindowLongW(self, hwnd, index):
+        win = self.desktop.windows.get(hwnd)
+        return win.style if win is not None else 0
+
+    def GetAncestor(self, hwnd, flags):
+        # 只实现 GA_ROOT；和真实 DLL 一样，已销毁的窗口返回 NULL
+        return self.desktop.root_of(hwnd) or 0
+
+    # ---------- WinEvent ----------
+
+    def SetWinEventHook(self, first, last, module, proc, pid, thread, flags):
+        if not self.desktop.start_events():
+            return 0
+        self._hooks.append((first, last, proc))
+        return len(self._hooks)
+
+    def UnhookWinEvent(self, hook):
+        return 1
+
+    def PeekMessageW(self, msg, hwnd, first, last, remove):
+        # 和 WINEVENT_OUTOFCONTEXT 一样在等待线程的消息循环里调用回调：
+        # FakeDesktop 送出销毁事件时窗口已经不存在，回调中的 GetAncestor 返回 NULL
+        for event, target in self.desktop.wait_events(0):
+            for first, last, proc in self._hooks:
+                if first <= event <= last:
+                    proc(None, event, target, 0, 0, 0, 0)
+        return 0
+
+    def MsgWaitForMultipleObjects(self, count, handles, wait_all, milliseconds, mask):
+        time.sleep(min(milliseconds, 10) / 1000)
+        return 0
+
+    def PostThreadMessageW(self, thread_id, msg, wparam, lparam):
+        return 1
+
+    def IsWindowVisible(self, hwnd):
+        return self.desktop.is_window_visible(hwnd)
+
+    def IsWindow(self, hwnd):
+        return self.desktop.is_window(hwnd)
+
+    def IsWindowEnabled(self, hwnd):
+        return self.desktop.is_window_enabled(hwnd)
+
+    def SendMessageTimeoutW(self, hwnd, msg, wparam, lparam, flags, timeout, result):
+        if hwnd not in self.desktop.windows:
+            return 0
+        text = self._text(hwnd)
+        if msg == self.WM_GETTEXTLENGTH:
+            value = len(text)
+        elif msg == self.WM_GETTEXT:
+            text = text[:wparam - 1]
+            # lparam 可能是地址、c_void_p 或者缓冲区本身（argtypes 为 c_void_p 时三种都可以传入）
+            if isinstance(lparam, ctypes.c_void_p):
+                address = lparam.value
+            elif isinstance(lparam, int):
+                address = lparam
+            else:
+                address = ctypes.addressof(lparam)
+            (ctypes.c_wchar * wparam).from_address(address).value = text
+            value = len(text)
+        else:
+            value = 0
+        self._out(result).value = value
+        return 1
@@ -0,0 +1,1175 @@
+#!/usr/bin/env python3
+"""
+窗口系统后端
+弹窗检测用到的 Windows API 收敛在 WindowBackend 这个小接口里：
+  - Win32Backend:   真实的 user32 实现（WinEvent 事件 + EnumWindows）
+  - FakeDesktop:    内存中的假桌面，Linux 下测试和测量检测延迟用
+  - CachingBackend: 包装任意后端，按 hwnd 缓存窗口属性（类名、进程等），跨扫描复用
+"""
+
+import os
+import sys
+import time
+import threading
+import collections
+import ctypes
+from ctypes import wintypes
+
+import win32_api
+
+# WinEvent 常量
+EVENT_OBJECT_CREATE = 0x8000
+EVENT_OBJECT_DESTROY = 0x8001
+EVENT_OBJECT_SHOW = 0x8002
+EVENT_OBJECT_HIDE = 0x8003
+EVENT_OBJECT_NAMECHANGE = 0x800C
+OBJID_WINDOW = 0
+CHILDID_SELF = 0
+WINEVENT_OUTOFCONTEXT = 0x0000
+WINEVENT_SKIPOWNPROCESS = 0x0002
+
+# 消息常量
+BM_GETCHECK = 0x00F0
+BM_CLICK = 0x00F5
+BST_CHECKED = 0x0001
+BN_CLICKED = 0
+WM_COMMAND = 0x0111
+WM_GETTEXT = 0x000D
+WM_GETTEXTLENGTH = 0x000E
+GWL_STYLE = -16
+BS_TYPEMASK = 0x000F
+BS_RADIOBUTTON = 0x0004
+BS_AUTORADIOBUTTON = 0x0009
+GW_OWNER = 4
+GA_ROOT = 2
+PM_REMOVE = 0x0001
+WM_NULL = 0x0000
+QS_ALLINPUT = 0x04FF
+WAIT_TIMEOUT = 0x0102
+SMTO_BLOCK = 0x0001
+SMTO_ABORTIFHUNG = 0x0002
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+# 未指定超时时，单次 WM_GETTEXT 最多等待的秒数
+TEXT_TIMEOUT = 0.5
+
+# BM_CLICK / BM_GETCHECK 最多等待的秒数
+CLICK_TIMEOUT = 1.0
+
+class WindowBackend:
+    """窗口系统后端接口"""
+
+    # start_events 之后是否会送出文本变化事件（EVENT_OBJECT_NAMECHANGE）
+    text_events = False
+
+    def enum_windows(self):
+        """所有顶层窗口的 hwnd 列表"""
+        raise NotImplementedError
+
+    def enum_child_windows(self, hwnd):
+        """所有子窗口的 hwnd 列表"""
+        raise NotImplementedError
+
+    def get_window_text(self, hwnd):
+        raise NotImplementedError
+
+    def get_control_text(self, hwnd, timeout=None):
+        """
+        控件文本（GetWindowText 取不到时用 WM_GETTEXT）
+        目标窗口在 timeout 秒内没有响应时返回 None（timeout 为 None 时使用 TEXT_TIMEOUT）
+        """
+        raise NotImplementedError
+
+    def get_class_name(self, hwnd):
+        raise NotImplementedError
+
+    def get_window_pid(self, hwnd):
+        raise NotImplementedError
+
+    def get_window_owner(self, hwnd):
+        """所有者窗口（没有返回 0）"""
+        raise NotImplementedError
+
+    def get_process_image(self, pid):
+        """进程的映像文件名（如 CorelDRW.exe），取不到返回空字符串"""
+        raise NotImplementedError
+
+    def get_control_id(self, hwnd):
+        raise NotImplementedError
+
+    def get_window_style(self, hwnd):
+        raise NotImplementedError
+
+    def is_window_visible(self, hwnd):
+        raise NotImplementedError
+
+    def is_window(self, hwnd):
+        raise NotImplementedError
+
+    def is_window_enabled(self, hwnd):
+        raise NotImplementedError
+
+    def is_checked(self, hwnd):
+        """单选按钮/复选框是否已选中（BM_GETCHECK）"""
+        raise NotImplementedError
+
+    def click(self, hwnd):
+        """向按钮发送 BM_CLICK（最多等待 CLICK_TIMEOUT 秒）"""
+        raise NotImplementedError
+
+    def post_click(self, hwnd):
+        """向按钮投递 BM_CLICK（不等待处理）"""
+        raise NotImplementedError
+
+    def post_command(self, dialog, control_id, button):
+        """向对话框投递 WM_COMMAND/BN_CLICKED（与按下快捷键/助记符的效果相同）"""
+        raise NotImplementedError
+
+    def start_events(self):
+        """开始接收窗口创建/销毁/显示/隐藏事件，不支持时返回 False"""
+        return False
+
+    def wait_events(self, timeout):
+        """等待窗口事件，返回 [(event, hwnd), ...]，超时或被 wake 唤醒返回空列表"""
+        time.sleep(max(0.0, timeout))
+        return []
+
+    def wake(self):
+        """从其它线程唤醒正在 wait_events 的线程"""
+        pass
+
+    def stop_events(self):
+        pass
+
+
+class Win32Backend(WindowBackend):
+    """
+    基于 user32 的真实后端（函数原型见 win32_api）
+    user32 / kernel32 可以替换为 win32_api.FakeUser32 等替身（Linux 下测量调用开销）
+    """
+
+    def __init__(self, user32=None, kernel32=None):
+        self.user32 = user32 or win32_api.user32
+        self.kernel32 = kernel32 or win32_api.kernel32
+        # 每个线程复用的缓冲区
+        self._buffers = win32_api.Buffers()
+        self._events = collections.deque()
+        self._hook = None
+        self._name_hook = None
+        self._event_proc = None
+        self._thread_id = 0
+        self._woken = False
+
+    def enum_windows(self):
+        return win32_api.enum_windows(self.user32)
+
+    def enum_child_windows(self, hwnd):
+        return win32_api.enum_child_windows(self.user32, hwnd)
+
+    def get_window_text(self, hwnd):
+        # 直接读入线程的缓冲区，只有可能被截断时才查询长度后重读
+        buffers = self._buffers
+        count = self.user32.GetWindowTextW(hwnd, buffers.text, buffers.text_length)
+        if count >= buffers.text_length - 1:
+            buffer = buffers.text_buffer(self.user32.GetWindowTextLengthW(hwnd) + 1)
+            count = self.user32.GetWindowTextW(hwnd, buffer, buffers.text_length)
+        return buffers.text.value if count > 0 else ''
+
+    def get_control_text(self, hwnd, timeout=None):
+        # 先尝试 GetWindowText（对其它进程的窗口不发消息，不会被卡住）
+        text = self.get_window_text(hwnd)
+        if text:
+            return text
+
+        # 再尝试 WM_GETTEXT（对静态控件更有效）
+        # 目标进程忙（例如 CorelDRAW 正在解析大文件）时不能无限等待
+        # 直接读入线程的缓冲区，填满时才用 WM_GETTEXTLENGTH 查询长度后重读（省一次跨进程消息）
+        deadline = time.monotonic() + (TEXT_TIMEOUT if timeout is None else timeout)
+        buffers = self._buffers
+        count = self._send_timeout(hwnd, WM_GETTEXT, buffers.text_length, buffers.text, deadline)
+        if count is None:
+            return None
+        if count >= buffers.text_length - 1:
+            length = self._send_timeout(hwnd, WM_GETTEXTLENGTH, 0, None, deadline)
+            if length is None:
+                return None
+            buffer = buffers.text_buffer(length + 1)
+            count = self._send_timeout(hwnd, WM_GETTEXT, buffers.text_length, buffer, deadline)
+            if count is None:
+                return None
+        return buffers.text.value if count > 0 else ""
+
+    def _send_timeout(self, hwnd, msg, wparam, lparam, deadline):
+        """SendMessageTimeout，超时或目标无响应返回 None"""
+        timeout_ms = int((deadline - time.monotonic()) * 1000)
+        if timeout_ms <= 0:
+            return None
+        buffers = self._buffers
+        if not self.user32.SendMessageTimeoutW(hwnd, msg, wparam, lparam,
+                                               SMTO_BLOCK | SMTO_ABORTIFHUNG, timeout_ms,
+                                               buffers.result_ref):
+            return None
+        return buffers.result.value
+
+    def get_class_name(self, hwnd):
+        buffers = self._buffers
+        self.user32.GetClassNameW(hwnd, buffers.class_name, win32_api.CLASS_NAME_LENGTH)
+        return buffers.class_name.value
+
+    def get_window_pid(self, hwnd):
+        buffers = self._buffers
+        buffers.dword.value = 0
+        self.user32.GetWindowThreadProcessId(hwnd, buffers.dword_ref)
+        return buffers.dword.value
+
+    def get_window_owner(self, hwnd):
+        return self.user32.GetWindow(hwnd, GW_OWNER) or 0
+
+    def get_process_image(self, pid):
+        kernel32 = self.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return ''
+        try:
+            size = wintypes.DWORD(260)
+            buffer = ctypes.create_unicode_buffer(size.value)
+            if not kernel32.QueryFullProcessImageNameW(handle, 0, buffer, ctypes.byref(size)):
+                return ''
+            return os.path.basename(buffer.value)
+        finally:
+            kernel32.CloseHandle(handle)
+
+    def get_control_id(self, hwnd):
+        return self.user32.GetDlgCtrlID(hwnd)
+
+    def get_window_style(self, hwnd):
+        return self.user32.GetWindowLongW(hwnd, GWL_STYLE) & 0xFFFFFFFF
+
+    def is_window_visible(self, hwnd):
+        return bool(self.user32.IsWindowVisible(hwnd))
+
+    def is_window(self, hwnd):
+        return bool(self.user32.IsWindow(hwnd))
+
+    def is_window_enabled(self, hwnd):
+        return bool(self.user32.IsWindowEnabled(hwnd))
+
+    def is_checked(self, hwnd):
+        state = self._send_timeout(hwnd, BM_GETCHECK, 0, None, time.monotonic() + CLICK_TIMEOUT)
+        return state == BST_CHECKED
+
+    def click(self, hwnd):
+        self._send_timeout(hwnd, BM_CLICK, 0, None, time.monotonic() + CLICK_TIMEOUT)
+
+    def post_click(self, hwnd):
+        self.user32.PostMessageW(hwnd, BM_CLICK, 0, 0)
+
+    def post_command(self, dialog, control_id, button):
+        wparam = (BN_CLICKED << 16) | (control_id & 0xFFFF)
+        self.user32.PostMessageW(dialog, WM_COMMAND, wparam, button)
+
+    # ---------- WinEvent ----------
+
+    def _on_event(self, hook, event, hwnd, id_object, id_child, thread_id, event_time):
+        # 只关心顶层窗口本身的事件，忽略控件和非窗口对象；文本变化报告为所在的顶层窗口
+        if id_object != OBJID_WINDOW or id_child != CHILDID_SELF or not hwnd:
+            return
+        root = self.user32.GetAncestor(hwnd, GA_ROOT)
+        if event == EVENT_OBJECT_NAMECHANGE:
+            if not root:
+                return
+            hwnd = root
+        elif root != hwnd:
+            # OUTOFCONTEXT 的事件送到时窗口可能已经销毁，GetAncestor 返回 NULL；
+            # 销毁/隐藏事件照样送出（已销毁的控件 hwnd 对使用方无害）
+            if root or (event != EVENT_OBJECT_DESTROY and event != EVENT_OBJECT_HIDE):
+                return
+        self._events.append((event, hwnd))
+
+    def start_events(self):
+        if self._hook:
+            return True
+        user32 = self.user32
+        # 回调对象必须一直持有，否则会被回收
+        self._event_proc = win32_api.WinEventProc(self._on_event)
+        self._hook = user32.SetWinEventHook(
+            EVENT_OBJECT_CREATE, EVENT_OBJECT_HIDE, None, self._event_proc,
+            0, 0, WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS
+        )
+        # 窗口/控件文本变化（未匹配的对话框内容变化后重新检查）；失败时只是退回按计划复查
+        self._name_hook = user32.SetWinEventHook(
+            EVENT_OBJECT_NAMECHANGE, EVENT_OBJECT_NAMECHANGE, None, self._event_proc,
+            0, 0, WINEVENT_OUTOFCONTEXT | WINEVENT_SKIPOWNPROCESS
+        )
+        self.text_events = bool(self._hook and self._name_hook)
+        # wake 向这个线程投递 WM_NULL，让 MsgWaitForMultipleObjects 返回
+        self._thread_id = self.kernel32.GetCurrentThreadId()
+        return bool(self._hook)
+
+    def wait_events(self, timeout):
+        # WINEVENT_OUTOFCONTEXT 的回调在本线程的消息循环里派发
+        user32 = self.user32
+        msg = wintypes.MSG()
+        msg_ref = ctypes.byref(msg)
+        deadline = time.monotonic() + max(0.0, timeout)
+        while True:
+            while user32.PeekMessageW(msg_ref, None, 0, 0, PM_REMOVE):
+                user32.TranslateMessage(msg_ref)
+                user32.DispatchMessageW(msg_ref)
+            if self._events or self._woken:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            user32.MsgWaitForMultipleObjects(0, None, False, int(remaining * 1000) + 1, QS_ALLINPUT)
+
+        self._woken = False
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+    def wake(self):
+        if self._thread_id:
+            self._woken = True
+            self.user32.PostThreadMessageW(self._thread_id, WM_NULL, 0, 0)
+
+    def stop_events(self):
+        if self._hook:
+            self.user32.UnhookWinEvent(self._hook)
+            self._hook = None
+            if self._name_hook:
+                self.user32.UnhookWinEvent(self._name_hook)
+                self._name_hook = None
+            self._event_proc = None
+            self.text_events = False
+
+
+class FakeWindow:
+    """假桌面中的一个窗口/控件"""
+
+    def __init__(self, hwnd, class_name, text='', parent=None, pid=0,
+                 visible=True, control_id=0, style=0, owner=0):
+        self.hwnd = hwnd
+        self.class_name = class_name
+        self.text = text
+        self.parent = parent
+        self.pid = pid
+        self.visible = visible
+        self.control_id = control_id
+        self.style = style
+        self.owner = owner
+        self.children = []
+        self.on_click = None
+        self.checked = False
+        self.enabled = True
+        # 模拟 BM_CLICK 没有生效（前几次发送的点击被丢弃）
+        self.drop_clicks = 0
+        # 模拟目标线程忙：WM_GETTEXT 要过这么多秒才有响应
+        self.delay = 0.0
+        self.created_at = time.perf_counter()
+
+
+class FakeDesktop(WindowBackend):
+    """
+    内存中的假桌面
+    可以在任意线程里创建/销毁窗口，事件和 Win32Backend 一样通过 wait_events 送出
+    processes 是 pid -> 映像名，默认 pid 1 是 CorelDRAW
+    """
+
+    def __init__(self, events=True):
+        self.windows = {}
+        self.processes = {1: 'CorelDRW.exe'}
+        self.top_level = []
+        self.clicks = []
+        self._events_enabled = events
+        self._events_started = False
+        self._events = collections.deque()
+        self._cond = threading.Condition()
+        self._woken = False
+        self._next_hwnd = 0x10000
+
+    # ---------- 构造桌面 ----------
+
+    def create_window(self, title, class_name='#32770', pid=1, visible=True, children=(), owner=0, hwnd=None):
+        """
+        创建顶层窗口
+        children: [(class_name, text), ...] 或 [(class_name, text, control_id), ...]
+        owner:    所有者窗口（对话框通常属于程序主窗口）
+        hwnd:     使用已销毁窗口的 hwnd（模拟系统复用 hwnd 值）
+        """
+        with self._cond:
+            win = self._new_window(class_name, title, None, pid, visible, hwnd)
+            win.owner = owner
+            for child in children:
+                self.add_child(win.hwnd, *child)
+            self.top_level.append(win.hwnd)
+            self._post(EVENT_OBJECT_CREATE, win.hwnd)
+            if visible:
+                self._post(EVENT_OBJECT_SHOW, win.hwnd)
+            return win.hwnd
+
+    def add_child(self, parent, class_name, text='', control_id=0, style=0):
+        with self._cond:
+            parent_win = self.windows[parent]
+            child = self._new_window(class_name, text, parent, parent_win.pid, True)
+            child.control_id = control_id
+            child.style = style
+            parent_win.children.append(child.hwnd)
+            return child.hwnd
+
+    def destroy_window(self, hwnd):
+        with self._cond:
+            win = self.windows.pop(hwnd, None)
+            if win is None:
+                return
+            for child in list(win.children):
+                self.destroy_window(child)
+            if hwnd in self.top_level:
+                self.top_level.remove(hwnd)
+                self._post(EVENT_OBJECT_DESTROY, hwnd)
+            elif win.parent in self.windows:
+                self.windows[win.parent].children.remove(hwnd)
+
+    def show_window(self, hwnd):
+        with self._cond:
+            self.windows[hwnd].visible = True
+            if hwnd in self.top_level:
+                self._post(EVENT_OBJECT_SHOW, hwnd)
+
+    def hide_window(self, hwnd):
+        with self._cond:
+            self.windows[hwnd].visible = False
+            if hwnd in self.top_level:
+                self._post(EVENT_OBJECT_HIDE, hwnd)
+
+    def set_text(self, hwnd, text):
+        """修改窗口/控件文本（模拟内容逐步出现），和 Windows 一样送出所在顶层窗口的文本变化事件"""
+        with self._cond:
+            self.windows[hwnd].text = text
+            self._post(EVENT_OBJECT_NAMECHANGE, self.root_of(hwnd))
+
+    def set_delay(self, hwnd, delay):
+        """让窗口及其所有子控件的 WM_GETTEXT 延迟 delay 秒响应（模拟程序忙/卡死）"""
+        with self._cond:
+            self.windows[hwnd].delay = delay
+            for child in self.enum_child_windows(hwnd):
+                self.windows[child].delay = delay
+
+    def root_of(self, hwnd):
+        win = self.windows.get(hwnd)
+        while win is not None and win.parent is not None:
+            win = self.windows.get(win.parent)
+        return win.hwnd if win is not None else None
+
+    def _new_window(self, class_name, text, parent, pid, visible, hwnd=None):
+        if hwnd is None or hwnd in self.windows:
+            self._next_hwnd += 4
+            hwnd = self._next_hwnd
+        win = FakeWindow(hwnd, class_name, text, parent, pid, visible)
+        self.windows[win.hwnd] = win
+        return win
+
+    def _post(self, event, hwnd):
+        if self._events_enabled and self._events_started:
+            self._events.append((event, hwnd))
+            self._cond.notify_all()
+
+    # ---------- WindowBackend ----------
+
+    def enum_windows(self):
+        with self._cond:
+            return list(self.top_level)
+
+    def enum_child_windows(self, hwnd):
+        # 和 EnumChildWindows 一样递归列出所有后代
+        with self._cond:
+            result = []
+            win = self.windows.get(hwnd)
+            stack = list(reversed(win.children)) if win else []
+            while stack:
+                child = stack.pop()
+                result.append(child)
+                stack.extend(reversed(self.windows[child].children))
+            return result
+
+    def get_window_text(self, hwnd):
+        win = self.windows.get(hwnd)
+        return win.text if win else ''
+
+    def get_control_text(self, hwnd, timeout=None):
+        win = self.windows.get(hwnd)
+        if win is None:
+            return ''
+        if win.delay:
+            if timeout is None:
+                timeout = TEXT_TIMEOUT
+            if win.delay > timeout:
+                time.sleep(timeout)
+                return None
+            time.sleep(win.delay)
+        return win.text
+
+    def get_class_name(self, hwnd):
+        win = self.windows.get(hwnd)
+        return win.class_name if win else ''
+
+    def get_window_pid(self, hwnd):
+        win = self.windows.get(hwnd)
+        return win.pid if win else 0
+
+    def get_window_owner(self, hwnd):
+        win = self.windows.get(hwnd)
+        return win.owner if win and win.owner in self.windows else 0
+
+    def get_process_image(self, pid):
+        return self.processes.get(pid, '')
+
+    def get_control_id(self, hwnd):
+        win = self.windows.get(hwnd)
+        return win.control_id if win else 0
+
+    def get_window_style(self, hwnd):
+        win = self.windows.get(hwnd)
+        return win.style if win else 0
+
+    def is_window_visible(self, hwnd):
+        win = self.windows.get(hwnd)
+        return bool(win and win.visible)
+
+    def is_window(self, hwnd):
+        return hwnd in self.windows
+
+    def is_window_enabled(self, hwnd):
+        win = self.windows.get(hwnd)
+        return bool(win and win.enabled)
+
+    def is_checked(self, hwnd):
+        win = self.windows.get(hwnd)
+        return bool(win and win.checked)
+
+    def click(self, hwnd):
+        win = self.windows.get(hwnd)
+        if win is None:
+            return
+        self.clicks.append((hwnd, win.text))
+        if win.drop_clicks:
+            win.drop_clicks -= 1
+            return
+        self._activate(win)
+
+    def post_click(self, hwnd):
+        win = self.windows.get(hwnd)
+        if win is not None:
+            self.clicks.append((hwnd, win.text))
+            self._activate(win)
+
+    def post_command(self, dialog, control_id, button):
+        win = self.windows.get(button)
+        if win is not None and self.root_of(button) == dialog:
+            self.clicks.append((button, win.text))
+            self._activate(win)
+
+    def _activate(self, win):
+        if not win.enabled:
+            return
+        if win.on_click:
+            win.on_click(self, win.hwnd)
+        elif (win.style & BS_TYPEMASK) in (BS_RADIOBUTTON, BS_AUTORADIOBUTTON):
+            # 单选按钮：选中自己，取消同一对话框中的其它单选按钮
+            with self._cond:
+                parent = self.windows.get(win.parent)
+                for sibling in (parent.children if parent else ()):
+                    other = self.windows[sibling]
+                    if (other.style & BS_TYPEMASK) in (BS_RADIOBUTTON, BS_AUTORADIOBUTTON):
+                        other.checked = False
+                win.checked = True
+        elif 'Button' in win.class_name:
+            # 默认行为：点击按钮关闭所在对话框
+            self.destroy_window(self.root_of(win.hwnd))
+
+    def start_events(self):
+        self._events_started = self._events_enabled
+        self.text_events = self._events_enabled
+        return self._events_enabled
+
+    def wait_events(self, timeout):
+        with self._cond:
+            if not self._events and not self._woken:
+                self._cond.wait(max(0.0, timeout))
+            self._woken = False
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+    def wake(self):
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+    def stop_events(self):
+        self._events_started = False
+        self.text_events = False
+
+
+class CountingBackend(WindowBackend):
+    """包装任意后端，统计每个方法的调用次数（用于衡量每个弹窗的跨进程调用量）"""
+
+    COUNTED = (
+        'enum_windows', 'enum_child_windows', 'get_window_text', 'get_control_text',
+        'get_class_name', 'get_window_pid', 'get_window_owner', 'get_process_image',
+        'get_control_id', 'get_window_style', 'is_window_visible', 'is_window',
+        'is_window_enabled', 'is_checked', 'click', 'post_click', 'post_command',
+    )
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.calls = collections.Counter()
+
+    def total(self):
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls.clear()
+
+    @property
+    def text_events(self):
+        return self.inner.text_events
+
+    def start_events(self):
+        return self.inner.start_events()
+
+    def wait_events(self, timeout):
+        return self.inner.wait_events(timeout)
+
+    def wake(self):
+        self.inner.wake()
+
+    def stop_events(self):
+        self.inner.stop_events()
+
+
+def _counted(name):
+    def method(self, *args):
+        self.calls[name] += 1
+        return getattr(self.inner, name)(*args)
+    method.__name__ = name
+    return method
+
+
+for _name in CountingBackend.COUNTED:
+    setattr(CountingBackend, _name, _counted(_name))
+
+
+class WindowAttributes:
+    """一个窗口的缓存属性（None 表示还没有读取）"""
+
+    __slots__ = ('class_name', 'pid', 'control_id', 'title', 'visible', 'owner', 'style')
+
+    def __init__(self):
+        self.class_name = None
+        self.pid = None
+        self.control_id = None
+        self.title = None
+        self.visible = None
+        self.owner = None
+        self.style = None
+
+
+class CachingBackend(WindowBackend):
+    """
+    包装任意后端，按 hwnd 缓存窗口属性，减少每轮全量扫描和每次遍历子控件的调用：
+      - 类名、所属进程、控件 ID 在窗口的生命周期内不变，读取一次后一直使用
+      - 顶层窗口的可见性和标题在事件驱动时使用缓存，由显示/隐藏/文本变化事件更新；
+        没有事件时（轮询模式）每次重新读取
+      - 所有者、样式每次重新读取，只记录最近一次的值
+    窗口销毁、同一 hwnd 上创建了新窗口（hwnd 被复用）、或者全量枚举中不再出现时丢弃它的缓存
+    （子控件的缓存随所属顶层窗口一起丢弃）
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._events = False
+        self._top_level = frozenset()
+        # 顶层窗口 -> 最近一次枚举到的子控件
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (f"窗口属性缓存: {len(self.entries)} 个窗口, 命中 {self.hits} 次, 读取 {self.misses} 次 "
+                f"(命中率 {rate:.1f}%), 失效 {self.invalidations} 次")
+
+    def _entry(self, hwnd):
+        entry = self.entries.get(hwnd)
+        if entry is None:
+            entry = self.entries.setdefault(hwnd, WindowAttributes())
+        return entry
+
+    def invalidate(self, hwnd):
+        """丢弃窗口（及其子控件）的缓存"""
+        with self._lock:
+            if self.entries.pop(hwnd, None) is not None:
+                self.invalidations += 1
+            for child in self._children.pop(hwnd, ()):
+                self.entries.pop(child, None)
+
+    def _trusted(self, hwnd):
+        # 事件只报告顶层窗口的变化
+        return self._events and hwnd in self._top_level
+
+    # ---------- 枚举（同时检查缓存中的窗口是否还在） ----------
+
+    def enum_windows(self):
+        windows = self.inner.enum_windows()
+        top_level = frozenset(windows)
+        with self._lock:
+            for hwnd in [h for h in self._children if h not in top_level]:
+                del self._children[hwnd]
+            alive = top_level.union(*self._children.values())
+            # 处理线程可能同时在添加条目，先复制一份键
+            dead = [h for h in list(self.entries) if h not in alive]
+            for hwnd in dead:
+                self.entries.pop(hwnd, None)
+            self.invalidations += len(dead)
+            self._top_level = top_level
+        return windows
+
+    def enum_child_windows(self, hwnd):
+        children = self.inner.enum_child_windows(hwnd)
+        current = frozenset(children)
+        with self._lock:
+            for child in self._children.get(hwnd, frozenset()) - current:
+                self.entries.pop(child, None)
+            self._children[hwnd] = current
+        return children
+
+    # ---------- 不变的属性 ----------
+
+    def get_class_name(self, hwnd):
+        entry = self._entry(hwnd)
+        if entry.class_name is not None:
+            self.hits += 1
+            return entry.class_name
+        self.misses += 1
+        name = self.inner.get_class_name(hwnd)
+        # 取不到（窗口已关闭）时不缓存
+        if name:
+            entry.class_name = name
+        return name
+
+    def get_window_pid(self, hwnd):
+        entry = self._entry(hwnd)
+        if entry.pid is not None:
+            self.hits += 1
+            return entry.pid
+        self.misses += 1
+        pid = self.inner.get_window_pid(hwnd)
+        if pid:
+            entry.pid = pid
+        return pid
+
+    def get_control_id(self, hwnd):
+        entry = self._entry(hwnd)
+        if entry.control_id is not None:
+            self.hits += 1
+            return entry.control_id
+        self.misses += 1
+        entry.control_id = control_id = self.inner.get_control_id(hwnd)
+        return control_id
+
+    # ---------- 事件驱动时缓存的属性 ----------
+
+    def get_window_text(self, hwnd):
+        entry = self._entry(hwnd)
+        if entry.title is not None and self.inner.text_events and self._trusted(hwnd):
+            self.hits += 1
+            return entry.title
+        self.misses += 1
+        entry.title = title = self.inner.get_window_text(hwnd)
+        return title
+
+    def is_window_visible(self, hwnd):
+        entry = self._entry(hwnd)
+        if entry.visible is not None and self._trusted(hwnd):
+            self.hits += 1
+            return entry.visible
+        self.misses += 1
+        entry.visible = visible = self.inner.is_window_visible(hwnd)
+        return visible
+
+    # ---------- 每次读取、只记录最近一次的值 ----------
+
+    def get_window_owner(self, hwnd):
+        owner = self.inner.get_window_owner(hwnd)
+        self._entry(hwnd).owner = owner
+        return owner
+
+    def get_window_style(self, hwnd):
+        style = self.inner.get_window_style(hwnd)
+        self._entry(hwnd).style = style
+        return style
+
+    def is_window(self, hwnd):
+        if self.inner.is_window(hwnd):
+            return True
+        if hwnd in self.entries:
+            self.invalidate(hwnd)
+        return False
+
+    def get_control_text(self, hwnd, timeout=None):
+        return self.inner.get_control_text(hwnd, timeout)
+
+    def get_process_image(self, pid):
+        return self.inner.get_process_image(pid)
+
+    def is_window_enabled(self, hwnd):
+        return self.inner.is_window_enabled(hwnd)
+
+    def is_checked(self, hwnd):
+        return self.inner.is_checked(hwnd)
+
+    def click(self, hwnd):
+        self.inner.click(hwnd)
+
+    def post_click(self, hwnd):
+        self.inner.post_click(hwnd)
+
+    def post_command(self, dialog, control_id, button):
+        self.inner.post_command(dialog, control_id, button)
+
+    # ---------- 事件 ----------
+
+    @property
+    def text_events(self):
+        return self.inner.text_events
+
+    def start_events(self):
+        self._events = self.inner.start_events()
+        return self._events
+
+    def wait_events(self, timeout):
+        events = self.inner.wait_events(timeout)
+        for event, hwnd in events:
+            if event == EVENT_OBJECT_CREATE or event == EVENT_OBJECT_DESTROY:
+                # 新窗口可能复用了已销毁窗口的 hwnd
+                self.invalidate(hwnd)
+            elif event == EVENT_OBJECT_SHOW or event == EVENT_OBJECT_HIDE:
+                entry = self.entries.get(hwnd)
+                if entry is not None:
+                    entry.visible = event == EVENT_OBJECT_SHOW
+            elif event == EVENT_OBJECT_NAMECHANGE:
+                entry = self.entries.get(hwnd)
+                if entry is not None:
+                    entry.title = None
+        return events
+
+    def wake(self):
+        self.inner.wake()
+
+    def stop_events(self):
+        self._events = False
+        self.inner.stop_events()
+
+
+class TextBudget:
+    """
+    每轮扫描读取控件文本的时间预算
+    单次读取最多等待 call_timeout 秒；一轮扫描中读取文本累计耗时超过 scan_budget 秒后，
+    本轮剩余的读取直接放弃（返回 None），对应的对话框放进重试队列
+    每个线程各自计算本轮预算（检测线程和处理对话框的工作线程互不占用），计数是全部线程的合计
+    """
+
+    def __init__(self, call_timeout=0.1, scan_budget=0.25):
+        self.call_timeout = call_timeout
+        self.scan_budget = scan_budget
+        self.scans = 0
+        self.calls = 0
+        self.budget_hits = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._scan = threading.local()
+
+    def start(self):
+        """当前线程开始新一轮扫描"""
+        with self._lock:
+            self.scans += 1
+        self._scan.spent = 0.0
+        self._scan.hit = False
+
+    def get_text(self, backend, hwnd):
+        """读取控件文本，目标无响应或本轮预算用完时返回 None"""
+        scan = self._scan
+        spent = getattr(scan, 'spent', 0.0)
+        remaining = self.scan_budget - spent
+        if remaining <= 0:
+            with self._lock:
+                if not getattr(scan, 'hit', False):
+                    scan.hit = True
+                    self.budget_hits += 1
+                self.skipped += 1
+            return None
+        start = time.monotonic()
+        text = backend.get_control_text(hwnd, min(self.call_timeout, remaining))
+        scan.spent = spent + time.monotonic() - start
+        with self._lock:
+            self.calls += 1
+            if text is None:
+                self.timeouts += 1
+        return text
+
+    def hit_rate(self):
+        return self.budget_hits / self.scans if self.scans else 0.0
+
+    def stats(self):
+        return (f"文本读取: {self.scans} 轮, 超时 {self.timeouts} 次, "
+                f"预算用尽 {self.budget_hits} 轮 ({self.hit_rate():.0%}), 放弃 {self.skipped} 次")
+
+
+class AdaptiveInterval:
+    """扫描间隔：有活动时回到 minimum，空闲时每次乘以 factor，直到 maximum"""
+
+    def __init__(self, minimum, maximum, factor=2.0):
+        self.minimum = min(minimum, maximum)
+        self.maximum = maximum
+        self.factor = factor
+        self.current = self.minimum
+
+    def activity(self):
+        self.current = self.minimum
+
+    def next(self):
+        """本次使用的间隔（并为下一次退避）"""
+        value = self.current
+        self.current = min(self.current * self.factor, self.maximum)
+        return value
+
+
+class StabilityTracker:
+    """
+    判断对话框内容是否已经稳定
+    同一个签名（快照内容、Hook 序号等）保持 settle 秒不变即视为稳定；
+    内容一直在变的对话框最多等待 max_wait 秒
+    """
+
+    def __init__(self, settle=0.1, max_wait=1.0):
+        self.settle = settle
+        self.max_wait = max_wait
+        self._seen = {}
+
+    def observe(self, hwnd, signature, now=None):
+        """返回 0 表示已稳定，否则返回建议多少秒后再检查"""
+        if now is None:
+            now = time.monotonic()
+        entry = self._seen.get(hwnd)
+        if entry is None:
+            self._seen[hwnd] = (signature, now, now)
+            return self.settle
+        last, since, first = entry
+        if signature != last:
+            if now - first >= self.max_wait:
+                del self._seen[hwnd]
+                return 0.0
+            self._seen[hwnd] = (signature, now, first)
+            return self.settle
+        if now - since >= self.settle:
+            del self._seen[hwnd]
+            return 0.0
+        return self.settle - (now - since)
+
+    def forget(self, hwnd):
+        self._seen.pop(hwnd, None)
+
+    def prune(self, is_alive):
+        # 工作线程可能同时在记录其它窗口，先复制键
+        for hwnd in [h for h in list(self._seen) if not is_alive(h)]:
+            self._seen.pop(hwnd, None)
+
+
+class DialogWatcher:
+    """
+    事件驱动的对话框检测
+    窗口创建/显示事件到达时只检查该窗口；全量 EnumWindows 只作为慢速兜底
+    全量扫描的间隔是自适应的：发现对话框后缩短到 burst_interval，
+    空闲时指数退避到 safety_interval（事件驱动）或 poll_interval（轮询）
+    未能处理的对话框按 retry_interval 重新检查，无响应的对话框重试间隔逐次加倍；
+    hold 推迟的对话框（未匹配任何规则）在到期前不会被全量扫描重新发现，文本变化事件或 recheck 让它立即重新检查
+    传入 budget（TextBudget）时，每轮返回对话框之前开始新一轮文本读取预算
+    传入 metrics（metrics.Registry）时记录全量扫描的耗时和枚举到的窗口数
+    defer / request_sweep 可以在其它线程中调用，会唤醒正在等待的 next_dialogs
+    """
+
+    def __init__(self, backend, is_dialog, safety_interval=5.0,
+                 poll_interval=1.0, retry_interval=0.5, budget=None, burst_interval=0.1,
+                 metrics=None):
+        self.backend = backend
+        self.is_dialog = is_dialog
+        self.safety_interval = safety_interval
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.budget = budget
+        self.metrics = metrics
+        self.event_driven = backend.start_events()
+        if self.event_driven:
+            # 事件驱动时全量扫描只是兜底，繁忙时也不必太频繁
+            self.schedule = AdaptiveInterval(max(burst_interval, 1.0), safety_interval)
+        else:
+            self.schedule = AdaptiveInterval(burst_interval, poll_interval)
+        self.swept = False
+        self._next_sweep = 0.0
+        self._pending = {}
+        self._backoff = {}
+        self._held = set()
+        self._lock = threading.Lock()
+        # 轮询模式下不调用 wait_events（只是 sleep），用 Event 接收 defer 的唤醒
+        self._wakeup = threading.Event()
+        self._owner = threading.current_thread()
+
+    def sweep(self):
+        """全量扫描所有顶层窗口"""
+        start = time.perf_counter()
+        windows = self.backend.enum_windows()
+        with self._lock:
+            if self._backoff or self._held:
+                alive = set(windows)
+                self._backoff = {h: d for h, d in self._backoff.items() if h in alive}
+                self._held &= alive
+            pending = set(self._pending)
+        # 正在退避的无响应窗口和暂缓的未匹配窗口由重试队列负责，不占用本轮的文本读取预算
+        dialogs = [h for h in windows
+                   if h not in pending and self.backend.is_window_visible(h) and self.is_dialog(h)]
+        if self.metrics is not None:
+            self.metrics.observe('sweep_seconds', time.perf_counter() - start)
+            self.metrics.inc('windows_enumerated_total', len(windows))
+        return dialogs
+
+    def defer(self, hwnd, slow=False, delay=None, hold=False):
+        """
+        对话框这次没有处理掉，稍后再检查
+        slow 表示窗口没有响应，退避重试；delay 指定本次的等待时间（如等待内容稳定）；
+        hold 表示到期（或内容变化）之前全量扫描也不再返回它
+        """
+        with self._lock:
+            if hold:
+                self._held.add(hwnd)
+            else:
+                self._held.discard(hwnd)
+            if slow:
+                delay = min(self._backoff.get(hwnd, self.retry_interval / 2) * 2, self.safety_interval)
+                self._backoff[hwnd] = delay
+            else:
+                self._backoff.pop(hwnd, None)
+                if delay is None:
+                    delay = self.retry_interval
+            self._pending[hwnd] = time.monotonic() + delay
+        if threading.current_thread() is not self._owner:
+            self._wake()
+
+    def pending_dialogs(self):
+        """重试队列中的对话框（等待稍后再检查的 hwnd 集合）"""
+        with self._lock:
+            return set(self._pending)
+
+    def request_sweep(self):
+        """
+        尽快做一次全量扫描，暂缓的对话框也立即重新检查
+        （可以在其它线程中调用，例如控制接口恢复处理、替换规则时）
+        """
+        self._next_sweep = 0.0
+        self.recheck()
+
+    def recheck(self, hwnds=None):
+        """让暂缓的对话框（默认全部）立即重新检查"""
+        with self._lock:
+            now = time.monotonic()
+            for hwnd in self._held if hwnds is None else self._held.intersection(hwnds):
+                self._pending[hwnd] = now
+        self._wake()
+
+    def _wake(self):
+        if self.event_driven:
+            self.backend.wake()
+        else:
+            self._wakeup.set()
+
+    def _start_scan(self):
+        if self.budget is not None:
+            self.budget.start()
+
+    def _activity(self, now):
+        """发现了对话框：进入繁忙模式，尽快再做一次全量扫描"""
+        self.schedule.activity()
+        self._next_sweep = min(self._next_sweep, now + self.schedule.minimum)
+
+    def next_dialogs(self):
+        """阻塞到有需要检查的对话框（或兜底扫描到期），返回 hwnd 列表"""
+        while True:
+            now = time.monotonic()
+            if now >= self._next_sweep:
+                self.swept = True
+                with self._lock:
+                    self._pending = {h: t for h, t in self._pending.items()
+                                     if h in self._backoff or h in self._held}
+                self._start_scan()
+                dialogs = self.sweep()
+                if dialogs:
+                    self.schedule.activity()
+                self._next_sweep = now + self.schedule.next()
+                return dialogs
+
+            self.swept = False
+            with self._lock:
+                due = [h for h, t in self._pending.items() if t <= now]
+                for h in due:
+                    del self._pending[h]
+                    self._held.discard(h)
+                wake_at = min([self._next_sweep] + list(self._pending.values()))
+            if due:
+                self._start_scan()
+                return [h for h in due if self.backend.is_window(h)]
+
+            if self.event_driven:
+                events = self.backend.wait_events(wake_at - now)
+            else:
+                self._wakeup.wait(max(0.0, wake_at - now))
+                self._wakeup.clear()
+                events = []
+
+            if events:
+                self._start_scan()
+            dialogs = []
+            for event, hwnd in events:
+                if event == EVENT_OBJECT_DESTROY:
+                    with self._lock:
+                        self._pending.pop(hwnd, None)
+                        self._backoff.pop(hwnd, None)
+                        self._held.discard(hwnd)
+                elif event == EVENT_OBJECT_HIDE:
+                    # 隐藏的窗口不是要处理的对话框（CachingBackend 据此更新可见性）
+                    continue
+                elif event == EVENT_OBJECT_NAMECHANGE:
+                    # 只关心暂缓的对话框内容变化，其它窗口的标题变化忽略
+                    if hwnd in self._held:
+                        with self._lock:
+                            if hwnd in self._held:
+                                self._pending[hwnd] = time.monotonic()
+                elif hwnd not in dialogs and self.backend.is_window_visible(hwnd) and self.is_dialog(hwnd):
+                    dialogs.append(hwnd)
+            if dialogs:
+                self._activity(time.monotonic())
+                return dialogs
+
+    def close(self):
+        self.backend.stop_events()
+
+
+def default_backend():
+    """当前平台的默认后端，非 Windows 返回 None（需自行注入 FakeDesktop）"""
+    if sys.platform == 'win32':
+        return CachingBackend(Win32Backend())
+    return None